@@ -1,11 +1,22 @@
 CREATE TABLE IF NOT EXISTS translation_parameters (
     translation_parameters_id   INTEGER PRIMARY KEY,
+    translation_parameters_sha256 TEXT UNIQUE,
     translation_tool_name       TEXT,
     translation_tool_commit     TEXT,
     translation_model           TEXT,
     translation_config_sha256   TEXT,
-    translation_config          TEXT,
-    UNIQUE(translation_tool_name, translation_tool_commit, translation_model, translation_config_sha256, translation_config)
+    translation_config_fingerprint TEXT,
+    translation_language        TEXT NOT NULL DEFAULT '',
+    FOREIGN KEY (translation_config_sha256) REFERENCES translation_config(translation_config_sha256)
+);
+
+CREATE INDEX IF NOT EXISTS idx_translation_parameters_fingerprint ON translation_parameters (translation_config_fingerprint);
+
+
+
+CREATE TABLE IF NOT EXISTS translation_config (
+    translation_config_sha256   TEXT PRIMARY KEY,
+    translation_config          TEXT
 );
 
 
@@ -16,7 +27,108 @@ CREATE TABLE IF NOT EXISTS message_translation (
     message_id                  INTEGER,
     translation_text            TEXT,
     translation_timestamp       TIMESTAMPTZ(0),
+    source_edit_date            TIMESTAMPTZ(0),
+    source_sha256               TEXT,
+    UNIQUE(message_id, translation_parameters_id),
+    FOREIGN KEY (translation_parameters_id) REFERENCES translation_parameters(translation_parameters_id),
+    FOREIGN KEY (message_id) REFERENCES messages(message_id)
+);
+
+DROP INDEX IF EXISTS idx_message_translation_parameters;
+CREATE INDEX IF NOT EXISTS idx_message_translation_sources ON message_translation (translation_parameters_id, message_id, source_edit_date);
+
+
+
+CREATE TABLE IF NOT EXISTS message_minhash (
+    message_id                  INTEGER PRIMARY KEY,
+    minhash_signature           BLOB,
+    FOREIGN KEY (message_id) REFERENCES messages(message_id)
+);
+
+
+
+CREATE TABLE IF NOT EXISTS message_minhash_band (
+    band                        INTEGER,
+    bucket                      INTEGER,
+    message_id                  INTEGER,
+    FOREIGN KEY (message_id) REFERENCES message_minhash(message_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_message_minhash_band_bucket ON message_minhash_band (band, bucket);
+CREATE INDEX IF NOT EXISTS idx_message_minhash_band_message ON message_minhash_band (message_id);
+
+
+
+CREATE TABLE IF NOT EXISTS segment_translation (
+    segment_translation_id      INTEGER PRIMARY KEY,
+    segment_sha256              TEXT,
+    translation_parameters_id   INTEGER,
+    translation_text            TEXT,
+    UNIQUE(segment_sha256, translation_parameters_id),
+    FOREIGN KEY (translation_parameters_id) REFERENCES translation_parameters(translation_parameters_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_message_translation_timestamp ON message_translation (translation_timestamp);
+
+
+
+CREATE TABLE IF NOT EXISTS translation_failure (
+    failure_id                  INTEGER PRIMARY KEY,
+    message_id                  INTEGER,
+    translation_parameters_id   INTEGER,
+    error_class                 TEXT,
+    error_message               TEXT,
+    attempt_count               INTEGER,
+    first_failure_timestamp     TIMESTAMPTZ(0),
+    last_failure_timestamp      TIMESTAMPTZ(0),
+    next_retry_timestamp        TIMESTAMPTZ(0),
     UNIQUE(message_id, translation_parameters_id),
     FOREIGN KEY (translation_parameters_id) REFERENCES translation_parameters(translation_parameters_id),
     FOREIGN KEY (message_id) REFERENCES messages(message_id)
 );
+
+CREATE INDEX IF NOT EXISTS idx_translation_failure_next_retry ON translation_failure (translation_parameters_id, next_retry_timestamp);
+
+
+
+CREATE TABLE IF NOT EXISTS translation_stats (
+    channel_id                  INTEGER,
+    translation_parameters_id   INTEGER,
+    translated_count            INTEGER DEFAULT 0,
+    failed_count                INTEGER DEFAULT 0,
+    skipped_count               INTEGER DEFAULT 0,
+    prompt_tokens               INTEGER DEFAULT 0,
+    completion_tokens           INTEGER DEFAULT 0,
+    cost                        REAL DEFAULT 0,
+    PRIMARY KEY (channel_id, translation_parameters_id),
+    FOREIGN KEY (translation_parameters_id) REFERENCES translation_parameters(translation_parameters_id)
+);
+
+
+
+CREATE TABLE IF NOT EXISTS channel_stats (
+    channel_id                  INTEGER PRIMARY KEY,
+    message_count               INTEGER DEFAULT 0,
+    last_message_id             INTEGER DEFAULT 0
+);
+
+
+
+CREATE TABLE IF NOT EXISTS request_latency (
+    request_latency_id          INTEGER PRIMARY KEY,
+    translation_model           TEXT,
+    prompt_tokens               INTEGER,
+    completion_tokens           INTEGER,
+    latency_seconds             REAL,
+    request_timestamp           TIMESTAMPTZ(0)
+);
+
+CREATE INDEX IF NOT EXISTS idx_request_latency_model ON request_latency (translation_model, request_latency_id);
+
+
+
+CREATE TABLE IF NOT EXISTS compression_dictionary (
+    dictionary_key              BLOB PRIMARY KEY,
+    dictionary                  BLOB,
+    dictionary_timestamp        TIMESTAMPTZ(0)
+);
@@ -7,45 +7,145 @@ using Large Language Models.
 # flake8: noqa: E501
 
 import argparse
+import asyncio
 import logging
 import os
+import sys
+import time
 import yaml
+from contextlib import contextmanager
 from dotenv import dotenv_values
-from openai import OpenAI
-import tiktoken
 from lib.utils import get_current_commit
 from lib.utils import get_file_sha256
 from lib.utils import get_file_content
 from lib.db_utils import get_db_connection
+from lib.db_utils import get_split_db_connection
 from lib.db_utils import create_tables_from_schema
 from lib.db_utils import has_channel_messages
+from lib.db_utils import check_channel_exists
 from lib.db_utils import insert_translation_parameters
+from lib.db_utils import get_translation_parameters_id
+from lib.db_utils import get_pending_channel_messages
 from lib.db_utils import get_channel_messages
 from lib.db_utils import exists_translation_for_message
 from lib.db_utils import upsert_message_translation
+from lib.db_utils import get_text_compressor
+from lib.db_utils import compress_translations
+from lib.fingerprint_utils import parse_personality
+from lib.fingerprint_utils import get_config_fingerprint
+from lib.fingerprint_utils import backfill_config_fingerprints
+from lib.dedup_utils import index_translated_messages
+from lib.dedup_utils import index_message_minhash
+from lib.dedup_utils import find_near_duplicate
+from lib.dedup_utils import build_translation_hint
+from lib.segment_utils import split_segments
+from lib.segment_utils import lookup_segment_translations
+from lib.segment_utils import translate_segments
+from lib.segment_utils import store_segment_translations
+from lib.client_utils import build_openai_client
+from lib.translator import request_translation
+from lib.translator import complete_translation
+from lib.translator import get_target_languages
+from lib.translator import request_languages_translation
+from lib.hedging import hedge_client
+from lib.concurrency import AIMDController
+from lib.concurrency import run_concurrently
+from lib.tokenizer import configure_tokenizer
+from lib.tokenizer import get_encoding
+from lib.tokenizer import get_tokenizer
+from lib.routing import ModelRouter
+from lib.token_budget import build_token_budget
+from lib.token_budget import get_translation_samples
+from lib.token_budget import learn_output_ratio
+from lib.planner import PlannedRequest
+from lib.planner import LatencyModel
+from lib.planner import get_latency_samples
+from lib.planner import plan_run
+from lib.failure_utils import DEFAULT_MAX_ATTEMPTS
+from lib.failure_utils import record_translation_failure
+from lib.failure_utils import clear_translation_failures
+from lib.failure_utils import get_failed_message_ids
+from lib.failure_utils import get_due_translation_failures
+from lib.failure_utils import requeue_null_translations
+from lib.stats_utils import get_cost
+from lib.stats_utils import RequestUsage
+from lib.stats_utils import record_request_latencies
+from lib.stats_utils import get_failure_stats
+from lib.stats_utils import get_message_channels
+from lib.stats_utils import increment_translation_stats
+from lib.stats_utils import has_translation_stats
+from lib.stats_utils import refresh_channel_stats
+from lib.stats_utils import rebuild_translation_stats
+from lib.stats_utils import get_translation_status
+from lib.edit_utils import record_translation_sources
+from lib.edit_utils import find_edited_translations
+from lib.batch_utils import INPUT_FORMATS
+from lib.batch_utils import read_records
+from lib.batch_utils import format_record
+from lib.batch_utils import translate_ordered
+from lib.server import TranslationService
+from lib.server import serve
+from lib.log_utils import TEXT_FORMAT
+from lib.log_utils import DEFAULT_LOG_FILE
+from lib.log_utils import parse_log_config
+from lib.log_utils import setup_logging
+from lib.log_utils import stop_logging
+from lib.tracing import enable_tracing
+from lib.tracing import span
+from lib.tracing import SamplingProfiler
+from lib.export_utils import export_translations
+from lib.export_utils import EXPORT_FORMATS
+from lib.search_utils import has_search_index
+from lib.search_utils import create_search_index
+from lib.search_utils import rebuild_search_index
+from lib.search_utils import search_translations
+from lib.shard_utils import resolve_shard_paths
+from lib.shard_utils import scan_shards
+from lib.shard_utils import group_pending_by_text
+from lib.shard_utils import write_shard_translations
 
 
-# Set up logging
+# Set up logging, the log file is set up in main(), from the YAML config once loaded
 logger = logging.getLogger('hermeneis')
 logger.setLevel(logging.DEBUG)
 
-# Create file handler for logging to a file
-file_handler = logging.FileHandler('logs/hermeneis.log')
-file_handler.setLevel(logging.DEBUG)  # Log all levels to the file
-
 # Create console handler for logging to the console
 console_handler = logging.StreamHandler()
 console_handler.setLevel(logging.ERROR)  # Log INFO and above to the console
 
-# Create formatter and add it to the handlers
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-file_handler.setFormatter(formatter)
+# Create formatter and add it to the handler
+formatter = logging.Formatter(TEXT_FORMAT)
 console_handler.setFormatter(formatter)
 
-# Add the handlers to the logger
-logger.addHandler(file_handler)
+# Add the handler to the logger
 logger.addHandler(console_handler)
 
+# Optional top level sections of the YAML config. They are only
+# added to the parsed config when present in the YAML file.
+OPTIONAL_CONFIG_SECTIONS = (
+    'near_duplicates',
+    'translation_memory',
+    'client',
+    'hedging',
+    'concurrency',
+    'retry',
+    'token_budget',
+    'serve',
+    'tokenizer',
+    'routing',
+    'pricing',
+    'plan',
+    'streaming',
+    'languages',
+    'compression',
+)
+
+# Number of translations written back to the shards at once
+SHARD_WRITE_BATCH = 100
+
+# Modes that do not send requests to the LLM
+OFFLINE_MODES = ('export', 'search', 'status', 'plan', 'compact')
+
 
 def set_key(env_path):
     "Reads the OpenAI API key and sets it"
@@ -66,17 +166,53 @@ def load_and_parse_config(yaml_config_path):
         logger.error("Error reading YAML file: %s", e)
         raise
 
-    config = {
-        'system': yaml_config['personality']['system'].strip(),
-        'user': yaml_config['personality']['user'],
-        'model': yaml_config['personality']['model'].strip(),
-        'temperature': float(yaml_config['personality']['temperature'].strip()),
-        'max_tokens': int(yaml_config['personality']['max_tokens'].strip()),
-        'log': yaml_config['personality']['log'].strip()
-    }
+    log_path, log_options = parse_log_config(yaml_config['personality']['log'])
+    config = parse_personality(yaml_config['personality'])
+    config['log'] = log_path
+    if log_options:
+        config['logging'] = log_options
+
+    for section in OPTIONAL_CONFIG_SECTIONS:
+        if yaml_config.get(section):
+            config[section] = yaml_config[section]
 
     return config
 
+def connect_sqlite(args):
+    """
+    Connect to the SQLite DB. When an output DB is given, translations
+    are written there and the source DB is attached read-only.
+    """
+    if args.output_db:
+        logger.debug("Connecting to output DB %s with source DB %s attached read-only", args.output_db, args.sqlite_db)
+        return get_split_db_connection(args.output_db, args.sqlite_db, args.source_immutable)
+
+    logger.debug("Connecting to DB: %s", args.sqlite_db)
+    return get_db_connection(args.sqlite_db)
+
+
+def count_prompt_tokens(encoding, config, message_text):
+    """
+    Count the tokens of the prompt sent to translate a message
+    """
+    translate_messages = [{"role":"system", "content": config['system']},
+                          {"role":"user", "content": config['user']+message_text}]
+    with span('encode_tokens'):
+        return len(encoding.encode(str(translate_messages)))
+
+
+def estimate_cost(total_tokens, config):
+    """
+    Estimate the cost in $ of translating messages with the given
+    prompt tokens, assuming as many output tokens as input tokens
+    for each target language
+    """
+    # The estimated total cost is calculated as the sum of the cost of the input messages
+    # and the cost of the output messages, at the prices of the 'pricing' config section.
+    output_tokens = total_tokens * max(1, len(get_target_languages(config)))
+    return get_cost(config.get('pricing'), config['model'], total_tokens, output_tokens)
+
+
 def calculate_cost_analysis(config, args):
     """
     Calculate cost for messages
@@ -85,29 +221,23 @@ def calculate_cost_analysis(config, args):
     limit = int(args.max_limit)
     count = 1
     total_tokens = 0
-    # cost in $ per 1k tokens as per 22.3.2024
-    # TODO: parametrize the cost functionality so the prices can
-    # be retrieved from OpenAI or through a configuration file
-    input_price =  0.0005
-    output_price =  0.0015
     try:
         logger.debug("Initializing the tokenizer")
-        encoding = tiktoken.encoding_for_model(config['model'])
+        with span('load_encoding'):
+            encoding = get_encoding(config['model'])
 
-        logger.debug("Connecting to DB: %s", args.sqlite_db)
-        connection, cursor = get_db_connection(args.sqlite_db)
+        connection, cursor = connect_sqlite(args)
 
         logger.debug("Retrieving messages for channel: %s", args.channel_name)
-        channel_messages = get_channel_messages(cursor, args.channel_name)
+        with span('get_channel_messages', channel=args.channel_name):
+            channel_messages = get_channel_messages(cursor, args.channel_name)
 
         for message_id, message_text in channel_messages:
             count = count + 1
             logger.debug("Processing channel %s message %s (%s bytes)", args.channel_name, message_id, len(message_text))
             if len(message_text) > 1:
                 logger.debug("Creating query to OpenAI")
-                translate_messages = [{"role":"system", "content": config['system']},
-                                      {"role":"user", "content": config['user']+message_text}]
-                tokens = len(encoding.encode(str(translate_messages)))
+                tokens = count_prompt_tokens(encoding, config, message_text)
                 logger.debug("Tokens for message %s (+prompt): %s", message_id, tokens)
                 total_tokens = total_tokens + tokens
             if count >= limit:
@@ -116,17 +246,108 @@ def calculate_cost_analysis(config, args):
                 break
         logger.debug("Total tokens for %s messages (+prompts): %s", count, total_tokens)
 
-        # The estimated total cost is calculated as the sum of the cost of the input messages
-        # and the cost of the output messages. These prices are per 1000 tokens.
-        estimated_total_cost = ((total_tokens*input_price)/1000)+((total_tokens*output_price)/1000)
+        estimated_total_cost = estimate_cost(total_tokens, config)
         logger.info("Estimated cost of translating %s messages: $ %.2f", count, estimated_total_cost)
-        connection.commit()
+        with span('commit'):
+            connection.commit()
         connection.close()
     except KeyboardInterrupt:
         connection.commit()
         connection.close()
         return
 
+
+def prepare_translation_db(config, connection, cursor, schema_path):
+    """
+    Apply the schema, build the compressor of the 'compression' section
+    and the search index triggers of this connection, and fingerprint
+    the stored parameters.
+
+    Returns:
+    TextCompressor or None
+    """
+    logger.debug("Creating tables needed for translation using schema: %s", schema_path)
+    create_tables_from_schema(connection, cursor, schema_path)
+
+    # Before the search triggers, which decompress once a dictionary is stored
+    compressor = get_compressor(config, cursor)
+
+    # Make sure the full-text search triggers exist on this connection
+    if has_search_index(cursor):
+        create_search_index(connection, cursor)
+
+    backfilled = backfill_config_fingerprints(cursor)
+    logger.debug("Fingerprinted %s stored translation parameters", backfilled)
+    return compressor
+
+
+@contextmanager
+def open_translation_db(config, args):
+    """
+    Open and prepare the SQLite DB of a translation run, see
+    prepare_translation_db(). The translations are committed when the
+    run ends or is interrupted.
+
+    Yields:
+    (connection, cursor, compressor)
+    """
+    connection, cursor = connect_sqlite(args)
+    try:
+        compressor = prepare_translation_db(config, connection, cursor, args.sqlite_schema)
+        yield connection, cursor, compressor
+        with span('commit'):
+            connection.commit()
+    except KeyboardInterrupt:
+        # Keep the translations stored so far
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def store_translation(cursor, message_id, translation_parameters_id, message_translated, compressor=None):
+    """
+    Store a translation with the edit date and hash of its message.
+
+    Returns:
+    translation ID
+    """
+    with span('upsert_message_translation'):
+        msg_translation_id = upsert_message_translation(cursor, message_id, translation_parameters_id, message_translated, compressor)
+    record_translation_sources(cursor, translation_parameters_id, [message_id])
+    return msg_translation_id
+
+
+def store_translation_failure(cursor, config, message_id, translation_parameters_id, channel_id, error):
+    """
+    Queue a failed translation for the retry pass and count it in the
+    stats, never store a NULL translation.
+
+    Returns:
+    attempt count of the message
+    """
+    max_attempts = int((config.get('retry') or {}).get('max_attempts', DEFAULT_MAX_ATTEMPTS))
+    attempt_count = record_translation_failure(cursor, message_id, translation_parameters_id, error, config.get('retry'))
+    failed, skipped = get_failure_stats(attempt_count, max_attempts)
+    increment_translation_stats(cursor, channel_id, translation_parameters_id,
+                                failed_count=failed, skipped_count=skipped)
+    return attempt_count
+
+
+def build_language_job(client, config, language, token_budget=None, router=None):
+    """
+    Return the job function translating the text of a (message_id,
+    message_text, ...) job into one target language, or with the
+    prompt of the config when language is empty. It returns the
+    translation and its RequestUsage.
+    """
+    def run_job(job):
+        usage = RequestUsage()
+        if language:
+            return translate_languages(client, config, job[1], [language], token_budget, usage)[language], usage
+        return translate_text(client, config, job[1], token_budget=token_budget, router=router, usage=usage), usage
+    return run_job
+
+
 def translate_mode_automatic(client, config, args):
     """
     Run the LLM translation in automatic mode using a
@@ -140,15 +361,13 @@ def translate_mode_automatic(client, config, args):
     translation_model = config['model']
     translation_config_sha256 = get_file_sha256(args.yaml_config)
     translation_config = get_file_content(args.yaml_config)
-    try:
-        logger.debug("Starting automatic translation")
-
-        logger.debug("Connecting to DB: %s", args.sqlite_db)
-        connection, cursor = get_db_connection(args.sqlite_db)
-
-        logger.debug("Creating tables needed for translation using schema: %s", args.sqlite_schema)
-        create_tables_from_schema(connection, cursor, args.sqlite_schema)
+    translation_config_fingerprint = get_config_fingerprint(config)
+    near_duplicates = config.get('near_duplicates')
+    translation_memory = config.get('translation_memory')
+    controller = AIMDController(config.get('concurrency'))
+    logger.debug("Starting automatic translation")
 
+    with open_translation_db(config, args) as (connection, cursor, compressor):
         has_messages = has_channel_messages(cursor, args.channel_name)
         logger.debug("Checking if there are messages for channel %s: %s", args.channel_name, has_messages)
 
@@ -158,78 +377,676 @@ def translate_mode_automatic(client, config, args):
         logger.debug("Retrieving the LLM model: %s", translation_model)
         logger.debug("Retrieving the YAML config file SHA256: %s", translation_config_sha256)
         logger.debug("Retrieving the YAML config file: %s bytes", len(translation_config))
+        logger.debug("Retrieving the translation config fingerprint: %s", translation_config_fingerprint)
 
         translation_parameters_id = insert_translation_parameters(cursor,
                                                                  translation_tool_name,
                                                                  translation_tool_commit,
                                                                  translation_model,
                                                                  translation_config_sha256,
-                                                                 translation_config)
+                                                                 translation_config,
+                                                                 translation_config_fingerprint)
 
         logger.debug("Storing translation parameters to DB and retrieving ID: %s", translation_parameters_id)
 
-        logger.debug("Retrieving messages for channel: %s", args.channel_name)
-        channel_messages = get_channel_messages(cursor, args.channel_name)
+        requeued = requeue_null_translations(cursor, translation_parameters_id)
+        if requeued:
+            logger.info("Moved %s NULL translations to the retry queue", requeued)
+        failed_message_ids = get_failed_message_ids(cursor, translation_parameters_id)
+        channel_id = check_channel_exists(cursor, args.channel_name)
+        token_budget = get_token_budget(config, cursor)
+        router = get_model_router(config)
 
-        logger.info("Processing '%s' messages for channel '%s'", len(channel_messages), args.channel_name)
-        for message_id, message_text in channel_messages:
-            logger.debug("Processing channel %s message %s (%s bytes)", args.channel_name, message_id, len(message_text))
-            exists_translation = exists_translation_for_message(cursor, message_id, translation_parameters_id)
+        if near_duplicates:
+            reuse_threshold = float(near_duplicates.get('reuse_threshold', 0.95))
+            hint_threshold = float(near_duplicates.get('hint_threshold', 0.7))
+            indexed = index_translated_messages(cursor)
+            logger.debug("Added %s translated messages to the near-duplicate index", indexed)
+
+        logger.debug("Retrieving messages for channel: %s", args.channel_name)
+        with span('get_channel_messages', channel=args.channel_name):
+            channel_messages = get_channel_messages(cursor, args.channel_name)
 
-            if not exists_translation:
-                # There is no translation for this message
-                if len(message_text) > 1:
-                    count = count+1
+        def prepare_jobs():
+            """
+            Check the messages in order and yield the ones to send to
+            the LLM. Runs in this thread, between stored results.
+            """
+            nonlocal count
+            for message_id, message_text in channel_messages:
+                # Check if we did not reach the translation limit (number of iterations)
+                if count > limit:
+                    # Translation quota reached
+                    logger.debug("Translation limit reached, stopping translation")
+                    return
 
-                    # Message is not empty, translate it with OpenAI model
-                    logger.debug("Translating message %s with translation parameters ID %s", message_id, translation_parameters_id)
-                    message_translated = translate(client, config, message_text)
+                logger.debug("Processing channel %s message %s (%s bytes)", args.channel_name, message_id, len(message_text))
+                exists_translation = exists_translation_for_message(cursor, message_id, translation_parameters_id)
 
-                    # Update the translation for that row
-                    msg_translation_id = upsert_message_translation(cursor, message_id, translation_parameters_id, message_translated)
-                    logger.debug("Message %s translated with translation ID %s", message_id, msg_translation_id)
-                else:
+                if exists_translation:
+                    # There is a translation for this message
+                    logger.debug("Found translation for message %s with translation parameters ID %s", message_id, translation_parameters_id)
+                    continue
+                if message_id in failed_message_ids:
+                    # Failed before, left to the retry pass
+                    logger.debug("Message %s is queued for retry, skipping", message_id)
+                    continue
+                if len(message_text) <= 1:
                     # Message is too short (1 byte), do not translate
                     logger.debug("Translation cancelled for message %s, too small (%s)", message_id, message_text)
+                    continue
+                count = count+1
+
+                # Look for a previously translated near-duplicate of this message
+                duplicate = None
+                if near_duplicates:
+                    duplicate = find_near_duplicate(cursor, translation_parameters_id, message_text,
+                                                    min(reuse_threshold, hint_threshold), message_id)
+
+                if duplicate and duplicate[1] >= reuse_threshold:
+                    # Near-identical message, reuse its translation
+                    logger.debug("Reusing translation of message %s for message %s (similarity %.2f)", duplicate[0], message_id, duplicate[1])
+                    store_result(message_id, message_text, duplicate[3], [])
+                    continue
+
+                hint = None
+                if duplicate:
+                    logger.debug("Using translation of message %s as hint for message %s (similarity %.2f)", duplicate[0], message_id, duplicate[1])
+                    hint = build_translation_hint(duplicate[2], duplicate[3], message_text)
+
+                job = {'message_id': message_id, 'message_text': message_text, 'hint': hint, 'segments': None}
+                if translation_memory:
+                    segments, separators = split_segments(message_text, translation_memory.get('segment', 'lines'))
+                    job['segments'] = segments
+                    job['separators'] = separators
+                    job['cached'] = lookup_segment_translations(cursor, translation_parameters_id, segments)
+
+                # Message is not empty, translate it with OpenAI model
+                logger.debug("Translating message %s with translation parameters ID %s", message_id, translation_parameters_id)
+                yield job
+
+        def run_job(job):
+            """
+            Send the translation request of a job, runs in a worker thread.
+            """
+            usage = RequestUsage()
+            if job['segments'] is None:
+                message_translated, new_segments = translate_text(client, config, job['message_text'], job['hint'], token_budget, router, usage), []
             else:
-                # There is a translation for this message
-                logger.debug("Found translation for message %s with translation parameters ID %s", message_id, translation_parameters_id)
+                message_translated, new_segments = translate_segments(job['segments'], job['separators'], job['cached'],
+                                                                      lambda text: translate_text(client, config, text, job['hint'], token_budget, router, usage))
+            if not message_translated:
+                raise ValueError("Empty translation returned by the model")
+            return message_translated, new_segments, usage
+
+        def store_result(message_id, message_text, message_translated, new_segments, usage=None):
+            # Update the translation for that row
+            msg_translation_id = store_translation(cursor, message_id, translation_parameters_id, message_translated, compressor)
+            logger.debug("Message %s translated with translation ID %s", message_id, msg_translation_id)
+            increment_translation_stats(cursor, channel_id, translation_parameters_id, translated_count=1,
+                                        **(usage.totals if usage else {}))
+            if usage:
+                record_request_latencies(cursor, usage.latencies)
+
+            if new_segments:
+                store_segment_translations(cursor, translation_parameters_id, new_segments)
+            if near_duplicates:
+                index_message_minhash(cursor, message_id, message_text)
 
-            # Check if we did not reach the translation limit (number of iterations)
-            if count > limit:
+        logger.info("Processing '%s' messages for channel '%s'", len(channel_messages), args.channel_name)
+        for job, result, error in run_concurrently(prepare_jobs(), run_job, controller):
+            if error is not None:
+                attempt_count = store_translation_failure(cursor, config, job['message_id'], translation_parameters_id, channel_id, error)
+                logger.debug("Exception translating message %s (attempt %s): %s", job['message_id'], attempt_count, error)
+                continue
+            store_result(job['message_id'], job['message_text'], *result)
+
+        logger.info("Finished translating %s messages for %s channel", limit, args.channel_name)
+        if router:
+            logger.info("Model routing: %s", dict(router.stats))
+
+
+def translate_mode_languages(client, config, args, languages):
+    """
+    Run the LLM translation in automatic mode into several target
+    languages. Each message is translated into all its missing
+    languages with one request, so its input tokens are paid once,
+    and each language is stored with its own translation parameters.
+    """
+    limit = int(args.max_limit)
+    count = 1
+    controller = AIMDController(config.get('concurrency'))
+    logger.debug("Starting automatic translation into %s", ', '.join(languages))
+
+    with open_translation_db(config, args) as (connection, cursor, compressor):
+        translation_parameters_ids = {}
+        failed_message_ids = set()
+        for language in languages:
+            translation_parameters_id = insert_translation_parameters(cursor, *get_translation_parameters(config, args, language))
+            logger.debug("Storing %s translation parameters to DB and retrieving ID: %s", language, translation_parameters_id)
+            requeue_null_translations(cursor, translation_parameters_id)
+            failed_message_ids.update(get_failed_message_ids(cursor, translation_parameters_id))
+            translation_parameters_ids[language] = translation_parameters_id
+        channel_id = check_channel_exists(cursor, args.channel_name)
+        token_budget = get_token_budget(config, cursor)
+
+        logger.debug("Retrieving messages for channel: %s", args.channel_name)
+        with span('get_channel_messages', channel=args.channel_name):
+            channel_messages = get_channel_messages(cursor, args.channel_name)
+
+        def prepare_jobs():
+            nonlocal count
+            for message_id, message_text in channel_messages:
+                if count > limit:
+                    # Translation quota reached
+                    logger.debug("Translation limit reached, stopping translation")
+                    return
+                missing = [language for language in languages
+                           if not exists_translation_for_message(cursor, message_id, translation_parameters_ids[language])]
+                if not missing:
+                    continue
+                if message_id in failed_message_ids:
+                    # Failed before, left to the retry pass
+                    logger.debug("Message %s is queued for retry, skipping", message_id)
+                    continue
+                if len(message_text) <= 1:
+                    # Message is too short (1 byte), do not translate
+                    continue
+                count = count + 1
+                logger.debug("Translating message %s into %s", message_id, ', '.join(missing))
+                yield message_id, message_text, missing
+
+        def run_job(job):
+            usage = RequestUsage()
+            return translate_languages(client, config, job[1], job[2], token_budget, usage), usage
+
+        logger.info("Processing '%s' messages for channel '%s'", len(channel_messages), args.channel_name)
+        for (message_id, _, missing), result, error in run_concurrently(prepare_jobs(), run_job, controller):
+            if error is not None:
+                logger.debug("Exception translating message %s: %s", message_id, error)
+                for language in missing:
+                    store_translation_failure(cursor, config, message_id, translation_parameters_ids[language], channel_id, error)
+                continue
+            translations, usage = result
+            for index, language in enumerate(missing):
+                store_translation(cursor, message_id, translation_parameters_ids[language], translations[language], compressor)
+                # The request is paid once, its usage is counted with the first language
+                increment_translation_stats(cursor, channel_id, translation_parameters_ids[language], translated_count=1,
+                                            **(usage.totals if index == 0 else {}))
+            record_request_latencies(cursor, usage.latencies)
+
+        logger.info("Finished translating %s messages for %s channel", count - 1, args.channel_name)
+
+
+def translate_mode_retry(client, config, args):
+    """
+    Retry the failed translations whose next retry is due, for the
+    translation parameters of this run or of each of its target
+    languages. Translated messages leave the
+    failure queue, failed ones are scheduled again with a longer delay.
+    """
+    limit = int(args.max_limit)
+    max_attempts = int((config.get('retry') or {}).get('max_attempts', DEFAULT_MAX_ATTEMPTS))
+    controller = AIMDController(config.get('concurrency'))
+    logger.debug("Starting retry of failed translations")
+
+    with open_translation_db(config, args) as (connection, cursor, compressor):
+        token_budget = get_token_budget(config, cursor)
+        router = get_model_router(config)
+        # Each target language has its own failures, retried one language per request
+        for language in get_target_languages(config) or ['']:
+            translation_parameters_id = insert_translation_parameters(cursor, *get_translation_parameters(config, args, language))
+            requeue_null_translations(cursor, translation_parameters_id)
+            failures = get_due_translation_failures(cursor, translation_parameters_id, args.channel_name, max_attempts, limit)
+            channel_ids = get_message_channels(cursor, [failure[0] for failure in failures])
+            logger.info("Retrying %s failed translations%s", len(failures), f" into {language}" if language else "")
+
+            translated = []
+            try:
+                for (message_id, _, _), result, error in run_concurrently(failures, build_language_job(client, config, language, token_budget, router), controller):
+                    if error is None and not result[0]:
+                        error = ValueError("Empty translation returned by the model")
+                    if error is not None:
+                        attempt_count = store_translation_failure(cursor, config, message_id, translation_parameters_id, channel_ids.get(message_id), error)
+                        logger.debug("Retry of message %s failed (attempt %s): %s", message_id, attempt_count, error)
+                        continue
+                    message_translated, usage = result
+                    store_translation(cursor, message_id, translation_parameters_id, message_translated, compressor)
+                    increment_translation_stats(cursor, channel_ids.get(message_id), translation_parameters_id,
+                                                translated_count=1, failed_count=-1, **usage.totals)
+                    record_request_latencies(cursor, usage.latencies)
+                    translated.append(message_id)
+            finally:
+                # Also when interrupted, translated messages leave the queue
+                clear_translation_failures(cursor, translation_parameters_id, translated)
+            logger.info("Finished retrying failed translations, %s of %s translated", len(translated), len(failures))
+
+
+def translate_mode_edited(client, config, args):
+    """
+    Retranslate the messages whose text was edited since their
+    translation, for the translation parameters of this run or of each
+    of its target languages. Failed retranslations keep the previous
+    translation and are tried again on the next run.
+    """
+    limit = int(args.max_limit)
+    controller = AIMDController(config.get('concurrency'))
+    logger.debug("Starting retranslation of edited messages")
+
+    with open_translation_db(config, args) as (connection, cursor, compressor):
+        token_budget = get_token_budget(config, cursor)
+        router = get_model_router(config)
+        for language in get_target_languages(config) or ['']:
+            translation_parameters_id = insert_translation_parameters(cursor, *get_translation_parameters(config, args, language))
+            requeue_null_translations(cursor, translation_parameters_id)
+            with span('find_edited_translations', channel=args.channel_name):
+                edited = find_edited_translations(cursor, translation_parameters_id, args.channel_name)
+            channel_ids = get_message_channels(cursor, [message_id for message_id, _ in edited[:limit]])
+            logger.info("Found %s edited messages%s", len(edited), f" translated into {language}" if language else "")
+
+            retranslated = 0
+            for (message_id, _), result, error in run_concurrently(edited[:limit], build_language_job(client, config, language, token_budget, router), controller):
+                if error is None and not result[0]:
+                    error = ValueError("Empty translation returned by the model")
+                if error is not None:
+                    logger.debug("Retranslation of edited message %s failed: %s", message_id, error)
+                    continue
+                message_translated, usage = result
+                store_translation(cursor, message_id, translation_parameters_id, message_translated, compressor)
+                # Already counted as translated, only the spend is new
+                increment_translation_stats(cursor, channel_ids.get(message_id), translation_parameters_id, **usage.totals)
+                record_request_latencies(cursor, usage.latencies)
+                retranslated = retranslated + 1
+            logger.info("Finished retranslating edited messages, %s of %s retranslated", retranslated, min(limit, len(edited)))
+
+
+def get_translation_parameters(config, args, translation_language=''):
+    """
+    Retrieve the translation parameters that identify the
+    translations of this run, or of one of its target languages.
+    """
+    translation_tool_name = os.path.basename(__file__)
+    translation_tool_commit = get_current_commit()
+    translation_model = config['model']
+    translation_config_sha256 = get_file_sha256(args.yaml_config)
+    translation_config = get_file_content(args.yaml_config)
+    translation_config_fingerprint = get_config_fingerprint(config, translation_language)
+    return (translation_tool_name,
+            translation_tool_commit,
+            translation_model,
+            translation_config_sha256,
+            translation_config,
+            translation_config_fingerprint,
+            translation_language)
+
+
+def prepare_shards(config, args):
+    """
+    Scan the SQLite shards in parallel for pending messages of the
+    channel, deduplicate them by text and estimate the cost.
+
+    Returns:
+    (scans, texts), see lib.shard_utils
+    """
+    shard_paths = resolve_shard_paths(args.sqlite_shards)
+    logger.info("Scanning %s shards for pending messages of channel '%s'", len(shard_paths), args.channel_name)
+    scans = scan_shards(shard_paths, args.sqlite_schema, args.channel_name,
+                        get_translation_parameters(config, args), int(args.shard_workers))
+    texts = group_pending_by_text(scans)
+
+    pending = sum(len(targets) for targets in texts.values())
+    logger.info("Found %s pending messages with %s unique texts", pending, len(texts))
+
+    with span('load_encoding'):
+        encoding = get_encoding(config['model'])
+    limit = int(args.max_limit)
+    total_tokens = sum(count_prompt_tokens(encoding, config, text) for text in list(texts)[:limit])
+    logger.info("Estimated cost of translating %s unique texts: $ %.2f", min(limit, len(texts)), estimate_cost(total_tokens, config))
+    return scans, texts
+
+
+def translate_mode_shards(client, config, args, scans, texts):
+    """
+    Translate the unique pending texts of many SQLite shards and
+    write each translation back to every shard the text appears in.
+    """
+    limit = int(args.max_limit)
+    count = 0
+    translation_parameters_ids = {shard_path: translation_parameters_id for shard_path, translation_parameters_id, _ in scans}
+    batch = {}
+    batch_failures = {}
+    batch_usage = {}
+
+    def write_shard(shard_path):
+        # The shard gets the same compressor, search triggers and failure queue as a single DB
+        translations = batch.pop(shard_path, [])
+        failures = batch_failures.pop(shard_path, [])
+        usage = batch_usage.pop(shard_path, None)
+        translation_parameters_id = translation_parameters_ids[shard_path]
+        connection, cursor = get_db_connection(shard_path)
+        try:
+            compressor = prepare_translation_db(config, connection, cursor, args.sqlite_schema)
+            if translations:
+                write_shard_translations(cursor, translation_parameters_id, translations, usage, compressor)
+            if failures:
+                channel_id = check_channel_exists(cursor, args.channel_name)
+                for message_id, error in failures:
+                    store_translation_failure(cursor, config, message_id, translation_parameters_id, channel_id, error)
+            connection.commit()
+            logger.debug("Wrote %s translations and %s failures to shard %s", len(translations), len(failures), shard_path)
+        finally:
+            connection.close()
+
+    def flush():
+        # Each shard leaves the batch before it is written, so an interrupted flush never writes it twice
+        for shard_path in sorted(batch.keys() | batch_failures.keys()):
+            write_shard(shard_path)
+
+    def run_job(job):
+        usage = RequestUsage()
+        return translate_text(client, config, job[0], token_budget=token_budget, router=router, usage=usage), usage
+
+    def prepare_jobs():
+        nonlocal count
+        for message_text, targets in texts.items():
+            if count >= limit:
                 # Translation quota reached
                 logger.debug("Translation limit reached, stopping translation")
-                break
+                return
+            count = count + 1
+            logger.debug("Translating text shared by %s messages", len(targets))
+            yield message_text, targets
 
-        logger.info("Finished translating %s messages for %s channel", limit, args.channel_name)
+    controller = AIMDController(config.get('concurrency'))
+    token_budget = get_token_budget(config)
+    router = get_model_router(config)
+    written = 0
+    try:
+        for (message_text, targets), result, error in run_concurrently(prepare_jobs(), run_job, controller):
+            if error is not None:
+                logger.debug("Exception translating text: %s", error)
+                for shard_path, message_id in targets:
+                    batch_failures.setdefault(shard_path, []).append((message_id, error))
+                continue
+
+            message_translated, usage = result
+            # The request is paid once, by the shard of the first message
+            shard_usage = batch_usage.setdefault(targets[0][0], RequestUsage())
+            shard_usage.totals.update(usage.totals)
+            shard_usage.latencies.extend(usage.latencies)
+            for shard_path, message_id in targets:
+                batch.setdefault(shard_path, []).append((message_id, message_translated))
+            written = written + 1
+            if written % SHARD_WRITE_BATCH == 0:
+                flush()
+
+        flush()
+        logger.info("Finished translating %s unique texts for %s channel", count, args.channel_name)
+    except KeyboardInterrupt:
+        flush()
+        return
+
+
+def get_token_budget(config, cursor=None):
+    """
+    Build the TokenBudget that sizes max_tokens per request, learning
+    the output/input ratio from the translations in the DB, or None if
+    the 'token_budget' section is not configured.
+    """
+    if not config.get('token_budget'):
+        return None
+    with span('load_encoding'):
+        encoding = get_encoding(config['model'])
+    return build_token_budget(encoding, config['token_budget'], cursor, config['model'])
+
+
+def get_model_router(config):
+    """
+    Build the ModelRouter of the 'routing' section, or None if the
+    section is not configured and every message goes to the model.
+    """
+    if not config.get('routing'):
+        return None
+    tokenizer = get_tokenizer()
+    return ModelRouter(config['routing'], lambda text: tokenizer.count_tokens(config['model'], text))
+
+
+def get_compressor(config, cursor):
+    """
+    Build the TextCompressor of the 'compression' section, or None if
+    the section is not configured and translations are stored as text.
+    """
+    if not config.get('compression'):
+        return None
+    return get_text_compressor(cursor, config['compression'])
+
+
+def translate_text(client, config, message, hint=None, token_budget=None, router=None, usage=None):
+    """
+    Request a translation, with max_tokens sized from the message if
+    a token budget is given and through the model tiers if a router
+    is given. The tokens, cost and latency of the requests are added
+    to the RequestUsage if given. Errors are raised to the caller.
+    """
+    start = time.monotonic()
+
+    def count_usage(result):
+        nonlocal start
+        if usage is not None:
+            now = time.monotonic()
+            usage.add(config.get('pricing'), result.model or config['model'], result.usage, now - start)
+            start = now
+
+    with span('translate', chars=len(message)):
+        max_tokens = token_budget.get_max_tokens(message) if token_budget else None
+        if router:
+            return router.translate(client, config, message, hint, max_tokens, count_usage).translation
+        result = complete_translation(client, config, message, hint, max_tokens)
+        count_usage(result)
+        return result.translation
+
+
+def translate_languages(client, config, message, languages, token_budget=None, usage=None):
+    """
+    Request the translations of a message into several languages in
+    one request, with max_tokens sized from the message for each
+    language if a token budget is given. The tokens, cost and latency
+    of the request are added to the RequestUsage if given. Errors are
+    raised to the caller.
+
+    Returns:
+    dict of language to translation
+    """
+    start = time.monotonic()
+    with span('translate', chars=len(message), languages=len(languages)):
+        max_tokens = token_budget.get_max_tokens(message) * len(languages) if token_budget else None
+        result = request_languages_translation(client, config, message, languages, max_tokens=max_tokens)
+    if usage is not None:
+        usage.add(config.get('pricing'), result.model, result.usage, time.monotonic() - start)
+    return result.translation
+
+
+def translate(client, config, message, hint=None):
+    """
+    Run the LLM translation. An optional hint (e.g. the translation
+    of a near-duplicate message) is given to the model as extra
+    system instructions.
+    """
+    try:
+        with span('translate', chars=len(message)):
+            message_translated, _ = request_translation(client, config, message, hint)
+        return message_translated
+
+    except Exception as err:
+        logger.debug("Exception in translate(): %s", err)
+
+
+def export_mode(args):
+    """
+    Export the translations of a SQLite database to a
+    JSONL, CSV or Parquet file.
+    """
+    connection, cursor = connect_sqlite(args)
+    try:
+        logger.debug("Exporting translations to %s as %s (since: %s)", args.export_path, args.export_format, args.since)
+        exported = export_translations(cursor, args.export_path, args.export_format,
+                                       since=args.since, channel_name=args.channel_name)
+        logger.info("Exported %s translations to %s", exported, args.export_path)
+    finally:
+        connection.close()
+
+
+def search_mode(args):
+    """
+    Search the original and translated text of the messages
+    using the full-text search index of a SQLite database.
+    """
+    connection, cursor = connect_sqlite(args)
+    try:
+        create_tables_from_schema(connection, cursor, args.sqlite_schema)
+        created = create_search_index(connection, cursor)
+        if created or args.rebuild_index:
+            logger.info("Building the full-text search index, this may take a while")
+            indexed = rebuild_search_index(connection, cursor)
+            logger.info("Indexed %s translations", indexed)
+
+        if not args.query:
+            return
+
+        logger.debug("Searching '%s' (channel: %s, since: %s, until: %s)", args.query, args.channel_name, args.since, args.until)
+        hits = search_translations(cursor, args.query, args.channel_name, args.since, args.until, int(args.search_limit))
+        for channel_name, message_id, message_date, original, translation, _ in hits:
+            print(f"{channel_name} | {message_id} | {message_date}")
+            print(f"  {original}")
+            print(f"  {translation}")
+        logger.info("Found %s results for '%s'", len(hits), args.query)
+    finally:
+        connection.close()
+
+
+def compact_mode(config, args):
+    """
+    Compress the translations of a SQLite database stored as plain
+    text, training the compression dictionary first if needed, and
+    reclaim the freed space.
+    """
+    connection, cursor = connect_sqlite(args)
+    try:
+        create_tables_from_schema(connection, cursor, args.sqlite_schema)
+        compressor = get_text_compressor(cursor, config.get('compression'))
+        logger.info("Compressing translations (dictionary: %s bytes)", len(compressor.dictionary))
+        # Move the full-text search triggers to this connection first
+        if has_search_index(cursor):
+            create_search_index(connection, cursor)
+        with span('compress_translations'):
+            compressed = compress_translations(cursor, compressor)
         connection.commit()
+        logger.info("Compressed %s translations", compressed)
+        with span('vacuum'):
+            cursor.execute("VACUUM")
+    finally:
         connection.close()
-    except KeyboardInterrupt:
+
+
+def status_mode(config, args):
+    """
+    Print the message, translation, failure, token and spend counts
+    of the channels of a SQLite database, per translation parameters.
+    Counts are read from the stats tables, built on the first run.
+    """
+    max_attempts = int((config.get('retry') or {}).get('max_attempts', DEFAULT_MAX_ATTEMPTS))
+    connection, cursor = connect_sqlite(args)
+    try:
+        create_tables_from_schema(connection, cursor, args.sqlite_schema)
+        if args.rebuild_stats or not has_translation_stats(cursor):
+            logger.info("Building the translation stats, this may take a while")
+            rebuild_translation_stats(cursor, max_attempts)
+        else:
+            refresh_channel_stats(cursor)
         connection.commit()
+
+        status = get_translation_status(cursor, args.channel_name)
+        print(f"{'channel':<24} {'params':>6} {'model':<20} {'messages':>9} {'translated':>10} {'failed':>7} "
+              f"{'skipped':>7} {'pending':>8} {'prompt':>10} {'completion':>10} {'cost $':>9}")
+        for entry in status:
+            print(f"{entry['channel_name']:<24} {entry['translation_parameters_id'] or '-':>6} {entry['translation_model'] or '-':<20} "
+                  f"{entry['message_count']:>9} {entry['translated_count']:>10} {entry['failed_count']:>7} "
+                  f"{entry['skipped_count']:>7} {entry['pending_count']:>8} {entry['prompt_tokens']:>10} "
+                  f"{entry['completion_tokens']:>10} {entry['cost']:>9.2f}")
+        logger.info("Status of %s channels", len({entry['channel_name'] for entry in status}))
+    finally:
         connection.close()
-        return
 
 
-def translate(client, config, message):
+def plan_mode(config, args):
     """
-    Run the LLM translation
+    Predict the duration, throughput and spend of translating the
+    pending messages of a channel into each target language, without
+    sending any request. The run is simulated with the rate limits of
+    the 'plan' config section, the concurrency of the config and the
+    latencies of past runs.
     """
+    plan_config = config.get('plan') or {}
+    limit = int(args.max_limit)
+    connection, cursor = connect_sqlite(args)
     try:
-        translate_messages = [{"role":"system", "content": config['system']},
-                              {"role":"user", "content": config['user']+message}]
+        create_tables_from_schema(connection, cursor, args.sqlite_schema)
+        backfill_config_fingerprints(cursor)
+        connection.commit()
 
-        # Initialize the OpenAI LLM (Language Learning Model)
-        llm_response = client.chat.completions.create(
-            model = config['model'],
-            messages = translate_messages,
-            max_tokens = config['max_tokens'],
-            temperature = config['temperature'],
-        )
+        # Same messages as an automatic run with this config, with the
+        # number of target languages each one is missing
+        missing = {}
+        failed_message_ids = set()
+        for language in get_target_languages(config) or ['']:
+            translation_parameters_id = get_translation_parameters_id(cursor, get_config_fingerprint(config, language))
+            if translation_parameters_id:
+                failed_message_ids.update(get_failed_message_ids(cursor, translation_parameters_id))
+            with span('get_channel_messages', channel=args.channel_name):
+                for message_id, message_text in get_pending_channel_messages(cursor, args.channel_name, translation_parameters_id):
+                    missing.setdefault(message_id, [message_text, 0])[1] += 1
+        pending = [(message_text, languages) for message_id, (message_text, languages) in missing.items()
+                   if message_id not in failed_message_ids and len(message_text) > 1][:limit]
 
-        return llm_response.choices[0].message.content
+        with span('load_encoding'):
+            encoding = get_encoding(config['model'])
+        ratio = learn_output_ratio(encoding, get_translation_samples(cursor, config['model']), percentile=50) or 1.0
+        token_budget = get_token_budget(config, cursor)
+        latency_model = LatencyModel(get_latency_samples(cursor, config['model'], int(plan_config.get('latency_samples', 1000))),
+                                     int(plan_config.get('min_latency_samples', 20)),
+                                     plan_config.get('latency_overhead', 0.5),
+                                     plan_config.get('seconds_per_token', 0.02))
+    finally:
+        connection.close()
 
-    except Exception as err:
-        logger.debug("Exception in translate(): %s", err)
+    requests = []
+    for message_text, languages in pending:
+        # One request answers all the missing languages of a message
+        prompt_tokens = count_prompt_tokens(encoding, config, message_text)
+        completion_tokens = round(len(encoding.encode(message_text)) * ratio) * languages
+        max_tokens = (token_budget.get_max_tokens(message_text) if token_budget else config['max_tokens']) * languages
+        requests.append(PlannedRequest(prompt_tokens, completion_tokens, prompt_tokens + max_tokens,
+                                       get_cost(config.get('pricing'), config['model'], prompt_tokens, completion_tokens)))
+    logger.info("Simulating the translation of %s messages (output/input ratio %.2f, %s past latencies)",
+                len(requests), ratio, latency_model.samples)
+
+    plan = plan_run(requests, latency_model, config.get('concurrency'),
+                    plan_config.get('requests_per_minute'), plan_config.get('tokens_per_minute'),
+                    int(plan_config.get('runs', 20)), plan_config.get('seed'))
+
+    print(f"Messages: {plan['requests']}")
+    print(f"Tokens: {plan['prompt_tokens']} prompt, {plan['completion_tokens']} completion (estimated)")
+    print(f"Cost: $ {plan['cost']:.2f}")
+    print(f"Duration: {plan['duration_p50'] / 60:.1f} min (p50), {plan['duration_p90'] / 60:.1f} min (p90)")
+    print(f"Peak throughput: {plan['peak_requests_per_minute']} requests/min, {plan['peak_tokens_per_minute']} tokens/min")
+    # Spend curve of the median run, at most 20 rows
+    step = max(1, len(plan['curve']) // 20)
+    print(f"{'minute':>8} {'completed':>10} {'tokens':>10} {'spent $':>9}")
+    completed = 0
+    for index, (end, count, tokens, spend) in enumerate(plan['curve']):
+        completed += count
+        if index % step == step - 1 or index == len(plan['curve']) - 1:
+            print(f"{end / 60:>8.0f} {completed:>10} {tokens:>10} {spend:>9.2f}")
 
 
 def translate_mode_manual(client, config):
@@ -255,6 +1072,51 @@ def translate_mode_manual(client, config):
         return
 
 
+def translate_mode_batch(client, config, args):
+    """
+    Run the LLM translation on the records of a file or a pipe,
+    writing the translations to the standard output in input order.
+    """
+    token_budget = get_token_budget(config)
+    router = get_model_router(config)
+    translated = 0
+    failed = 0
+    input_file = sys.stdin
+    if args.input_file and args.input_file != '-':
+        input_file = open(args.input_file, 'r', encoding='utf-8', newline='' if args.input_format == 'nul' else None)
+    try:
+        logger.debug("Starting batch translation of %s records", args.input_format)
+        records = read_records(input_file, args.input_format)
+        results = translate_ordered(records, lambda text: translate_text(client, config, text, token_budget=token_budget, router=router),
+                                    int(args.workers))
+        for record_id, text, message_translated, error in results:
+            if error is None:
+                translated = translated + 1
+            else:
+                failed = failed + 1
+            sys.stdout.write(format_record(args.input_format, record_id, text, message_translated, error))
+        sys.stdout.flush()
+        logger.info("Finished batch translation, %s records translated, %s failed", translated, failed)
+    except KeyboardInterrupt:
+        sys.stdout.flush()
+        return
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+
+
+def serve_mode(client, config, args):
+    """
+    Run the local HTTP translation service until interrupted.
+    """
+    service = TranslationService(client, config, config.get('serve'), get_token_budget(config))
+    try:
+        asyncio.run(serve(service, args.host, int(args.port)))
+    except KeyboardInterrupt:
+        logger.info("Stopped serving translations: %s", service.get_metrics())
+        return
+
+
 def main():
     """
     Take a message input and use the data from the yaml file to translate
@@ -264,6 +1126,10 @@ def main():
         yaml_config: Path to the configuration file (.yaml)
         env: Path to the .env file with secrets (API keys, etc)
     """
+    tracer = None
+    profiler = None
+    # Errors before the YAML config is loaded go to the default log file
+    log_listener = setup_logging(logger, DEFAULT_LOG_FILE, console_handler=console_handler)
     try:
         # Set up the argument parser
         parser = argparse.ArgumentParser(
@@ -287,9 +1153,20 @@ def main():
                             help='path to environment file (.env)')
         parser.add_argument('-m',
                             '--mode',
-                            choices=['manual', 'auto-sqlite'],
+                            choices=['manual', 'auto-sqlite', 'retry-failed', 'retranslate-edited', 'serve', 'export', 'search', 'status', 'plan', 'compact'],
                             default='manual',
-                            help='select the mode (manual or auto-sqlite)')
+                            help='select the mode (manual, auto-sqlite, retry-failed, retranslate-edited, serve, export, search, status, plan or compact)')
+
+        parser.add_argument('--input_file',
+                            help='manual mode: translate the records of this file ("-" for the standard input) '
+                                 'instead of prompting, used by default when the standard input is a pipe')
+        parser.add_argument('--input_format',
+                            choices=INPUT_FORMATS,
+                            default='line',
+                            help='format of the records of --input_file (default=line)')
+        parser.add_argument('--workers',
+                            default=8,
+                            help='number of records translated concurrently from --input_file (default=8)')
 
         parser.add_argument('--channel_name',
                             help='name of the hacktivist telegram channel to translate')
@@ -299,6 +1176,17 @@ def main():
 
         parser.add_argument('--sqlite_db',
                             help='path to SQLite database with messages to translate')
+        parser.add_argument('--sqlite_shards',
+                            help='directory or glob of SQLite databases to translate in one run (instead of --sqlite_db)')
+        parser.add_argument('--shard_workers',
+                            default=8,
+                            help='number of shards scanned in parallel (default=8)')
+        parser.add_argument('--output_db',
+                            help='path to SQLite database where translations are written, '
+                                 'the --sqlite_db database is then opened read-only')
+        parser.add_argument('--source_immutable',
+                            action='store_true',
+                            help='open --sqlite_db as immutable, only when no other process writes to it')
         parser.add_argument('--sqlite_schema',
                             default='assets/schema.sql',
                             help='path to SQLite database schema for translations')
@@ -314,6 +1202,43 @@ def main():
         parser.add_argument('--sqlite_msg_field',
                             default='message_text',
                             help='field on messages table that contains message text (default="message_text")')
+
+        parser.add_argument('--export_path',
+                            default='-',
+                            help='path of the export file, "-" for the standard output (default="-")')
+        parser.add_argument('--export_format',
+                            choices=EXPORT_FORMATS,
+                            default='jsonl',
+                            help='format of the export file (default=jsonl)')
+        parser.add_argument('--since',
+                            help='export: only translations written after this ISO timestamp, '
+                                 'search: only messages posted at or after this date')
+
+        parser.add_argument('--query',
+                            help='full-text search query (FTS5 syntax) for search mode')
+        parser.add_argument('--until',
+                            help='search: only messages posted before this date')
+        parser.add_argument('--search_limit',
+                            default=20,
+                            help='maximum number of search results (default=20)')
+        parser.add_argument('--rebuild_index',
+                            action='store_true',
+                            help='rebuild the full-text search index from all translations')
+        parser.add_argument('--rebuild_stats',
+                            action='store_true',
+                            help='status: recount the translation stats from all messages, translations and failures')
+
+        parser.add_argument('--host',
+                            default='127.0.0.1',
+                            help='address the serve mode listens on (default=127.0.0.1)')
+        parser.add_argument('--port',
+                            default=8080,
+                            help='port the serve mode listens on (default=8080)')
+
+        parser.add_argument('--trace',
+                            help='write timed spans of the run to this Chrome trace-event JSON file')
+        parser.add_argument('--profile',
+                            help='write a sampling wall-clock profile of the busy threads of the run to this file (folded stacks)')
         args = parser.parse_args()
 
         if args.verbose:
@@ -321,12 +1246,32 @@ def main():
         if args.debug:
             console_handler.setLevel(logging.DEBUG)
 
+        if args.trace:
+            tracer = enable_tracing()
+        if args.profile:
+            profiler = SamplingProfiler()
+            profiler.start()
+
         # Read YAML Configuration file
-        config = load_and_parse_config(args.yaml_config)
+        with span('load_and_parse_config'):
+            config = load_and_parse_config(args.yaml_config)
 
-        # Set the API key
-        openai_key = set_key(args.env)
-        client = OpenAI(api_key=openai_key)
+        # Write the log file of the config from a background thread, the
+        # default log file is kept if the logging config is invalid
+        config_log_listener = setup_logging(logger, config['log'], config.get('logging'), console_handler)
+        stop_logging(logger, log_listener)
+        log_listener = config_log_listener
+
+        # Encodings are loaded once, from the local cache when configured
+        configure_tokenizer(config.get('tokenizer'))
+
+        # Set the API key and build the client shared by all translations
+        client = None
+        if args.mode not in OFFLINE_MODES:
+            openai_key = set_key(args.env)
+            client = build_openai_client(openai_key, config.get('client'))
+            if config.get('hedging'):
+                client = hedge_client(client, config['hedging'])
 
         # Match the mode to run on
         match args.mode:
@@ -337,6 +1282,11 @@ def main():
                 if args.sqlite_db:
                     logger.info("Running on manual mode, ignoring the DB file '%s'", args.sqlite_db)
 
+                # Translate a file or a pipe without prompting
+                if args.input_file or not sys.stdin.isatty():
+                    translate_mode_batch(client, config, args)
+                    return
+
                 # Run interactive manual mode
                 translate_mode_manual(client, config)
 
@@ -344,26 +1294,122 @@ def main():
                 logger.info("hermeneisGPT on automatic SQLite mode")
 
                 # Automatic DB mode requires the database arg to be passes/
-                if not args.sqlite_db:
-                    logger.error("--sqlite_db is required when running on automatic SQLite mode")
+                if not args.sqlite_db and not args.sqlite_shards:
+                    logger.error("--sqlite_db or --sqlite_shards is required when running on automatic SQLite mode")
                     return
                 # Automatic DB mode requires the hacktivist channel_name to translate messages from
                 if not args.channel_name:
                     logger.error("--channel_name is required when running on automatic SQLite mode")
                     return
 
+                languages = get_target_languages(config)
+                if args.sqlite_shards and languages:
+                    logger.error("--sqlite_shards does not support several target languages")
+                    return
+
+                if args.sqlite_shards:
+                    # Run automatic mode over many sqlite shards
+                    scans, texts = prepare_shards(config, args)
+                    print("Proceeding with the following actions will incur costs. Do you wish to continue? (Y/N)")
+                    user_input = input()
+
+                    if user_input == "Y" or user_input == "y":
+                        translate_mode_shards(client, config, args, scans, texts)
+                    return
+
                 # Run automatic mode with sqlite db
                 calculate_cost_analysis(config, args)
                 print("Proceeding with the following actions will incur costs. Do you wish to continue? (Y/N)")
                 user_input = input()
 
                 if user_input == "Y" or user_input == "y":
+                    if languages:
+                        # Translate into every target language at once
+                        translate_mode_languages(client, config, args, languages)
+                        return
                     # Run automatic mode with sqlite db
                     translate_mode_automatic(client, config, args)
 
+            case "retry-failed":
+                logger.info("hermeneisGPT on retry-failed mode")
+
+                if not args.sqlite_db:
+                    logger.error("--sqlite_db is required when running on retry-failed mode")
+                    return
+
+                translate_mode_retry(client, config, args)
+
+            case "retranslate-edited":
+                logger.info("hermeneisGPT on retranslate-edited mode")
+
+                if not args.sqlite_db:
+                    logger.error("--sqlite_db is required when running on retranslate-edited mode")
+                    return
+
+                translate_mode_edited(client, config, args)
+
+            case "serve":
+                logger.info("hermeneisGPT on serve mode")
+
+                serve_mode(client, config, args)
+
+            case "export":
+                logger.info("hermeneisGPT on export mode")
+
+                if not args.sqlite_db:
+                    logger.error("--sqlite_db is required when running on export mode")
+                    return
+
+                export_mode(args)
+
+            case "search":
+                logger.info("hermeneisGPT on search mode")
+
+                if not args.sqlite_db:
+                    logger.error("--sqlite_db is required when running on search mode")
+                    return
+
+                search_mode(args)
+
+            case "status":
+                logger.info("hermeneisGPT on status mode")
+
+                if not args.sqlite_db:
+                    logger.error("--sqlite_db is required when running on status mode")
+                    return
+
+                status_mode(config, args)
+
+            case "plan":
+                logger.info("hermeneisGPT on plan mode")
+
+                if not args.sqlite_db or not args.channel_name:
+                    logger.error("--sqlite_db and --channel_name are required when running on plan mode")
+                    return
+
+                plan_mode(config, args)
+
+            case "compact":
+                logger.info("hermeneisGPT on compact mode")
+
+                if not args.sqlite_db:
+                    logger.error("--sqlite_db is required when running on compact mode")
+                    return
+
+                compact_mode(config, args)
+
     except Exception as err:
-        logger.info("Exception in main()")
-        logger.info(err)
+        logger.error("Exception in main(): %s", err)
+    finally:
+        if tracer is not None:
+            tracer.write(args.trace)
+            logger.info("Trace written to %s", args.trace)
+        if profiler is not None:
+            profiler.stop()
+            profiler.write(args.profile)
+            logger.info("Profile written to %s", args.profile)
+        if log_listener is not None:
+            stop_logging(logger, log_listener)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,137 @@
+"""
+HermeneisGPT library of functions to translate a stream of records
+from a pipe or a file.
+
+Records are read lazily, translated concurrently and written in input
+order. At most a fixed window of records is held in memory, so the
+memory use does not depend on the size of the input.
+"""
+
+import json
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+logger = logging.getLogger('hermeneis')
+
+INPUT_FORMATS = ('line', 'nul', 'jsonl')
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def split_stream(stream, delimiter, chunk_size=READ_CHUNK_SIZE):
+    """
+    Split a text stream on a delimiter without reading it whole.
+    A trailing delimiter does not produce an empty record.
+    """
+    buffer = ''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        buffer = buffer + chunk
+        *records, buffer = buffer.split(delimiter)
+        yield from records
+    if buffer:
+        yield buffer
+
+
+def read_records(stream, input_format='line'):
+    """
+    Read the records to translate from a text stream.
+
+    Parameters:
+    stream: text stream, e.g. sys.stdin
+    input_format: 'line' (one record per line), 'nul' (records
+    separated by NUL bytes, may span lines) or 'jsonl' (one JSON
+    object per line with 'text' and an optional 'id')
+
+    Yields:
+    (record_id, text), record_id is the record number unless the
+    JSONL record has an 'id'
+
+    Raises:
+    ValueError on an unknown format or an invalid JSONL record
+    """
+    if input_format == 'line':
+        for number, line in enumerate(stream, 1):
+            yield number, line.rstrip('\r\n')
+    elif input_format == 'nul':
+        for number, record in enumerate(split_stream(stream, '\0'), 1):
+            yield number, record
+    elif input_format == 'jsonl':
+        for number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                yield record.get('id', number), record['text']
+            except (ValueError, KeyError, AttributeError) as err:
+                raise ValueError(f"Invalid JSONL record on line {number}: {err}") from err
+    else:
+        raise ValueError(f"Unknown input format: {input_format}")
+
+
+def format_record(input_format, record_id, text, translation, error=None):
+    """
+    Format the translation of a record for the output stream, in the
+    same format as the input. In 'line' format newlines of the
+    translation are replaced with spaces so output lines match input
+    lines, a failed record is an empty line.
+    """
+    if input_format == 'jsonl':
+        record = {'id': record_id, 'text': text, 'translation': translation}
+        if error is not None:
+            record['error'] = f"{type(error).__name__}: {error}"
+        return json.dumps(record, ensure_ascii=False) + '\n'
+    if input_format == 'nul':
+        return (translation or '') + '\0'
+    return ' '.join((translation or '').splitlines()) + '\n'
+
+
+def translate_ordered(records, translate_fn, workers=8):
+    """
+    Translate records concurrently and yield the results in input order.
+
+    At most 'workers' * 2 records are read ahead of the record being
+    written, a slow record holds back the output but not the memory.
+
+    Parameters:
+    records: iterable of (record_id, text)
+    translate_fn: function of the text, run in a worker thread
+    workers: number of concurrent translations
+
+    Yields:
+    (record_id, text, translation, error), translation is None and
+    error the exception when the translation failed
+    """
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+
+    def run(text):
+        if not text.strip():
+            # Nothing to translate, keep the record so the output stays aligned
+            return text
+        return translate_fn(text)
+
+    window = deque()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch') as executor:
+        try:
+            for record_id, text in records:
+                window.append((record_id, text, executor.submit(run, text)))
+                if len(window) >= workers * 2:
+                    yield _result(*window.popleft())
+            while window:
+                yield _result(*window.popleft())
+        finally:
+            for _, _, future in window:
+                future.cancel()
+
+
+def _result(record_id, text, future):
+    try:
+        return record_id, text, future.result(), None
+    except Exception as err:
+        logger.debug("Exception translating record %s: %s", record_id, err)
+        return record_id, text, None, err
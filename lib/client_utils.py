@@ -0,0 +1,98 @@
+"""
+HermeneisGPT library of functions to build the LLM API clients.
+
+A single client with a pooled HTTP transport is built from the optional
+'client' section of the YAML config and shared by every component that
+sends requests. Any OpenAI-compatible server can be used with base_url.
+"""
+
+import httpx
+from openai import OpenAI
+from openai import AsyncOpenAI
+
+
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 20
+DEFAULT_KEEPALIVE_EXPIRY = 30.0
+DEFAULT_TIMEOUT = 600.0
+DEFAULT_MAX_RETRIES = 2
+
+
+def get_client_timeout(client_config):
+    """
+    Build the request timeout from the client config. The timeout
+    is either a number of seconds or a mapping with any of
+    'total', 'connect', 'read', 'write' and 'pool'.
+    """
+    timeout = client_config.get('timeout', DEFAULT_TIMEOUT)
+    if isinstance(timeout, dict):
+        total = float(timeout.get('total', DEFAULT_TIMEOUT))
+        return httpx.Timeout(total,
+                             connect=float(timeout.get('connect', total)),
+                             read=float(timeout.get('read', total)),
+                             write=float(timeout.get('write', total)),
+                             pool=float(timeout.get('pool', total)))
+    return httpx.Timeout(float(timeout))
+
+
+def get_client_limits(client_config):
+    """
+    Build the connection pool limits from the client config.
+    """
+    return httpx.Limits(max_connections=int(client_config.get('max_connections', DEFAULT_MAX_CONNECTIONS)),
+                        max_keepalive_connections=int(client_config.get('max_keepalive_connections', DEFAULT_MAX_KEEPALIVE_CONNECTIONS)),
+                        keepalive_expiry=float(client_config.get('keepalive_expiry', DEFAULT_KEEPALIVE_EXPIRY)))
+
+
+def get_client_options(api_key, client_config):
+    """
+    Build the keyword arguments shared by the sync and async clients.
+    """
+    options = {
+        'api_key': api_key,
+        'timeout': get_client_timeout(client_config),
+        'max_retries': int(client_config.get('max_retries', DEFAULT_MAX_RETRIES)),
+    }
+    if client_config.get('base_url'):
+        options['base_url'] = client_config['base_url'].strip()
+    return options
+
+
+def build_openai_client(api_key, client_config=None):
+    """
+    Build an OpenAI client with a pooled HTTP transport.
+
+    Parameters:
+    api_key
+    client_config: optional 'client' section of the YAML config
+
+    Returns:
+    OpenAI client
+
+    Raises:
+    ImportError if http2 is enabled and the 'h2' package is missing
+    """
+    client_config = client_config or {}
+    http_client = httpx.Client(limits=get_client_limits(client_config),
+                               http2=bool(client_config.get('http2', False)))
+    return OpenAI(http_client=http_client, **get_client_options(api_key, client_config))
+
+
+def build_async_openai_client(api_key, client_config=None):
+    """
+    Build an AsyncOpenAI client with a pooled HTTP transport.
+
+    Parameters:
+    api_key
+    client_config: optional 'client' section of the YAML config
+
+    Returns:
+    AsyncOpenAI client
+
+    Raises:
+    ImportError if http2 is enabled and the 'h2' package is missing
+    """
+    client_config = client_config or {}
+    http_client = httpx.AsyncClient(limits=get_client_limits(client_config),
+                                    http2=bool(client_config.get('http2', False)))
+    return AsyncOpenAI(http_client=http_client, **get_client_options(api_key, client_config))
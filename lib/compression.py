@@ -0,0 +1,148 @@
+"""
+HermeneisGPT library to compress translation texts.
+
+Translations are short and share a lot of vocabulary, so they are
+compressed with zlib and a preset dictionary trained on the
+translations of the DB. A compressed translation is a BLOB holding
+COMPRESSED_FORMAT, the key of its dictionary (the start of the SHA256
+of the dictionary, zeros without dictionary) and the raw deflate
+stream. Plain TEXT translations are left as they are, so compressed
+and uncompressed translations live side by side.
+"""
+
+import zlib
+import hashlib
+from collections import Counter
+
+
+COMPRESSED_FORMAT = 1
+KEY_SIZE = 8
+NO_DICTIONARY_KEY = bytes(KEY_SIZE)
+
+DEFAULT_LEVEL = 9
+DEFAULT_MIN_LENGTH = 32
+# zlib only looks 32 KiB back, a larger dictionary is never used
+DEFAULT_DICTIONARY_SIZE = 32 * 1024
+MAX_NGRAM = 3
+
+# Dictionaries by key, shared by all the connections since keys are
+# content hashes
+_dictionaries = {NO_DICTIONARY_KEY: b''}
+
+
+def get_dictionary_key(dictionary):
+    """
+    Return the key of a dictionary stored in compressed translations.
+    """
+    if not dictionary:
+        return NO_DICTIONARY_KEY
+    return hashlib.sha256(dictionary).digest()[:KEY_SIZE]
+
+
+def add_dictionary(dictionary):
+    """
+    Make a dictionary available to decompress_text().
+
+    Returns:
+    key of the dictionary
+    """
+    key = get_dictionary_key(dictionary)
+    _dictionaries[key] = dictionary
+    return key
+
+
+def has_dictionary(key):
+    """
+    Check if decompress_text() knows the dictionary of a key.
+    """
+    return key in _dictionaries
+
+
+def train_dictionary(samples, size=DEFAULT_DICTIONARY_SIZE):
+    """
+    Build a zlib preset dictionary from sample texts, made of the word
+    n-grams that save the most bytes (repeats times length). The most
+    valuable n-grams are placed last, where zlib reaches them with the
+    shortest distances.
+
+    Returns:
+    dictionary bytes, empty if the samples share nothing
+    """
+    counts = Counter()
+    for text in samples:
+        words = text.split()
+        for length in range(1, MAX_NGRAM + 1):
+            for start in range(len(words) - length + 1):
+                counts[' '.join(words[start:start + length])] += 1
+    pieces = []
+    total = 0
+    for ngram, count in sorted(counts.items(), key=lambda item: (item[1] - 1) * len(item[0]), reverse=True):
+        if count < 2:
+            break
+        piece = (ngram + ' ').encode('utf-8')
+        if total + len(piece) > size:
+            continue
+        pieces.append(piece)
+        total += len(piece)
+    return b''.join(reversed(pieces))
+
+
+class TextCompressor:
+    """
+    Compresses translation texts with an optional preset dictionary.
+    """
+
+    def __init__(self, dictionary=b'', level=DEFAULT_LEVEL, min_length=DEFAULT_MIN_LENGTH):
+        self.dictionary = dictionary or b''
+        self.key = add_dictionary(self.dictionary)
+        self.level = int(level)
+        self.min_length = int(min_length)
+
+    def compress(self, text):
+        """
+        Return the compressed BLOB of a text, or the text itself when it
+        is shorter than min_length or does not get smaller.
+        """
+        if text is None or len(text) < self.min_length:
+            return text
+        if self.dictionary:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=self.dictionary)
+        else:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        data = compressor.compress(text.encode('utf-8')) + compressor.flush()
+        blob = bytes([COMPRESSED_FORMAT]) + self.key + data
+        if len(blob) >= len(text.encode('utf-8')):
+            return text
+        return blob
+
+
+def get_compressed_key(value):
+    """
+    Return the dictionary key of a compressed translation, or None if
+    the value is not compressed.
+    """
+    if isinstance(value, bytes) and len(value) > KEY_SIZE and value[0] == COMPRESSED_FORMAT:
+        return value[1:1 + KEY_SIZE]
+    return None
+
+
+def decompress_text(value):
+    """
+    Return the text of a translation, compressed or not.
+
+    Raises:
+    KeyError if the dictionary of the translation was not added
+    ValueError if the translation can not be decompressed
+    """
+    key = get_compressed_key(value)
+    if key is None:
+        return value
+    dictionary = _dictionaries[key]
+    try:
+        if dictionary:
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=dictionary)
+        else:
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        return (decompressor.decompress(value[1 + KEY_SIZE:]) + decompressor.flush()).decode('utf-8')
+    except (zlib.error, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid compressed translation: {e}") from e
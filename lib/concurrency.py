@@ -0,0 +1,165 @@
+"""
+HermeneisGPT library to run LLM requests concurrently with an
+adaptive concurrency limit.
+
+The number of requests in flight follows an AIMD (additive increase,
+multiplicative decrease) controller: it grows slowly while requests
+succeed under the target latency and is cut when requests are rate
+limited, time out, the server is overloaded or latency is too high.
+"""
+
+import time
+import logging
+import threading
+import openai
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import wait
+
+
+logger = logging.getLogger('hermeneis')
+
+DEFAULT_INITIAL = 1
+DEFAULT_MIN = 1
+DEFAULT_MAX = 32
+DEFAULT_TARGET_LATENCY = 30.0
+DEFAULT_INCREASE = 1.0
+DEFAULT_DECREASE = 0.5
+DEFAULT_COOLDOWN = 5.0
+
+
+def classify_error(err):
+    """
+    Classify a request error for the concurrency controller.
+
+    Returns:
+    'rate_limit', 'timeout', 'overload' or 'error'
+    """
+    if isinstance(err, openai.RateLimitError):
+        return 'rate_limit'
+    if isinstance(err, openai.APITimeoutError):
+        return 'timeout'
+    if isinstance(err, openai.InternalServerError):
+        return 'overload'
+    return 'error'
+
+
+class AIMDController:
+    """
+    Adaptive limit of requests in flight. Without a config the limit
+    is fixed to one request, i.e. requests run sequentially.
+
+    The cooldown is measured with clock, which simulations replace with
+    their own time, and limit changes are logged at log_level.
+    """
+
+    def __init__(self, concurrency_config=None, clock=time.monotonic, log_level=logging.INFO):
+        concurrency_config = concurrency_config or {'max': 1}
+        # At least one request in flight, or runs stall
+        self.min = max(1, int(concurrency_config.get('min', DEFAULT_MIN)))
+        self.max = max(self.min, int(concurrency_config.get('max', DEFAULT_MAX)))
+        self.limit = float(min(self.max, max(self.min, int(concurrency_config.get('initial', DEFAULT_INITIAL)))))
+        self.target_latency = float(concurrency_config.get('target_latency', DEFAULT_TARGET_LATENCY))
+        self.increase = float(concurrency_config.get('increase', DEFAULT_INCREASE))
+        self.decrease = float(concurrency_config.get('decrease', DEFAULT_DECREASE))
+        self.cooldown = float(concurrency_config.get('cooldown', DEFAULT_COOLDOWN))
+        self.last_decrease = None
+        self.clock = clock
+        self.log_level = log_level
+        self.lock = threading.Lock()
+
+    def get_limit(self):
+        """
+        Return the current number of requests allowed in flight.
+        """
+        return int(self.limit)
+
+    def _set_limit(self, limit, reason):
+        previous = int(self.limit)
+        self.limit = min(float(self.max), max(float(self.min), limit))
+        if int(self.limit) != previous:
+            logger.log(self.log_level, "Concurrency limit %s -> %s (%s)", previous, int(self.limit), reason)
+
+    def _decrease(self, reason):
+        # Cut once per cooldown, requests in flight fail together
+        now = self.clock()
+        if self.last_decrease is not None and now - self.last_decrease < self.cooldown:
+            return
+        self.last_decrease = now
+        self._set_limit(self.limit * self.decrease, reason)
+
+    def on_success(self, latency):
+        """
+        Update the limit after a successful request.
+        """
+        with self.lock:
+            if latency > self.target_latency:
+                self._decrease(f"latency {latency:.1f}s over target {self.target_latency:.1f}s")
+            else:
+                # Grows by 'increase' once every 'limit' successful requests
+                self._set_limit(self.limit + self.increase / self.limit, f"latency {latency:.1f}s")
+
+    def on_error(self, kind):
+        """
+        Update the limit after a failed request, see classify_error().
+        """
+        with self.lock:
+            if kind in ('rate_limit', 'timeout', 'overload'):
+                self._decrease(kind)
+
+
+def _timed(worker, job):
+    start = time.monotonic()
+    try:
+        result = worker(job)
+    except Exception as err:
+        return None, err, time.monotonic() - start
+    return result, None, time.monotonic() - start
+
+
+def run_concurrently(jobs, worker, controller):
+    """
+    Run worker(job) in threads for every job, with at most
+    controller.get_limit() jobs in flight.
+
+    Jobs are taken lazily from the iterable in the calling thread,
+    and results are yielded in the calling thread too, so both can
+    safely use a SQLite connection of that thread.
+
+    Parameters:
+    jobs: iterable of jobs
+    worker: function run in a thread for each job
+    controller: AIMDController
+
+    Yields:
+    (job, result, error) in completion order, error is the exception
+    raised by the worker or None
+    """
+    executor = ThreadPoolExecutor(max_workers=controller.max, thread_name_prefix='translation')
+    jobs = iter(jobs)
+    pending = {}
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < controller.get_limit():
+                try:
+                    job = next(jobs)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[executor.submit(_timed, worker, job)] = job
+
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = pending.pop(future)
+                result, error, latency = future.result()
+                if error is None:
+                    controller.on_success(latency)
+                else:
+                    controller.on_error(classify_error(error))
+                yield job, result, error
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -2,8 +2,55 @@
 HermeneisGPT library of functions to handle SQLite DB transactions.
 """
 
+import os
+import re
+import json
+import hashlib
 import sqlite3
+from urllib.parse import quote
 from datetime import datetime
+from lib.compression import DEFAULT_LEVEL
+from lib.compression import DEFAULT_MIN_LENGTH
+from lib.compression import DEFAULT_DICTIONARY_SIZE
+from lib.compression import TextCompressor
+from lib.compression import add_dictionary
+from lib.compression import has_dictionary
+from lib.compression import get_compressed_key
+from lib.compression import get_dictionary_key
+from lib.compression import decompress_text
+from lib.compression import train_dictionary
+
+
+UPSERT_TRANSLATION_QUERY = """
+INSERT OR REPLACE INTO message_translation (translation_id, message_id, translation_parameters_id, translation_text, translation_timestamp)
+VALUES (
+    (SELECT translation_id FROM message_translation WHERE message_id = ? AND translation_parameters_id = ?),
+    ?, ?, ?, ?
+)
+"""
+
+# Columns added to existing tables after their first release, added to
+# older DBs before the schema is applied: (table, column, type)
+SCHEMA_MIGRATIONS = (
+    ('translation_parameters', 'translation_config_fingerprint', 'TEXT'),
+    ('message_translation', 'source_edit_date', 'TIMESTAMPTZ(0)'),
+    ('message_translation', 'source_sha256', 'TEXT'),
+)
+
+# Tables whose constraints changed after their first release, rebuilt
+# from the schema when they lack the column: (table, column)
+SCHEMA_REBUILDS = (
+    ('translation_parameters', 'translation_parameters_sha256'),
+)
+
+# Translations sampled to train a compression dictionary, at least
+# DEFAULT_MIN_DICTIONARY_SAMPLES
+DEFAULT_DICTIONARY_SAMPLES = 5000
+DEFAULT_MIN_DICTIONARY_SAMPLES = 100
+
+# Name of the attached source DB when translations are written to a separate DB
+SOURCE_SCHEMA = 'source'
+DEFAULT_SOURCE_MMAP_SIZE = 256 * 1024 * 1024
 
 
 def get_db_connection(db_path):
@@ -30,6 +77,47 @@ def get_db_connection(db_path):
         raise
 
 
+def get_split_db_connection(output_db_path, source_db_path, source_immutable=False, source_mmap_size=DEFAULT_SOURCE_MMAP_SIZE):
+    """
+    Create a SQLite DB connection to an output DB where translations
+    are written, with the scraped source DB attached read-only.
+
+    Unqualified table names are looked up in the output DB first and
+    then in the source DB, so queries joining messages and
+    translations work across both files. The output DB must not
+    contain the source tables (channels, messages).
+
+    Args:
+    output_db_path (str)
+    source_db_path (str)
+    source_immutable (bool): only for source DBs that are not being
+    written anymore, SQLite then skips all locking on them
+    source_mmap_size (int): bytes of the source DB to memory map
+
+    Returns:
+    connection
+    cursor
+
+    Raises:
+    sqlite3.DatabaseError
+    """
+    if not os.path.isfile(source_db_path):
+        raise sqlite3.DatabaseError(f"Source database not found: {source_db_path}")
+
+    source_uri = f"file:{quote(os.path.abspath(source_db_path))}?mode=ro"
+    if source_immutable:
+        source_uri = source_uri + "&immutable=1"
+    try:
+        connection = sqlite3.connect(output_db_path, uri=True)
+        cursor = connection.cursor()
+        cursor.execute(f"ATTACH DATABASE ? AS {SOURCE_SCHEMA}", (source_uri,))
+        cursor.execute(f"PRAGMA {SOURCE_SCHEMA}.mmap_size = {int(source_mmap_size)}")
+        return connection, cursor
+    except sqlite3.DatabaseError as e:
+        print(f"Database error: {e}")
+        raise
+
+
 def check_channel_exists(cursor, channel_name):
     """
     Check if a given channel_name exists on the DB.
@@ -140,6 +228,7 @@ def create_tables_from_schema(connection, cursor, schema_file_path):
     """
     schema_sql = read_sql_from_file(schema_file_path)
     try:
+        migrate_schema(cursor, schema_sql)
         cursor.executescript(schema_sql)
         connection.commit()
     except sqlite3.OperationalError as e:
@@ -147,9 +236,166 @@ def create_tables_from_schema(connection, cursor, schema_file_path):
         raise sqlite3.OperationalError(e)
 
 
-def insert_translation_parameters(cursor, translation_tool_name, translation_tool_commit, translation_model, translation_config_sha256, translation_config):
+def get_table_columns(cursor, table_name):
+    """
+    Return the column names of a table.
+    """
+    cursor.execute(f"PRAGMA table_info({table_name})")
+    return [column[1] for column in cursor.fetchall()]
+
+
+def migrate_schema(cursor, schema_sql=None):
+    """
+    Rebuild the SCHEMA_REBUILDS tables with the definition of the
+    schema and add the SCHEMA_MIGRATIONS columns missing in existing
+    tables, so the indexes of the schema on these columns can be
+    created.
+
+    Parameters:
+    cursor
+    schema_sql: optional schema with the current table definitions,
+    tables are only rebuilt when it defines them
+
+    Raises:
+    sqlite3.OperationalError
+    """
+    # Older versions stored the config in each translation parameters
+    config_definition = get_table_definition(schema_sql or '', 'translation_config')
+    if config_definition is not None and check_table_exists(cursor, 'translation_parameters') \
+            and 'translation_config' in get_table_columns(cursor, 'translation_parameters'):
+        move_translation_configs(cursor, config_definition)
+
+    for table_name, column_name in SCHEMA_REBUILDS:
+        definition = get_table_definition(schema_sql or '', table_name)
+        if definition is None or not check_table_exists(cursor, table_name):
+            continue
+        if column_name not in get_table_columns(cursor, table_name):
+            rebuild_table(cursor, table_name, definition)
+            fill_translation_parameters_sha256(cursor)
+
+    for table_name, column_name, column_type in SCHEMA_MIGRATIONS:
+        if not check_table_exists(cursor, table_name):
+            continue
+        if column_name not in get_table_columns(cursor, table_name):
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}")
+
+
+def get_table_definition(schema_sql, table_name):
+    """
+    Return the column and constraint definitions of a table in a
+    schema, or None if the schema does not create the table.
+    """
+    match = re.search(rf"CREATE TABLE IF NOT EXISTS {table_name} \((.*?)\n\);", schema_sql, re.DOTALL)
+    return match.group(1) if match else None
+
+
+def rebuild_table(cursor, table_name, definition):
     """
-    Inserts a new entry into the translation_parameters table.
+    Recreate a table with a new definition, keeping its rows. Columns
+    new to the table get their default value. The new table is renamed
+    to the old name once the old one is dropped, so the foreign keys of
+    other tables keep pointing to it.
+
+    Parameters:
+    cursor
+    table_name
+    definition: column and constraint definitions, see get_table_definition()
+
+    Raises:
+    sqlite3.OperationalError
+    """
+    rebuilt_name = f"{table_name}_rebuild"
+    columns = get_table_columns(cursor, table_name)
+    cursor.execute(f"DROP TABLE IF EXISTS {rebuilt_name}")
+    cursor.execute(f"CREATE TABLE {rebuilt_name} ({definition}\n)")
+    kept = ', '.join(column for column in get_table_columns(cursor, rebuilt_name) if column in columns)
+    cursor.execute(f"INSERT INTO {rebuilt_name} ({kept}) SELECT {kept} FROM {table_name}")
+    cursor.execute(f"DROP TABLE {table_name}")
+    cursor.execute(f"ALTER TABLE {rebuilt_name} RENAME TO {table_name}")
+
+
+def move_translation_configs(cursor, definition):
+    """
+    Copy the configs stored in translation_parameters by older versions
+    to the translation_config table, once per config SHA256.
+
+    Parameters:
+    cursor
+    definition: column definitions of translation_config, see get_table_definition()
+
+    Raises:
+    sqlite3.OperationalError
+    """
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS translation_config ({definition}\n)")
+    cursor.execute("""
+    INSERT OR IGNORE INTO translation_config (translation_config_sha256, translation_config)
+    SELECT translation_config_sha256, translation_config FROM translation_parameters
+    WHERE translation_config_sha256 IS NOT NULL
+    ORDER BY translation_parameters_id
+    """)
+
+
+def get_translation_parameters_sha256(translation_tool_name, translation_tool_commit, translation_model, translation_config_sha256, translation_language=''):
+    """
+    Return the SHA256 identifying a set of translation parameters. The
+    config is identified by its SHA256.
+    """
+    identity = [translation_tool_name, translation_tool_commit, translation_model, translation_config_sha256, translation_language or '']
+    return hashlib.sha256(json.dumps(identity, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def fill_translation_parameters_sha256(cursor):
+    """
+    Compute the identity SHA256 of the translation parameters stored
+    without it.
+
+    Raises:
+    sqlite3.OperationalError
+    """
+    cursor.execute("""
+    SELECT translation_parameters_id, translation_tool_name, translation_tool_commit, translation_model,
+           translation_config_sha256, translation_language
+    FROM translation_parameters WHERE translation_parameters_sha256 IS NULL
+    """)
+    updates = [(get_translation_parameters_sha256(*row[1:]), row[0]) for row in cursor.fetchall()]
+    cursor.executemany("UPDATE translation_parameters SET translation_parameters_sha256 = ? WHERE translation_parameters_id = ?", updates)
+
+
+def get_translation_parameters_id(cursor, translation_config_fingerprint):
+    """
+    Retrieve the oldest translation parameters with the given
+    fingerprint.
+
+    Returns:
+    translation_parameters_id, or None
+
+    Raises:
+    sqlite3.OperationalError
+    """
+    query = """
+    SELECT translation_parameters_id FROM translation_parameters
+    WHERE translation_config_fingerprint = ?
+    ORDER BY translation_parameters_id LIMIT 1
+    """
+    try:
+        cursor.execute(query, (translation_config_fingerprint,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+    except sqlite3.OperationalError as e:
+        raise sqlite3.OperationalError(f"Operational error retrieving translation parameters: {e}")
+
+
+def insert_translation_parameters(cursor, translation_tool_name, translation_tool_commit, translation_model, translation_config_sha256, translation_config, translation_config_fingerprint=None,
+                                  translation_language=''):
+    """
+    Inserts a new entry into the translation_parameters table, and its
+    config into the translation_config table if it is not stored yet.
+    Existing parameters are found by their identity SHA256, see
+    get_translation_parameters_sha256().
+
+    When a fingerprint is given and parameters with the same
+    fingerprint exist, the oldest are returned instead so their
+    translations are reused.
 
     Parameters:
     cursor
@@ -158,23 +404,39 @@ def insert_translation_parameters(cursor, translation_tool_name, translation_too
     translation_model
     translation_config_sha256
     translation_config
+    translation_config_fingerprint: see lib.fingerprint_utils
+    translation_language: target language of a multi-language config,
+    empty for the language of the prompt
 
     Returns:
     lastrowid
     """
+    config_query = """
+    INSERT OR IGNORE INTO translation_config (translation_config_sha256, translation_config)
+    VALUES (?, ?)
+    """
     insert_query = """
     INSERT OR IGNORE INTO translation_parameters
-    (translation_tool_name, translation_tool_commit, translation_model, translation_config_sha256, translation_config)
-    VALUES (?, ?, ?, ?, ?)
+    (translation_parameters_sha256, translation_tool_name, translation_tool_commit, translation_model, translation_config_sha256,
+     translation_config_fingerprint, translation_language)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    """
+    select_query = """
+    SELECT translation_parameters_id FROM translation_parameters
+    WHERE translation_parameters_sha256 = ?
     """
+    translation_parameters_sha256 = get_translation_parameters_sha256(translation_tool_name, translation_tool_commit, translation_model,
+                                                                      translation_config_sha256, translation_language)
     try:
-        cursor.execute(insert_query, (translation_tool_name, translation_tool_commit, translation_model, translation_config_sha256, translation_config))
+        if translation_config_fingerprint is not None:
+            translation_parameters_id = get_translation_parameters_id(cursor, translation_config_fingerprint)
+            if translation_parameters_id is not None:
+                return translation_parameters_id
+        cursor.execute(config_query, (translation_config_sha256, translation_config))
+        cursor.execute(insert_query, (translation_parameters_sha256, translation_tool_name, translation_tool_commit, translation_model,
+                                      translation_config_sha256, translation_config_fingerprint, translation_language or ''))
         # Retrieve the ID of the existing or newly inserted row
-        select_query = """
-        SELECT translation_parameters_id FROM translation_parameters
-        WHERE translation_tool_name=? AND translation_tool_commit=? AND translation_model=? AND translation_config_sha256=? AND translation_config=?
-        """
-        cursor.execute(select_query, (translation_tool_name, translation_tool_commit, translation_model, translation_config_sha256, translation_config))
+        cursor.execute(select_query, (translation_parameters_sha256,))
         translation_parameters_id = cursor.fetchone()[0]
 
         return translation_parameters_id
@@ -219,10 +481,48 @@ def get_channel_messages(cursor, channel_name):
         raise
 
 
+def get_pending_channel_messages(cursor, channel_name, translation_parameters_id):
+    """
+    Function to retrieve messages from DB matching a channel name
+    that have no translation with the given translation_parameters_id.
+
+    Parameters:
+    cursor
+    channel_name
+    translation_parameters_id
+
+    Returns:
+    messages
+
+    Raises:
+    sqlerrors various
+    """
+    query = """
+    SELECT m.message_id, m.message_text
+    FROM messages m
+    JOIN channels c ON m.channel_id = c.channel_id
+    LEFT JOIN message_translation mt
+        ON mt.message_id = m.message_id AND mt.translation_parameters_id = ?
+    WHERE c.channel_name = ? AND mt.translation_text IS NULL
+    """
+
+    try:
+        cursor.execute(query, (translation_parameters_id, channel_name))
+        return cursor.fetchall()
+    except sqlite3.IntegrityError:
+        raise
+    except sqlite3.OperationalError:
+        raise
+    except sqlite3.ProgrammingError:
+        raise
+    except sqlite3.DatabaseError:
+        raise
+
+
 def exists_translation_for_message(cursor, message_id, translation_parameters_id):
     """
     Check if a translation exists for the message with given
-    translation_parameters_id.
+    translation_parameters_id. NULL translations do not count.
 
     Parameters:
     cursor
@@ -238,7 +538,7 @@ def exists_translation_for_message(cursor, message_id, translation_parameters_id
     query = """
     SELECT COUNT(*)
     FROM message_translation
-    WHERE message_id = ? AND translation_parameters_id = ?
+    WHERE message_id = ? AND translation_parameters_id = ? AND translation_text IS NOT NULL
     """
 
     try:
@@ -254,7 +554,7 @@ def exists_translation_for_message(cursor, message_id, translation_parameters_id
         raise
 
 
-def upsert_message_translation(cursor, message_id, translation_parameters_id, translation_text):
+def upsert_message_translation(cursor, message_id, translation_parameters_id, translation_text, compressor=None):
     """
     Inserts or updates a translation in the message_translations table
     based on the uniqueness of message_id and translation_parameters_id.
@@ -264,6 +564,7 @@ def upsert_message_translation(cursor, message_id, translation_parameters_id, tr
     message_id
     translation_parameters_id
     translation_text
+    compressor: optional TextCompressor, see get_text_compressor()
 
     Returns:
 
@@ -273,23 +574,16 @@ def upsert_message_translation(cursor, message_id, translation_parameters_id, tr
     """
     translation_timestamp = datetime.utcnow().isoformat()
 
-    query = """
-    INSERT OR REPLACE INTO message_translation (translation_id, message_id, translation_parameters_id, translation_text, translation_timestamp)
-    VALUES (
-        (SELECT translation_id FROM message_translation WHERE message_id = ? AND translation_parameters_id = ?),
-        ?, ?, ?, ?
-    )
-    """
     try:
         params = (
             message_id,
             translation_parameters_id,
             message_id,
             translation_parameters_id,
-            translation_text,
+            encode_translation_text(translation_text, compressor),
             translation_timestamp
         )
-        cursor.execute(query, params)
+        cursor.execute(UPSERT_TRANSLATION_QUERY, params)
 
         return cursor.lastrowid
     except sqlite3.IntegrityError:
@@ -298,3 +592,175 @@ def upsert_message_translation(cursor, message_id, translation_parameters_id, tr
         raise
     except sqlite3.DatabaseError:
         raise
+
+
+def upsert_message_translations(cursor, translation_parameters_id, translations, compressor=None):
+    """
+    Bulk version of upsert_message_translation() for many messages
+    with the same translation_parameters_id.
+
+    Parameters:
+    cursor
+    translation_parameters_id
+    translations: list of (message_id, translation_text)
+    compressor: optional TextCompressor, see get_text_compressor()
+
+    Raises:
+    sqlerrors various
+    """
+    translation_timestamp = datetime.utcnow().isoformat()
+    try:
+        cursor.executemany(UPSERT_TRANSLATION_QUERY,
+                           [(message_id, translation_parameters_id, message_id, translation_parameters_id,
+                             encode_translation_text(translation_text, compressor), translation_timestamp)
+                            for message_id, translation_text in translations])
+    except sqlite3.IntegrityError:
+        raise
+    except sqlite3.OperationalError:
+        raise
+    except sqlite3.DatabaseError:
+        raise
+
+
+def encode_translation_text(translation_text, compressor=None):
+    """
+    Return the value stored for a translation text, compressed when a
+    TextCompressor is given.
+    """
+    if compressor is None:
+        return translation_text
+    return compressor.compress(translation_text)
+
+
+def decode_translation_text(cursor, value):
+    """
+    Return the text of a stored translation, compressed or not. The
+    dictionaries of the DB are loaded on first use.
+
+    Raises:
+    ValueError if the translation can not be decompressed
+    """
+    key = get_compressed_key(value)
+    if key is not None and not has_dictionary(key):
+        # A new cursor leaves the rows being read by the caller alone
+        load_compression_dictionaries(cursor.connection.cursor())
+        if not has_dictionary(key):
+            raise ValueError("Compression dictionary of the translation not found")
+    return decompress_text(value)
+
+
+def load_compression_dictionaries(cursor):
+    """
+    Make the compression dictionaries stored in the DB available to
+    decode_translation_text().
+
+    Raises:
+    sqlite3.OperationalError
+    """
+    if not check_table_exists(cursor, 'compression_dictionary'):
+        return
+    cursor.execute("SELECT dictionary FROM compression_dictionary")
+    for (dictionary,) in cursor.fetchall():
+        add_dictionary(dictionary or b'')
+
+
+def is_compressed_db(cursor):
+    """
+    Check if translations of the DB may be compressed, once compression
+    is enabled a dictionary (maybe empty) is always stored.
+    """
+    if not check_table_exists(cursor, 'compression_dictionary'):
+        return False
+    cursor.execute("SELECT 1 FROM compression_dictionary LIMIT 1")
+    return cursor.fetchone() is not None
+
+
+def register_text_functions(cursor):
+    """
+    Make decompress_text() available to the SQL queries and triggers of
+    the connection of the cursor, with the dictionaries of the DB.
+    """
+    load_compression_dictionaries(cursor)
+    cursor.connection.create_function('decompress_text', 1, decompress_text, deterministic=True)
+
+
+def get_translation_texts(cursor, limit=DEFAULT_DICTIONARY_SAMPLES):
+    """
+    Retrieve the most recent translation texts, decompressed.
+
+    Raises:
+    sqlite3.OperationalError
+    """
+    cursor.execute("""
+    SELECT translation_text FROM message_translation
+    WHERE translation_text IS NOT NULL
+    ORDER BY translation_id DESC
+    LIMIT ?
+    """, (limit,))
+    return [decode_translation_text(cursor, value) for (value,) in cursor.fetchall()]
+
+
+def get_text_compressor(cursor, compression_config=None):
+    """
+    Build the TextCompressor of the 'compression' config section with
+    the latest dictionary of the DB. A dictionary is trained on the
+    translations of the DB and stored when there is none yet and
+    enough translations to learn from.
+
+    Raises:
+    sqlite3.OperationalError
+    """
+    compression_config = compression_config if isinstance(compression_config, dict) else {}
+    dictionary_size = int(compression_config.get('dictionary_size', DEFAULT_DICTIONARY_SIZE))
+    try:
+        load_compression_dictionaries(cursor)
+        cursor.execute("SELECT dictionary FROM compression_dictionary ORDER BY rowid DESC LIMIT 1")
+        row = cursor.fetchone()
+        dictionary = (row[0] or b'') if row else None
+        if not dictionary and dictionary_size:
+            samples = get_translation_texts(cursor, int(compression_config.get('dictionary_samples', DEFAULT_DICTIONARY_SAMPLES)))
+            if len(samples) >= int(compression_config.get('min_dictionary_samples', DEFAULT_MIN_DICTIONARY_SAMPLES)):
+                dictionary = train_dictionary(samples, dictionary_size)
+        if row is None or dictionary:
+            cursor.execute("""
+            INSERT OR IGNORE INTO compression_dictionary (dictionary_key, dictionary, dictionary_timestamp)
+            VALUES (?, ?, ?)
+            """, (get_dictionary_key(dictionary or b''), dictionary or b'', datetime.utcnow().isoformat()))
+    except sqlite3.OperationalError as e:
+        raise sqlite3.OperationalError(f"Operational error loading the compression dictionary: {e}")
+    return TextCompressor(dictionary or b'', compression_config.get('level', DEFAULT_LEVEL),
+                          compression_config.get('min_length', DEFAULT_MIN_LENGTH))
+
+
+def compress_translations(cursor, compressor, chunk_size=1000):
+    """
+    Compress the translations stored as plain text.
+
+    Returns:
+    number of translations compressed
+
+    Raises:
+    sqlite3.OperationalError
+    """
+    select_query = """
+    SELECT translation_id, translation_text FROM message_translation
+    WHERE translation_id > ? AND typeof(translation_text) = 'text'
+    ORDER BY translation_id
+    LIMIT ?
+    """
+    compressed = 0
+    last_translation_id = 0
+    try:
+        while True:
+            cursor.execute(select_query, (last_translation_id, chunk_size))
+            rows = cursor.fetchall()
+            if not rows:
+                return compressed
+            last_translation_id = rows[-1][0]
+            updates = [(value, translation_id) for translation_id, value in
+                       ((translation_id, compressor.compress(text)) for translation_id, text in rows)
+                       if isinstance(value, bytes)]
+            cursor.executemany("UPDATE message_translation SET translation_text = ? WHERE translation_id = ?", updates)
+            compressed += len(updates)
+    except sqlite3.OperationalError as e:
+        raise sqlite3.OperationalError(f"Operational error compressing translations: {e}")
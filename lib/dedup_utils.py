@@ -0,0 +1,264 @@
+"""
+HermeneisGPT library of functions to detect near-duplicate messages.
+
+Hacktivist channels repeat the same announcement templates changing
+only targets or dates. A MinHash signature with LSH banding is stored
+for every translated message so a new message can be matched against
+them and reuse (or be guided by) a previous translation.
+"""
+
+import re
+import random
+import struct
+import sqlite3
+import hashlib
+import difflib
+from array import array
+from lib.db_utils import decode_translation_text
+
+
+# MinHash parameters. Changing them invalidates the stored index.
+NUM_PERMUTATIONS = 64
+NUM_BANDS = 16
+SHINGLE_SIZE = 2
+MAX_CANDIDATES = 50
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+# Fixed seed so signatures are comparable between runs
+_rng = random.Random(57016)
+_PERMUTATIONS = [(_rng.randint(1, _MERSENNE_PRIME - 1), _rng.randint(0, _MERSENNE_PRIME - 1))
+                 for _ in range(NUM_PERMUTATIONS)]
+
+
+def get_shingles(text, size=SHINGLE_SIZE):
+    """
+    Split a text in a set of lowercase word n-grams.
+
+    Parameters:
+    text
+    size
+
+    Returns:
+    set
+    """
+    words = re.findall(r'\w+', text.lower())
+    if len(words) <= size:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def compute_minhash(text):
+    """
+    Compute the MinHash signature of a text.
+
+    Parameters:
+    text
+
+    Returns:
+    list of NUM_PERMUTATIONS integers, or None if the
+    text has no words
+    """
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'little')
+              for shingle in get_shingles(text)]
+    if not hashes:
+        return None
+    return [min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+            for a, b in _PERMUTATIONS]
+
+
+def get_minhash_bands(signature):
+    """
+    Split a MinHash signature in LSH bands and hash each band
+    into a signed 64-bit bucket that fits a SQLite INTEGER.
+
+    Returns:
+    list of (band, bucket)
+    """
+    rows = NUM_PERMUTATIONS // NUM_BANDS
+    bands = []
+    for band in range(NUM_BANDS):
+        band_values = struct.pack(f'<{rows}I', *signature[band * rows:(band + 1) * rows])
+        bucket = int.from_bytes(hashlib.blake2b(band_values, digest_size=8).digest(), 'little', signed=True)
+        bands.append((band, bucket))
+    return bands
+
+
+def estimate_similarity(signature_a, signature_b):
+    """
+    Estimate the Jaccard similarity of two texts from
+    their MinHash signatures.
+    """
+    matches = sum(1 for a, b in zip(signature_a, signature_b) if a == b)
+    return matches / NUM_PERMUTATIONS
+
+
+def _pack_signature(signature):
+    return array('I', signature).tobytes()
+
+
+def _unpack_signature(blob):
+    signature = array('I')
+    signature.frombytes(blob)
+    return signature.tolist()
+
+
+def index_message_minhash(cursor, message_id, message_text):
+    """
+    Store or replace the MinHash signature and LSH bands of a message.
+
+    Parameters:
+    cursor
+    message_id
+    message_text
+
+    Returns:
+    bool, False when the message has no words to index
+
+    Raises:
+    sqlerrors various
+    """
+    signature = compute_minhash(message_text)
+    if signature is None:
+        return False
+
+    try:
+        cursor.execute("INSERT OR REPLACE INTO message_minhash (message_id, minhash_signature) VALUES (?, ?)",
+                       (message_id, _pack_signature(signature)))
+        cursor.execute("DELETE FROM message_minhash_band WHERE message_id = ?", (message_id,))
+        cursor.executemany("INSERT INTO message_minhash_band (band, bucket, message_id) VALUES (?, ?, ?)",
+                           [(band, bucket, message_id) for band, bucket in get_minhash_bands(signature)])
+        return True
+    except sqlite3.IntegrityError:
+        raise
+    except sqlite3.OperationalError:
+        raise
+    except sqlite3.DatabaseError:
+        raise
+
+
+def index_translated_messages(cursor):
+    """
+    Index the messages that have a translation but are not yet
+    in the near-duplicate index. Keeps the index up to date with
+    translations written by previous runs or other tools.
+
+    Parameters:
+    cursor
+
+    Returns:
+    number of messages indexed
+
+    Raises:
+    sqlerrors various
+    """
+    query = """
+    SELECT DISTINCT m.message_id, m.message_text
+    FROM message_translation mt
+    JOIN messages m ON m.message_id = mt.message_id
+    LEFT JOIN message_minhash s ON s.message_id = mt.message_id
+    WHERE s.message_id IS NULL AND mt.translation_text IS NOT NULL AND m.message_text IS NOT NULL
+    """
+    try:
+        cursor.execute(query)
+        pending = cursor.fetchall()
+        indexed = 0
+        for message_id, message_text in pending:
+            if index_message_minhash(cursor, message_id, message_text):
+                indexed = indexed + 1
+        return indexed
+    except sqlite3.IntegrityError:
+        raise
+    except sqlite3.OperationalError:
+        raise
+    except sqlite3.DatabaseError:
+        raise
+
+
+def find_near_duplicate(cursor, translation_parameters_id, message_text, min_similarity, message_id=None):
+    """
+    Find the most similar already translated message with the
+    given translation_parameters_id.
+
+    Parameters:
+    cursor
+    translation_parameters_id
+    message_text
+    min_similarity: estimated Jaccard similarity between 0 and 1
+    message_id: optional, excluded from the candidates
+
+    Returns:
+    (message_id, similarity, message_text, translation_text) or None
+
+    Raises:
+    sqlerrors various
+    """
+    signature = compute_minhash(message_text)
+    if signature is None:
+        return None
+
+    bands = get_minhash_bands(signature)
+    band_filter = " OR ".join(["(band = ? AND bucket = ?)"] * len(bands))
+    candidates_query = f"""
+    SELECT b.message_id, s.minhash_signature
+    FROM message_minhash_band b
+    JOIN message_minhash s ON s.message_id = b.message_id
+    WHERE {band_filter}
+    GROUP BY b.message_id
+    ORDER BY COUNT(*) DESC
+    LIMIT ?
+    """
+    translation_query = """
+    SELECT m.message_text, mt.translation_text
+    FROM message_translation mt
+    JOIN messages m ON m.message_id = mt.message_id
+    WHERE mt.message_id = ? AND mt.translation_parameters_id = ? AND mt.translation_text IS NOT NULL
+    """
+    try:
+        params = [value for band in bands for value in band]
+        cursor.execute(candidates_query, params + [MAX_CANDIDATES])
+        candidates = [(estimate_similarity(signature, _unpack_signature(blob)), candidate_id)
+                      for candidate_id, blob in cursor.fetchall()
+                      if candidate_id != message_id]
+
+        # Best candidates first, the first one translated with these parameters wins
+        for similarity, candidate_id in sorted(candidates, reverse=True):
+            if similarity < min_similarity:
+                break
+            cursor.execute(translation_query, (candidate_id, translation_parameters_id))
+            result = cursor.fetchone()
+            if result:
+                return candidate_id, similarity, result[0], decode_translation_text(cursor, result[1])
+        return None
+    except sqlite3.IntegrityError:
+        raise
+    except sqlite3.OperationalError:
+        raise
+    except sqlite3.DatabaseError:
+        raise
+
+
+def build_translation_hint(previous_text, previous_translation, message_text, max_changes=20):
+    """
+    Build a short hint for the LLM with the translation of a near
+    duplicate and the word-level changes between both originals.
+    """
+    previous_words = previous_text.split()
+    message_words = message_text.split()
+    changes = []
+    matcher = difflib.SequenceMatcher(a=previous_words, b=message_words, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        if i2 > i1:
+            changes.append("- " + " ".join(previous_words[i1:i2]))
+        if j2 > j1:
+            changes.append("+ " + " ".join(message_words[j1:j2]))
+    if len(changes) > max_changes:
+        changes = changes[:max_changes] + ["(more changes omitted)"]
+
+    return ("A near-identical message was translated before. Keep the same wording "
+            "and only adapt the parts of the original that changed.\n"
+            f"Previous translation:\n{previous_translation}\n"
+            "Changes in the original text (- removed, + added):\n" + "\n".join(changes))
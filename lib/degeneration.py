@@ -0,0 +1,101 @@
+"""
+HermeneisGPT library to detect degenerate LLM output while it streams.
+
+Models sometimes loop on a phrase until max_tokens. With the
+'streaming' config section, translations are streamed and checked as
+they grow for:
+
+- repetition: the end of the output is the same unit repeated
+  min_repeats times, and the source has no such repetition
+- runaway length: the output is much longer than the source
+
+A degenerate stream is closed right away, which stops the generation
+(and its billing) instead of waiting for max_tokens.
+"""
+
+
+DEFAULT_MAX_LENGTH_RATIO = 3.0
+DEFAULT_MIN_LENGTH = 200
+DEFAULT_MIN_REPEATS = 4
+DEFAULT_MAX_PERIOD = 100
+DEFAULT_MIN_REPEAT_CHARS = 40
+DEFAULT_CHECK_INTERVAL = 32
+
+
+class DegenerateOutputError(ValueError):
+    """
+    The LLM output degenerated and the request was aborted.
+    """
+
+    def __init__(self, reason, partial_translation=''):
+        super().__init__(f"Degenerate translation aborted ({reason}) after {len(partial_translation)} characters")
+        self.reason = reason
+        self.partial_translation = partial_translation
+
+
+def find_repetition(text, min_repeats=DEFAULT_MIN_REPEATS, max_period=DEFAULT_MAX_PERIOD, min_repeat_chars=DEFAULT_MIN_REPEAT_CHARS):
+    """
+    Find a unit repeated at least min_repeats times in a row at the
+    end of the text, covering at least min_repeat_chars characters.
+
+    Returns:
+    the repeated end of the text, or None
+    """
+    for period in range(1, max_period + 1):
+        repeats = max(min_repeats, -(-min_repeat_chars // period))
+        span = period * repeats
+        if span > len(text):
+            break
+        unit = text[-period:]
+        if unit * repeats == text[-span:] and unit.strip():
+            return text[-span:]
+    return None
+
+
+class DegenerationDetector:
+    """
+    Checks a streamed translation as chunks arrive.
+    """
+
+    def __init__(self, source, streaming_config=None):
+        streaming_config = streaming_config or {}
+        self.source = source
+        self.max_length = int(float(streaming_config.get('max_length_ratio', DEFAULT_MAX_LENGTH_RATIO)) * len(source)
+                              + int(streaming_config.get('min_length', DEFAULT_MIN_LENGTH)))
+        self.min_repeats = int(streaming_config.get('min_repeats', DEFAULT_MIN_REPEATS))
+        self.max_period = int(streaming_config.get('max_period', DEFAULT_MAX_PERIOD))
+        self.min_repeat_chars = int(streaming_config.get('min_repeat_chars', DEFAULT_MIN_REPEAT_CHARS))
+        self.check_interval = int(streaming_config.get('check_interval', DEFAULT_CHECK_INTERVAL))
+        self.chunks = []
+        self.length = 0
+        self.checked_length = 0
+
+    def get_text(self):
+        """
+        Return the output received so far.
+        """
+        return ''.join(self.chunks)
+
+    def feed(self, chunk):
+        """
+        Add a chunk of output.
+
+        Returns:
+        None, or the reason the output is degenerate: 'repetition' or
+        'length'
+        """
+        self.chunks.append(chunk)
+        self.length += len(chunk)
+        if self.length > self.max_length:
+            return 'length'
+        if self.length - self.checked_length < self.check_interval:
+            return None
+        self.checked_length = self.length
+        # Only the end of the output can hold the repetition
+        window = self.max_period * self.min_repeats + self.min_repeat_chars
+        text = self.get_text()
+        self.chunks = [text]
+        repetition = find_repetition(text[-window:], self.min_repeats, self.max_period, self.min_repeat_chars)
+        if repetition is not None and repetition not in self.source:
+            return 'repetition'
+        return None
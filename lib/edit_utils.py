@@ -0,0 +1,143 @@
+"""
+HermeneisGPT library to find the translations of edited messages.
+
+Translations record the edit date and the SHA256 of the text of their
+source message when they are written. A message whose edit date
+changed since is retranslated if its text hash changed too, edits that
+keep the text (e.g. of buttons or links) only update the recorded edit
+date. Translations written before sources were recorded are
+retranslated if the message was edited after them.
+"""
+
+import hashlib
+import sqlite3
+from datetime import datetime
+from datetime import timezone
+
+
+# Chunk size of IN (...) queries, below the SQLite variable limit
+QUERY_CHUNK_SIZE = 500
+
+
+def get_text_sha256(text):
+    """
+    Return the SHA256 of a message text, or None for a NULL text.
+    """
+    if text is None:
+        return None
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def register_text_sha256(cursor):
+    """
+    Make get_text_sha256() available to the SQL queries of the
+    connection of the cursor as text_sha256().
+    """
+    cursor.connection.create_function('text_sha256', 1, get_text_sha256, deterministic=True)
+
+
+def parse_timestamp(value):
+    """
+    Parse an ISO timestamp of the DB, naive timestamps are UTC.
+
+    Raises:
+    ValueError
+    """
+    timestamp = datetime.fromisoformat(str(value))
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+def is_edited_after(message_edit_date, translation_timestamp):
+    """
+    Check if a message was edited after its translation. Unknown or
+    unparsable timestamps count as edited.
+    """
+    try:
+        return parse_timestamp(message_edit_date) > parse_timestamp(translation_timestamp)
+    except (TypeError, ValueError):
+        return True
+
+
+def record_translation_sources(cursor, translation_parameters_id, message_ids):
+    """
+    Record the current edit date and text hash of the source messages
+    in their translations.
+
+    Parameters:
+    cursor
+    translation_parameters_id
+    message_ids
+
+    Raises:
+    sqlite3.OperationalError
+    """
+    message_ids = list(message_ids)
+    register_text_sha256(cursor)
+    try:
+        for start in range(0, len(message_ids), QUERY_CHUNK_SIZE):
+            chunk = message_ids[start:start + QUERY_CHUNK_SIZE]
+            cursor.execute(f"""
+            UPDATE message_translation SET
+            source_edit_date = (SELECT m.message_edit_date FROM messages m WHERE m.message_id = message_translation.message_id),
+            source_sha256 = (SELECT text_sha256(m.message_text) FROM messages m WHERE m.message_id = message_translation.message_id)
+            WHERE translation_parameters_id = ? AND message_id IN ({','.join('?' * len(chunk))})
+            """, [translation_parameters_id] + chunk)
+    except sqlite3.OperationalError as e:
+        raise sqlite3.OperationalError(f"Operational error recording translation sources: {e}")
+
+
+def find_edited_translations(cursor, translation_parameters_id, channel_name=None):
+    """
+    Find the translated messages whose text changed since their
+    translation. Only messages whose edit date differs from the one
+    recorded in their translation are hashed, the recorded edit dates
+    are read from idx_message_translation_sources without loading the
+    translations. NULL translations must be moved to the failure queue
+    first, see lib.failure_utils.requeue_null_translations(). Those whose text did not
+    change get their new edit date recorded, so they are not checked
+    again.
+
+    Parameters:
+    cursor
+    translation_parameters_id
+    channel_name: optional, all channels when None
+
+    Returns:
+    list of (message_id, message_text) to retranslate
+
+    Raises:
+    sqlite3.OperationalError
+    """
+    query = """
+    SELECT mt.message_id, m.message_text, m.message_edit_date, mt.source_sha256, mt.translation_timestamp
+    FROM message_translation mt
+    JOIN messages m ON m.message_id = mt.message_id
+    JOIN channels c ON c.channel_id = m.channel_id
+    WHERE mt.translation_parameters_id = ?
+    AND m.message_edit_date IS NOT NULL AND m.message_edit_date IS NOT mt.source_edit_date
+    AND length(m.message_text) > 1
+    AND (? IS NULL OR c.channel_name = ?)
+    ORDER BY mt.message_id
+    """
+    try:
+        cursor.execute(query, (translation_parameters_id, channel_name, channel_name))
+        rows = cursor.fetchall()
+    except sqlite3.OperationalError as e:
+        raise sqlite3.OperationalError(f"Operational error retrieving edited messages: {e}")
+
+    edited = []
+    unchanged = []
+    for message_id, message_text, message_edit_date, source_sha256, translation_timestamp in rows:
+        if source_sha256 is not None:
+            changed = get_text_sha256(message_text) != source_sha256
+        else:
+            # Translated before sources were recorded
+            changed = is_edited_after(message_edit_date, translation_timestamp)
+        if changed:
+            edited.append((message_id, message_text))
+        else:
+            unchanged.append(message_id)
+    record_translation_sources(cursor, translation_parameters_id, unchanged)
+    return edited
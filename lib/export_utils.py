@@ -0,0 +1,184 @@
+"""
+HermeneisGPT library of functions to export translations.
+
+Translations are joined with their messages, channels and translation
+parameters and streamed in chunks to JSONL, CSV or Parquet, so memory
+use does not depend on the size of the DB.
+"""
+
+import csv
+import sys
+import json
+import sqlite3
+from lib.db_utils import decode_translation_text
+
+
+EXPORT_FORMATS = ('jsonl', 'csv', 'parquet')
+
+EXPORT_FIELDS = [
+    'channel_name',
+    'message_id',
+    'message_date',
+    'message_text',
+    'translation_id',
+    'translation_text',
+    'translation_timestamp',
+    'translation_parameters_id',
+    'translation_model',
+    'translation_tool_commit',
+]
+
+DEFAULT_CHUNK_SIZE = 5000
+
+
+def iterate_translations(cursor, since=None, channel_name=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Iterate over the translations joined with their message, channel
+    and translation parameters, fetching chunk_size rows at a time.
+
+    Parameters:
+    cursor
+    since: optional, only translations written after this ISO timestamp
+    channel_name: optional, only translations of this channel
+    chunk_size
+
+    Yields:
+    dict with EXPORT_FIELDS keys, ordered by translation timestamp
+
+    Raises:
+    sqlerrors various
+    """
+    query = """
+    SELECT c.channel_name, m.message_id, m.message_date, m.message_text,
+           mt.translation_id, mt.translation_text, mt.translation_timestamp,
+           mt.translation_parameters_id, tp.translation_model, tp.translation_tool_commit
+    FROM message_translation mt
+    JOIN messages m ON m.message_id = mt.message_id
+    LEFT JOIN channels c ON c.channel_id = m.channel_id
+    LEFT JOIN translation_parameters tp ON tp.translation_parameters_id = mt.translation_parameters_id
+    WHERE (? IS NULL OR mt.translation_timestamp > ?)
+      AND (? IS NULL OR c.channel_name = ?)
+    ORDER BY mt.translation_timestamp, mt.translation_id
+    """
+    try:
+        cursor.execute(query, (since, since, channel_name, channel_name))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                row = dict(zip(EXPORT_FIELDS, row))
+                row['translation_text'] = decode_translation_text(cursor, row['translation_text'])
+                yield row
+    except sqlite3.OperationalError:
+        raise
+    except sqlite3.ProgrammingError:
+        raise
+    except sqlite3.DatabaseError:
+        raise
+
+
+def export_jsonl(rows, output):
+    """
+    Write rows to a text stream as JSON lines.
+
+    Returns:
+    number of rows written
+    """
+    count = 0
+    for row in rows:
+        output.write(json.dumps(row, ensure_ascii=False) + '\n')
+        count = count + 1
+    return count
+
+
+def export_csv(rows, output):
+    """
+    Write rows to a text stream as CSV with a header.
+
+    Returns:
+    number of rows written
+    """
+    writer = csv.DictWriter(output, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count = count + 1
+    return count
+
+
+def export_parquet(rows, output_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Write rows to a Parquet file, one row group per chunk.
+
+    Returns:
+    number of rows written
+
+    Raises:
+    ImportError if pyarrow is not installed
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("pyarrow is required to export to Parquet: pip install pyarrow") from e
+
+    schema = pyarrow.schema([
+        ('channel_name', pyarrow.string()),
+        ('message_id', pyarrow.int64()),
+        ('message_date', pyarrow.string()),
+        ('message_text', pyarrow.string()),
+        ('translation_id', pyarrow.int64()),
+        ('translation_text', pyarrow.string()),
+        ('translation_timestamp', pyarrow.string()),
+        ('translation_parameters_id', pyarrow.int64()),
+        ('translation_model', pyarrow.string()),
+        ('translation_tool_commit', pyarrow.string()),
+    ])
+    count = 0
+    with pyarrow.parquet.ParquetWriter(output_path, schema) as writer:
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                writer.write_table(pyarrow.Table.from_pylist(chunk, schema=schema))
+                count = count + len(chunk)
+                chunk = []
+        if chunk or count == 0:
+            writer.write_table(pyarrow.Table.from_pylist(chunk, schema=schema))
+            count = count + len(chunk)
+    return count
+
+
+def export_translations(cursor, output_path, export_format='jsonl', since=None, channel_name=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Export translations to a file. JSONL and CSV can be written to
+    the standard output with output_path '-'.
+
+    Parameters:
+    cursor
+    output_path
+    export_format: 'jsonl', 'csv' or 'parquet'
+    since: optional, only translations written after this ISO timestamp
+    channel_name: optional, only translations of this channel
+    chunk_size
+
+    Returns:
+    number of rows exported
+
+    Raises:
+    ValueError if the format is unknown
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {export_format}")
+
+    rows = iterate_translations(cursor, since, channel_name, chunk_size)
+    if export_format == 'parquet':
+        return export_parquet(rows, output_path, chunk_size)
+
+    writer = export_jsonl if export_format == 'jsonl' else export_csv
+    if output_path == '-':
+        return writer(rows, sys.stdout)
+    with open(output_path, 'w', encoding='utf-8', newline='') as output:
+        return writer(rows, output)
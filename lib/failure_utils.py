@@ -0,0 +1,230 @@
+"""
+HermeneisGPT library of functions for the queue of failed translations.
+
+A message whose translation fails is recorded in translation_failure
+with the error, the number of attempts and the time of the next retry,
+instead of storing a NULL translation. The retry pass reprocesses only
+the failures that are due, with an exponential backoff between attempts.
+"""
+
+import sqlite3
+from datetime import datetime
+from datetime import timedelta
+
+
+DEFAULT_BASE_DELAY = 60
+DEFAULT_MAX_DELAY = 24 * 60 * 60
+DEFAULT_MAX_ATTEMPTS = 5
+
+# Longest error message stored, API errors may include whole responses
+MAX_ERROR_MESSAGE_LENGTH = 1000
+
+
+def get_retry_delay(attempt_count, retry_config=None):
+    """
+    Seconds to wait before the next attempt, doubling after every
+    failed attempt up to max_delay.
+
+    Parameters:
+    attempt_count: number of failed attempts so far
+    retry_config: 'retry' section of the YAML config
+
+    Returns:
+    delay in seconds
+    """
+    retry_config = retry_config or {}
+    base_delay = float(retry_config.get('base_delay', DEFAULT_BASE_DELAY))
+    max_delay = float(retry_config.get('max_delay', DEFAULT_MAX_DELAY))
+    return min(max_delay, base_delay * 2 ** max(0, attempt_count - 1))
+
+
+def record_translation_failure(cursor, message_id, translation_parameters_id, error, retry_config=None):
+    """
+    Record a failed translation, or one more failed attempt of an
+    already recorded failure, and schedule its next retry.
+
+    Parameters:
+    cursor
+    message_id
+    translation_parameters_id
+    error: exception raised by the translation
+    retry_config: 'retry' section of the YAML config
+
+    Returns:
+    attempt_count
+
+    Raises:
+    sqlerrors various
+    """
+    select_query = """
+    SELECT attempt_count
+    FROM translation_failure
+    WHERE message_id = ? AND translation_parameters_id = ?
+    """
+    upsert_query = """
+    INSERT INTO translation_failure (message_id, translation_parameters_id, error_class, error_message, attempt_count,
+                                     first_failure_timestamp, last_failure_timestamp, next_retry_timestamp)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(message_id, translation_parameters_id) DO UPDATE SET
+        error_class = excluded.error_class,
+        error_message = excluded.error_message,
+        attempt_count = excluded.attempt_count,
+        last_failure_timestamp = excluded.last_failure_timestamp,
+        next_retry_timestamp = excluded.next_retry_timestamp
+    """
+    now = datetime.utcnow()
+    try:
+        cursor.execute(select_query, (message_id, translation_parameters_id))
+        row = cursor.fetchone()
+        attempt_count = (row[0] if row else 0) + 1
+        next_retry = now + timedelta(seconds=get_retry_delay(attempt_count, retry_config))
+        cursor.execute(upsert_query, (message_id,
+                                      translation_parameters_id,
+                                      type(error).__name__,
+                                      str(error)[:MAX_ERROR_MESSAGE_LENGTH],
+                                      attempt_count,
+                                      now.isoformat(),
+                                      now.isoformat(),
+                                      next_retry.isoformat()))
+        return attempt_count
+    except sqlite3.IntegrityError:
+        raise
+    except sqlite3.OperationalError:
+        raise
+    except sqlite3.DatabaseError:
+        raise
+
+
+def clear_translation_failures(cursor, translation_parameters_id, message_ids):
+    """
+    Remove the failures of messages that were translated.
+
+    Parameters:
+    cursor
+    translation_parameters_id
+    message_ids: list of message IDs
+
+    Raises:
+    sqlerrors various
+    """
+    query = """
+    DELETE FROM translation_failure
+    WHERE message_id = ? AND translation_parameters_id = ?
+    """
+    try:
+        cursor.executemany(query, [(message_id, translation_parameters_id) for message_id in message_ids])
+    except sqlite3.IntegrityError:
+        raise
+    except sqlite3.OperationalError:
+        raise
+    except sqlite3.DatabaseError:
+        raise
+
+
+def get_failed_message_ids(cursor, translation_parameters_id):
+    """
+    Retrieve the IDs of the messages queued for retry, regular runs
+    skip them and leave them to the retry pass.
+
+    Returns:
+    set of message IDs
+
+    Raises:
+    sqlerrors various
+    """
+    query = """
+    SELECT message_id
+    FROM translation_failure
+    WHERE translation_parameters_id = ?
+    """
+    try:
+        cursor.execute(query, (translation_parameters_id,))
+        return {row[0] for row in cursor.fetchall()}
+    except sqlite3.IntegrityError:
+        raise
+    except sqlite3.OperationalError:
+        raise
+    except sqlite3.DatabaseError:
+        raise
+
+
+def get_due_translation_failures(cursor, translation_parameters_id, channel_name=None, max_attempts=DEFAULT_MAX_ATTEMPTS, limit=None):
+    """
+    Retrieve the failed messages whose next retry is due, oldest
+    retry first. Failures that reached max_attempts are not retried.
+
+    Parameters:
+    cursor
+    translation_parameters_id
+    channel_name: optional, only messages of this channel
+    max_attempts
+    limit: optional, maximum number of failures
+
+    Returns:
+    list of (message_id, message_text, attempt_count)
+
+    Raises:
+    sqlerrors various
+    """
+    query = """
+    SELECT f.message_id, m.message_text, f.attempt_count
+    FROM translation_failure f
+    JOIN messages m ON m.message_id = f.message_id
+    JOIN channels c ON c.channel_id = m.channel_id
+    WHERE f.translation_parameters_id = ?
+      AND f.next_retry_timestamp <= ?
+      AND f.attempt_count < ?
+      AND (? IS NULL OR c.channel_name = ?)
+    ORDER BY f.next_retry_timestamp
+    LIMIT ?
+    """
+    now = datetime.utcnow().isoformat()
+    try:
+        cursor.execute(query, (translation_parameters_id, now, max_attempts, channel_name, channel_name,
+                               -1 if limit is None else limit))
+        return cursor.fetchall()
+    except sqlite3.IntegrityError:
+        raise
+    except sqlite3.OperationalError:
+        raise
+    except sqlite3.DatabaseError:
+        raise
+
+
+def requeue_null_translations(cursor, translation_parameters_id):
+    """
+    Move the NULL translations stored by older versions to the failure
+    queue, so the retry pass picks them up.
+
+    Parameters:
+    cursor
+    translation_parameters_id
+
+    Returns:
+    number of translations moved
+
+    Raises:
+    sqlerrors various
+    """
+    insert_query = """
+    INSERT OR IGNORE INTO translation_failure (message_id, translation_parameters_id, error_class, error_message, attempt_count,
+                                               first_failure_timestamp, last_failure_timestamp, next_retry_timestamp)
+    SELECT message_id, translation_parameters_id, 'NullTranslation', 'NULL translation stored', 1,
+           translation_timestamp, translation_timestamp, ?
+    FROM message_translation
+    WHERE translation_parameters_id = ? AND translation_text IS NULL
+    """
+    delete_query = """
+    DELETE FROM message_translation
+    WHERE translation_parameters_id = ? AND translation_text IS NULL
+    """
+    try:
+        cursor.execute(insert_query, (datetime.utcnow().isoformat(), translation_parameters_id))
+        cursor.execute(delete_query, (translation_parameters_id,))
+        return cursor.rowcount
+    except sqlite3.IntegrityError:
+        raise
+    except sqlite3.OperationalError:
+        raise
+    except sqlite3.DatabaseError:
+        raise
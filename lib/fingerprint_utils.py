@@ -0,0 +1,186 @@
+"""
+HermeneisGPT library to fingerprint the translation config.
+
+The fingerprint only covers the fields of the config that change the
+output of the LLM: prompts, model, temperature and max_tokens, the
+limits of the 'token_budget' section, the degeneration thresholds and
+retries of the 'streaming' section, and the models, limits and
+validation of the 'routing' tiers. Missing settings count as their
+defaults. Runs whose configs share a fingerprint reuse the same
+translation parameters, and so the same translations, whatever the
+tool commit, the log file or the YAML formatting.
+
+Left out on purpose: the output/input ratio learned by token_budget
+from the translations of the DB (not part of the config), and the
+sections that only change how requests are sent (client, hedging,
+concurrency, retry, pricing) or reuse translations made with the same
+parameters (near_duplicates, translation_memory).
+
+With several target languages, each language has its own fingerprint
+and translation parameters.
+"""
+
+import json
+import hashlib
+import logging
+import sqlite3
+import yaml
+from lib import token_budget
+from lib import degeneration
+from lib.routing import DEFAULT_MAX_UNTRANSLATED_RATIO
+from lib.routing import DEFAULT_TECHNICAL_TERMS
+from lib.translator import DEFAULT_DEGENERATE_RETRIES
+from lib.translator import DEFAULT_RETRY_TEMPERATURE
+
+
+logger = logging.getLogger('hermeneis')
+
+FINGERPRINT_FIELDS = ('system', 'user', 'model', 'temperature', 'max_tokens')
+
+# Settings of the optional sections with their defaults
+TOKEN_BUDGET_FIELDS = {
+    'default_ratio': token_budget.DEFAULT_RATIO,
+    'margin': token_budget.DEFAULT_MARGIN,
+    'min_tokens': token_budget.DEFAULT_MIN_TOKENS,
+    'max_tokens': token_budget.DEFAULT_MAX_TOKENS,
+    'percentile': token_budget.DEFAULT_PERCENTILE,
+    'sample_size': token_budget.DEFAULT_SAMPLE_SIZE,
+    'min_samples': token_budget.DEFAULT_MIN_SAMPLES,
+}
+STREAMING_FIELDS = {
+    'max_length_ratio': degeneration.DEFAULT_MAX_LENGTH_RATIO,
+    'min_length': degeneration.DEFAULT_MIN_LENGTH,
+    'min_repeats': degeneration.DEFAULT_MIN_REPEATS,
+    'max_period': degeneration.DEFAULT_MAX_PERIOD,
+    'min_repeat_chars': degeneration.DEFAULT_MIN_REPEAT_CHARS,
+    'check_interval': degeneration.DEFAULT_CHECK_INTERVAL,
+    'retries': DEFAULT_DEGENERATE_RETRIES,
+    'retry_temperature': DEFAULT_RETRY_TEMPERATURE,
+}
+ROUTING_TIER_FIELDS = ('max_tokens', 'max_input_tokens', 'max_latin_ratio', 'max_technical_terms')
+
+# Optional sections of the YAML config in the fingerprint
+FINGERPRINT_SECTIONS = ('token_budget', 'streaming', 'routing')
+
+
+def parse_personality(personality):
+    """
+    Parse the 'personality' section of the YAML config into the
+    fields used to translate.
+
+    Returns:
+    dict with system, user, model, temperature and max_tokens
+    """
+    return {
+        'system': personality['system'].strip(),
+        'user': personality['user'],
+        'model': personality['model'].strip(),
+        'temperature': float(str(personality['temperature']).strip()),
+        'max_tokens': int(str(personality['max_tokens']).strip()),
+    }
+
+
+def parse_number(value):
+    """
+    Return a YAML number as a float, so 5, 5.0 and '5' match.
+    """
+    return None if value is None else float(str(value).strip())
+
+
+def get_section_settings(section, defaults):
+    """
+    Return the settings of a config section, defaults included.
+    """
+    return {field: parse_number(section.get(field, default)) for field, default in defaults.items()}
+
+
+def get_routing_settings(routing):
+    """
+    Return the settings of the 'routing' section that decide the model
+    of a message and the validation of its answer.
+    """
+    return {
+        'tiers': [[str(tier.get('model', '')).strip()] + [parse_number(tier.get(field)) for field in ROUTING_TIER_FIELDS]
+                  for tier in routing['tiers']],
+        'max_untranslated_ratio': parse_number(routing.get('max_untranslated_ratio', DEFAULT_MAX_UNTRANSLATED_RATIO)),
+        'technical_terms': sorted(str(term).lower() for term in routing.get('technical_terms', DEFAULT_TECHNICAL_TERMS)),
+    }
+
+
+def get_config_fingerprint(config, language=None):
+    """
+    Return the SHA256 of the canonical JSON of the config fields
+    that affect the translations.
+
+    Parameters:
+    config: dict of load_and_parse_config()
+    language: optional target language of a multi-language config
+    """
+    canonical = {field: config[field] for field in FINGERPRINT_FIELDS}
+    if language:
+        canonical['language'] = language
+    # Sections are absent when off so the fingerprints of plain configs stay valid
+    if config.get('token_budget'):
+        canonical['token_budget'] = get_section_settings(config['token_budget'], TOKEN_BUDGET_FIELDS)
+    if config.get('streaming'):
+        canonical['streaming'] = get_section_settings(config['streaming'], STREAMING_FIELDS)
+    routing = config.get('routing')
+    if routing and routing.get('tiers'):
+        canonical['routing'] = get_routing_settings(routing)
+    serialized = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+def get_yaml_fingerprint(yaml_text, language=None):
+    """
+    Return the fingerprint of a YAML config as stored in
+    translation_parameters, for one of its target languages if given.
+
+    Raises:
+    ValueError if the YAML config can not be parsed
+    """
+    try:
+        yaml_config = yaml.safe_load(yaml_text)
+        config = parse_personality(yaml_config['personality'])
+    except (yaml.YAMLError, KeyError, TypeError, AttributeError, ValueError) as e:
+        raise ValueError(f"Invalid translation config: {e}") from e
+    for section in FINGERPRINT_SECTIONS:
+        if yaml_config.get(section):
+            config[section] = yaml_config[section]
+    return get_config_fingerprint(config, language)
+
+
+def backfill_config_fingerprints(cursor):
+    """
+    Compute the fingerprint of the translation parameters stored
+    before fingerprints existed, from their YAML config. Parameters
+    whose config can not be parsed are left without fingerprint.
+
+    Returns:
+    number of fingerprinted parameters
+
+    Raises:
+    sqlite3.OperationalError
+    """
+    select_query = """
+    SELECT tp.translation_parameters_id, tc.translation_config, tp.translation_language
+    FROM translation_parameters tp
+    LEFT JOIN translation_config tc ON tc.translation_config_sha256 = tp.translation_config_sha256
+    WHERE tp.translation_config_fingerprint IS NULL
+    """
+    update_query = """
+    UPDATE translation_parameters SET translation_config_fingerprint = ?
+    WHERE translation_parameters_id = ?
+    """
+    try:
+        cursor.execute(select_query)
+        updates = []
+        for translation_parameters_id, translation_config, translation_language in cursor.fetchall():
+            try:
+                updates.append((get_yaml_fingerprint(translation_config, translation_language), translation_parameters_id))
+            except ValueError as e:
+                logger.debug("Not fingerprinting translation parameters %s: %s", translation_parameters_id, e)
+        cursor.executemany(update_query, updates)
+        return len(updates)
+    except sqlite3.OperationalError as e:
+        raise sqlite3.OperationalError(f"Operational error fingerprinting translation parameters: {e}")
@@ -0,0 +1,232 @@
+"""
+HermeneisGPT library to hedge slow LLM requests.
+
+The latency of the requests is tracked online. When a request runs
+longer than a configured percentile of the recent latencies, a
+duplicate request is sent and the first answer wins. The share of
+duplicated requests is capped to limit the extra spend.
+
+The losing request is paid too: its usage is attached to the winning
+response as hedged_usage, see get_hedged_usage(), so it is counted
+with the tokens and cost of the winner.
+
+Streamed requests are not hedged: the stream returned first only has
+its headers, not the answer, and the losing stream would keep its
+connection and keep generating until max_tokens.
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import wait
+
+
+logger = logging.getLogger('hermeneis')
+
+DEFAULT_PERCENTILE = 95
+DEFAULT_MAX_EXTRA_REQUESTS = 0.05
+DEFAULT_MIN_DELAY = 1.0
+DEFAULT_WINDOW = 500
+DEFAULT_MIN_SAMPLES = 20
+DEFAULT_MAX_WORKERS = 64
+
+
+class LatencyTracker:
+    """
+    Sliding window of the latencies of the most recent requests.
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW, min_samples=DEFAULT_MIN_SAMPLES):
+        self.latencies = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+
+    def record(self, latency):
+        """
+        Record the latency of a request in seconds.
+        """
+        with self.lock:
+            self.latencies.append(latency)
+
+    def percentile(self, percentile):
+        """
+        Return the given percentile of the recent latencies, or None
+        if there are not enough samples yet.
+        """
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            latencies = sorted(self.latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * percentile / 100))
+        return latencies[index]
+
+
+def get_hedged_usage(response, loser, loser_start):
+    """
+    Return the usage of the losing request of a hedge as a dict with
+    prompt_tokens, completion_tokens, total_tokens, latency and
+    estimated. A loser still running is not cancelled and will most
+    likely answer the same as the winner, its tokens are estimated as
+    those of the winner and its latency is unknown (None). A loser that
+    failed is not counted.
+
+    Returns:
+    dict or None if the winner does not report usage
+    """
+    usage = getattr(response, 'usage', None)
+    if usage is None:
+        return None
+    estimated = True
+    latency = None
+    if loser.done():
+        if loser.exception() is not None:
+            return None
+        loser_response, loser_end = loser.result()
+        if getattr(loser_response, 'usage', None) is not None:
+            usage = loser_response.usage
+            estimated = False
+            latency = loser_end - loser_start
+    return {
+        'prompt_tokens': usage.prompt_tokens,
+        'completion_tokens': usage.completion_tokens,
+        'total_tokens': usage.total_tokens,
+        'latency': latency,
+        'estimated': estimated,
+    }
+
+
+class HedgedCompletions:
+    """
+    Drop-in replacement of client.chat.completions that hedges
+    requests running longer than the latency percentile.
+    """
+
+    def __init__(self, completions, hedging_config):
+        self.completions = completions
+        self.percentile = float(hedging_config.get('percentile', DEFAULT_PERCENTILE))
+        self.max_extra_requests = float(hedging_config.get('max_extra_requests', DEFAULT_MAX_EXTRA_REQUESTS))
+        self.min_delay = float(hedging_config.get('min_delay', DEFAULT_MIN_DELAY))
+        self.tracker = LatencyTracker(int(hedging_config.get('window', DEFAULT_WINDOW)),
+                                      int(hedging_config.get('min_samples', DEFAULT_MIN_SAMPLES)))
+        self.executor = ThreadPoolExecutor(max_workers=int(hedging_config.get('max_workers', DEFAULT_MAX_WORKERS)),
+                                           thread_name_prefix='hedging')
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.hedged_requests = 0
+        self.hedge_wins = 0
+
+    def get_hedge_delay(self):
+        """
+        Return the delay after which a request is hedged, or None if
+        it must not be hedged (not enough samples, or budget spent).
+        """
+        threshold = self.tracker.percentile(self.percentile)
+        if threshold is None:
+            return None
+        with self.lock:
+            if self.hedged_requests + 1 > self.max_extra_requests * self.requests:
+                return None
+        return max(threshold, self.min_delay)
+
+    def send(self, kwargs):
+        """
+        Send a request in a worker thread.
+
+        Returns:
+        (response, monotonic time of the answer)
+        """
+        response = self.completions.create(**kwargs)
+        return response, time.monotonic()
+
+    def create(self, **kwargs):
+        """
+        Send a chat completion request, hedged if it is slow. Streamed
+        requests are sent as they are.
+        """
+        if kwargs.get('stream'):
+            return self.completions.create(**kwargs)
+
+        with self.lock:
+            self.requests = self.requests + 1
+        delay = self.get_hedge_delay()
+        start = time.monotonic()
+
+        if delay is None:
+            response = self.completions.create(**kwargs)
+            self.tracker.record(time.monotonic() - start)
+            return response
+
+        primary = self.executor.submit(self.send, kwargs)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            self.tracker.record(time.monotonic() - start)
+            return primary.result()[0]
+
+        # Check the budget again, other threads may have hedged meanwhile
+        with self.lock:
+            if self.hedged_requests + 1 > self.max_extra_requests * self.requests:
+                hedge = None
+            else:
+                self.hedged_requests = self.hedged_requests + 1
+                hedge_start = time.monotonic()
+                hedge = self.executor.submit(self.send, kwargs)
+        if hedge is None:
+            response = primary.result()[0]
+            self.tracker.record(time.monotonic() - start)
+            return response
+
+        logger.debug("Hedging request after %.2fs (%s hedged of %s requests)", delay, self.hedged_requests, self.requests)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                self.tracker.record(time.monotonic() - start)
+                if future is hedge:
+                    with self.lock:
+                        self.hedge_wins = self.hedge_wins + 1
+                # The slower request is not cancelled, its answer is ignored but its usage is counted
+                response = future.result()[0]
+                if future is hedge:
+                    hedged_usage = get_hedged_usage(response, primary, start)
+                else:
+                    hedged_usage = get_hedged_usage(response, hedge, hedge_start)
+                if hedged_usage is not None:
+                    response.hedged_usage = hedged_usage
+                return response
+        raise error
+
+
+class HedgedClient:
+    """
+    Wraps an OpenAI client so chat completions are hedged, any other
+    attribute is taken from the wrapped client.
+    """
+
+    def __init__(self, client, hedging_config):
+        self.client = client
+        self.chat = SimpleNamespace(completions=HedgedCompletions(client.chat.completions, hedging_config))
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+def hedge_client(client, hedging_config):
+    """
+    Wrap a client to hedge slow chat completion requests.
+
+    Parameters:
+    client: OpenAI client
+    hedging_config: 'hedging' section of the YAML config
+
+    Returns:
+    HedgedClient
+    """
+    return HedgedClient(client, hedging_config or {})
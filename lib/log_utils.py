@@ -0,0 +1,169 @@
+"""
+HermeneisGPT library to set up logging off the hot path.
+
+Records are put on a queue by the thread that logs them and formatted and
+written to the log file by a background QueueListener. DEBUG records,
+several per translated message, can be sampled and rate limited
+before they are queued.
+"""
+
+import os
+import json
+import time
+import queue
+import random
+import logging
+import threading
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
+
+
+LOG_DIR = 'logs'
+# Log file used until the YAML config is loaded
+DEFAULT_LOG_FILE = 'hermeneis.log'
+DEFAULT_LOG_LEVEL = 'DEBUG'
+DEFAULT_LOG_FORMAT = 'text'
+LOG_FORMATS = ('text', 'json')
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Attributes of every LogRecord, anything else was given with extra=
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line, with the fields given
+    with extra= as top level keys.
+    """
+
+    def format(self, record):
+        entry = {
+            'timestamp': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DebugSamplingFilter(logging.Filter):
+    """
+    Keeps a sample of the DEBUG records and at most rate_limit DEBUG
+    records per second. Records above DEBUG always pass.
+    """
+
+    def __init__(self, sample_rate=1.0, rate_limit=0):
+        super().__init__()
+        self.sample_rate = float(sample_rate)
+        self.rate_limit = float(rate_limit)
+        self.tokens = self.rate_limit
+        self.last = time.monotonic()
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self.dropped = self.dropped + 1
+            return False
+        if self.rate_limit > 0:
+            # Token bucket refilled at rate_limit records per second
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate_limit, self.tokens + (now - self.last) * self.rate_limit)
+                self.last = now
+                if self.tokens < 1:
+                    self.dropped = self.dropped + 1
+                    return False
+                self.tokens = self.tokens - 1
+        return True
+
+
+def parse_log_config(log_config):
+    """
+    Parse the 'log' key of the YAML config, either the path of the
+    log file or a mapping with path and logging options.
+
+    Returns:
+    (path, options), options is None for a plain path
+    """
+    if isinstance(log_config, dict):
+        options = dict(log_config)
+        path = str(options.pop('path', 'hermeneis.log')).strip()
+        return path, options
+    return str(log_config).strip(), None
+
+
+def get_log_path(path):
+    """
+    Relative log paths are placed in the LOG_DIR directory.
+    """
+    if os.path.isabs(path) or os.path.dirname(path):
+        return path
+    return os.path.join(LOG_DIR, path)
+
+
+def setup_logging(logger, path, options=None, console_handler=None):
+    """
+    Log to a file through a background queue listener.
+
+    Parameters:
+    logger: 'hermeneis' logger
+    path: log file
+    options: optional mapping with level, format ('text' or 'json'),
+    debug_sample_rate (0-1) and debug_rate_limit (records per second,
+    0 for unlimited)
+    console_handler: optional handler written directly, only used to
+    set the logger level so disabled levels are skipped early
+
+    Returns:
+    started QueueListener, see stop_logging()
+    """
+    options = options or {}
+    level = logging.getLevelName(str(options.get('level', DEFAULT_LOG_LEVEL)).upper())
+    if not isinstance(level, int):
+        raise ValueError(f"Unknown log level: {options.get('level')}")
+    log_format = options.get('format', DEFAULT_LOG_FORMAT)
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f"Unknown log format: {log_format}")
+
+    log_path = get_log_path(path)
+    if os.path.dirname(log_path):
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    file_handler = logging.FileHandler(log_path, encoding='utf-8')
+    file_handler.setLevel(level)
+    file_handler.setFormatter(JSONFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.setLevel(level)
+    queue_handler.addFilter(DebugSamplingFilter(options.get('debug_sample_rate', 1.0),
+                                                options.get('debug_rate_limit', 0)))
+    logger.addHandler(queue_handler)
+
+    levels = [level] + ([console_handler.level] if console_handler is not None else [])
+    logger.setLevel(min(levels))
+
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def stop_logging(logger, listener):
+    """
+    Flush the queued records to the log file and detach the queue
+    handler of the listener from the logger.
+    """
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+    for handler in list(logger.handlers):
+        if isinstance(handler, QueueHandler) and handler.queue is listener.queue:
+            logger.removeHandler(handler)
@@ -0,0 +1,209 @@
+"""
+HermeneisGPT library to plan translation runs before sending requests.
+
+A discrete-event simulation replays the pending messages of a run
+against the requests and tokens per minute limits of the API and the
+adaptive concurrency of the config, with request latencies drawn from
+the latencies of past runs. Several simulations give the expected
+wall-clock duration, the peak throughput and the spend over time.
+"""
+
+import heapq
+import random
+import logging
+import sqlite3
+from collections import deque
+from collections import namedtuple
+from lib.concurrency import AIMDController
+
+
+DEFAULT_RUNS = 20
+DEFAULT_LATENCY_SAMPLES = 1000
+DEFAULT_MIN_LATENCY_SAMPLES = 20
+
+# Latency of a request without past latencies: overhead plus time per output token
+DEFAULT_LATENCY_OVERHEAD = 0.5
+DEFAULT_SECONDS_PER_TOKEN = 0.02
+MIN_LATENCY = 0.05
+
+# Rate limits are enforced over a sliding minute
+RATE_WINDOW = 60.0
+
+# prompt_tokens and completion_tokens are expected tokens, reserved_tokens
+# (prompt plus max_tokens) count towards the tokens per minute limit
+PlannedRequest = namedtuple('PlannedRequest', ['prompt_tokens', 'completion_tokens', 'reserved_tokens', 'cost'])
+
+
+def get_latency_samples(cursor, translation_model, limit=DEFAULT_LATENCY_SAMPLES):
+    """
+    Retrieve the most recent (completion_tokens, latency_seconds) of
+    the requests sent to a model.
+
+    Raises:
+    sqlite3.OperationalError
+    """
+    query = """
+    SELECT completion_tokens, latency_seconds FROM request_latency
+    WHERE translation_model = ? AND completion_tokens IS NOT NULL AND latency_seconds IS NOT NULL
+    ORDER BY request_latency_id DESC
+    LIMIT ?
+    """
+    try:
+        cursor.execute(query, (translation_model, limit))
+        return cursor.fetchall()
+    except sqlite3.OperationalError as e:
+        raise sqlite3.OperationalError(f"Operational error retrieving request latencies: {e}")
+
+
+class LatencyModel:
+    """
+    Request latency as overhead + seconds_per_token * completion_tokens,
+    fitted by least squares on past latencies, plus a residual drawn
+    from the fit so the spread of the latencies is kept.
+    """
+
+    def __init__(self, samples=(), min_samples=DEFAULT_MIN_LATENCY_SAMPLES,
+                 overhead=DEFAULT_LATENCY_OVERHEAD, seconds_per_token=DEFAULT_SECONDS_PER_TOKEN):
+        samples = list(samples)
+        self.samples = len(samples)
+        self.overhead = float(overhead)
+        self.seconds_per_token = float(seconds_per_token)
+        self.residuals = [0.0]
+        if len(samples) < min_samples:
+            return
+
+        mean_tokens = sum(tokens for tokens, _ in samples) / len(samples)
+        mean_latency = sum(latency for _, latency in samples) / len(samples)
+        variance = sum((tokens - mean_tokens) ** 2 for tokens, _ in samples)
+        covariance = sum((tokens - mean_tokens) * (latency - mean_latency) for tokens, latency in samples)
+        self.seconds_per_token = max(0.0, covariance / variance) if variance else 0.0
+        self.overhead = mean_latency - self.seconds_per_token * mean_tokens
+        self.residuals = [latency - self.predict(tokens) for tokens, latency in samples]
+
+    def predict(self, completion_tokens):
+        """
+        Return the expected latency in seconds of a request.
+        """
+        return self.overhead + self.seconds_per_token * completion_tokens
+
+    def sample(self, completion_tokens, rng):
+        """
+        Draw the latency in seconds of a request.
+        """
+        return max(MIN_LATENCY, self.predict(completion_tokens) + rng.choice(self.residuals))
+
+
+def simulate(requests, latency_model, concurrency_config=None, requests_per_minute=None, tokens_per_minute=None, rng=None):
+    """
+    Simulate a run sending the requests in order.
+
+    A request starts when the concurrency limit, the requests per
+    minute and the tokens per minute allow it. The concurrency limit
+    is an AIMDController of lib.concurrency driven by the simulated
+    time: it grows after requests faster than the target latency and is
+    cut after slower ones.
+
+    Parameters:
+    requests: list of PlannedRequest
+    latency_model: LatencyModel
+    concurrency_config: 'concurrency' section of the config
+    requests_per_minute: optional limit
+    tokens_per_minute: optional limit on the reserved tokens
+    rng: random.Random
+
+    Returns:
+    list of (start, end) seconds of each request
+    """
+    rng = rng or random.Random()
+    # Completions are processed at their finish time, the clock of the controller
+    finished = 0.0
+    controller = AIMDController(concurrency_config, clock=lambda: finished, log_level=logging.DEBUG)
+    in_flight = []
+    window = deque()
+    window_tokens = 0
+    now = 0.0
+    schedule = []
+
+    for request in requests:
+        while True:
+            # Requests finished by now update the concurrency limit first
+            while in_flight and in_flight[0][0] <= now:
+                finished, latency = heapq.heappop(in_flight)
+                controller.on_success(latency)
+            if len(in_flight) >= controller.get_limit():
+                now = in_flight[0][0]
+                continue
+            while window and window[0][0] + RATE_WINDOW <= now:
+                window_tokens -= window.popleft()[1]
+            if requests_per_minute and len(window) >= requests_per_minute:
+                now = window[0][0] + RATE_WINDOW
+                continue
+            if tokens_per_minute and window and window_tokens + request.reserved_tokens > tokens_per_minute:
+                now = window[0][0] + RATE_WINDOW
+                continue
+            break
+
+        latency = latency_model.sample(request.completion_tokens, rng)
+        heapq.heappush(in_flight, (now + latency, latency))
+        window.append((now, request.reserved_tokens))
+        window_tokens += request.reserved_tokens
+        schedule.append((now, now + latency))
+    return schedule
+
+
+def summarize_schedule(requests, schedule, bucket=RATE_WINDOW):
+    """
+    Aggregate a simulated run in buckets of seconds by end of request.
+
+    Returns:
+    list of (bucket end, completed requests, tokens, cumulative cost)
+    """
+    if not schedule:
+        return []
+    buckets = int(max(end for _, end in schedule) // bucket) + 1
+    completed = [0] * buckets
+    tokens = [0] * buckets
+    costs = [0.0] * buckets
+    for request, (_, end) in zip(requests, schedule):
+        index = int(end // bucket)
+        completed[index] += 1
+        tokens[index] += request.prompt_tokens + request.completion_tokens
+        costs[index] += request.cost
+    curve = []
+    spend = 0.0
+    for index in range(buckets):
+        spend += costs[index]
+        curve.append(((index + 1) * bucket, completed[index], tokens[index], spend))
+    return curve
+
+
+def plan_run(requests, latency_model, concurrency_config=None, requests_per_minute=None, tokens_per_minute=None,
+             runs=DEFAULT_RUNS, seed=None):
+    """
+    Simulate a run several times and summarize the predictions.
+
+    Returns:
+    dict with requests, prompt_tokens, completion_tokens, cost,
+    duration_p50 and duration_p90 (seconds), peak_requests_per_minute,
+    peak_tokens_per_minute and curve, the per-minute curve of the
+    median run (see summarize_schedule())
+    """
+    rng = random.Random(seed)
+    simulations = []
+    for _ in range(max(1, int(runs)) if requests else 0):
+        schedule = simulate(requests, latency_model, concurrency_config, requests_per_minute, tokens_per_minute, rng)
+        simulations.append((max(end for _, end in schedule), schedule))
+    simulations.sort(key=lambda simulation: simulation[0])
+    durations = [duration for duration, _ in simulations] or [0.0]
+    curve = summarize_schedule(requests, simulations[len(simulations) // 2][1]) if simulations else []
+    return {
+        'requests': len(requests),
+        'prompt_tokens': sum(request.prompt_tokens for request in requests),
+        'completion_tokens': sum(request.completion_tokens for request in requests),
+        'cost': sum(request.cost for request in requests),
+        'duration_p50': durations[len(durations) // 2],
+        'duration_p90': durations[min(len(durations) - 1, int(len(durations) * 0.9))],
+        'peak_requests_per_minute': max((completed for _, completed, _, _ in curve), default=0),
+        'peak_tokens_per_minute': max((tokens for _, _, tokens, _ in curve), default=0),
+        'curve': curve,
+    }
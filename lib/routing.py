@@ -0,0 +1,163 @@
+"""
+HermeneisGPT library to route messages through a cascade of models.
+
+Each message starts at the cheapest model tier whose limits accept
+its local features (token length, share of Latin script, technical
+vocabulary). When the answer fails validation (empty, truncated, or
+Cyrillic left untranslated) or degenerates while streaming, it is
+escalated to the next, stronger tier.
+"""
+
+import re
+import logging
+import threading
+from collections import Counter
+from lib.translator import complete_translation
+from lib.degeneration import DegenerateOutputError
+
+
+logger = logging.getLogger('hermeneis')
+
+DEFAULT_MAX_UNTRANSLATED_RATIO = 0.1
+
+# Stems of hacking, military and financial vocabulary that cheap
+# models tend to mistranslate, matched at the start of words
+DEFAULT_TECHNICAL_TERMS = (
+    'ddos', 'ддос', 'дудос', 'бот', 'эксплойт', 'уязвим', 'взлом', 'хак', 'дефейс', 'шелл', 'малвар',
+    'вредонос', 'фишинг', 'сервер', 'прокси', 'впн', 'vpn', 'sql', 'xss', 'api',
+    'бпла', 'всу', 'рсзо', 'артиллер', 'снаряд', 'дрон',
+    'кредит', 'займ', 'микрозайм', 'ипотек', 'транзакц', 'крипт', 'биткоин',
+)
+
+CYRILLIC = re.compile(r'[Ѐ-ӿ]')
+LATIN = re.compile(r'[A-Za-z]')
+WORD = re.compile(r'\w+')
+
+
+def get_cyrillic_ratio(text):
+    """
+    Return the share of Cyrillic letters among the letters of a text.
+    """
+    cyrillic = len(CYRILLIC.findall(text))
+    letters = cyrillic + len(LATIN.findall(text))
+    return cyrillic / letters if letters else 0.0
+
+
+def get_text_features(text, count_tokens, technical_terms=DEFAULT_TECHNICAL_TERMS):
+    """
+    Compute the cheap local features used to pick a model tier.
+
+    Parameters:
+    text
+    count_tokens: function returning the number of tokens of a text
+    technical_terms: word stems of technical vocabulary
+
+    Returns:
+    dict with tokens, latin_ratio and technical_terms
+    """
+    words = [word.lower() for word in WORD.findall(text)]
+    latin = len(LATIN.findall(text))
+    letters = latin + len(CYRILLIC.findall(text))
+    return {
+        'tokens': count_tokens(text),
+        'latin_ratio': latin / letters if letters else 0.0,
+        'technical_terms': sum(1 for word in words if word.startswith(tuple(technical_terms))),
+    }
+
+
+def validate_translation(source, translation, finish_reason=None, max_untranslated_ratio=DEFAULT_MAX_UNTRANSLATED_RATIO):
+    """
+    Check an LLM answer for the usual failures of cheap models.
+
+    Returns:
+    None if the translation is valid, otherwise the reason:
+    'empty', 'truncated' or 'untranslated'
+    """
+    if not translation or not translation.strip():
+        return 'empty'
+    if finish_reason == 'length':
+        return 'truncated'
+    if CYRILLIC.search(source) and get_cyrillic_ratio(translation) > max_untranslated_ratio:
+        return 'untranslated'
+    return None
+
+
+class ModelRouter:
+    """
+    Routes translations through the model tiers of the 'routing'
+    config section, cheapest first.
+    """
+
+    def __init__(self, routing_config, count_tokens):
+        self.tiers = list(routing_config['tiers'])
+        if not self.tiers or not all(tier.get('model') for tier in self.tiers):
+            raise ValueError("routing needs a list of tiers, each with a model")
+        self.count_tokens = count_tokens
+        self.technical_terms = tuple(term.lower() for term in routing_config.get('technical_terms', DEFAULT_TECHNICAL_TERMS))
+        self.max_untranslated_ratio = float(routing_config.get('max_untranslated_ratio', DEFAULT_MAX_UNTRANSLATED_RATIO))
+        self.lock = threading.Lock()
+        self.stats = Counter()
+
+    def select_tier(self, text):
+        """
+        Return the index of the first tier whose limits accept the
+        features of the text, the last tier accepts everything.
+        """
+        features = get_text_features(text, self.count_tokens, self.technical_terms)
+        for index, tier in enumerate(self.tiers[:-1]):
+            if features['tokens'] > tier.get('max_input_tokens', float('inf')):
+                continue
+            if features['latin_ratio'] > tier.get('max_latin_ratio', 1.0):
+                continue
+            if features['technical_terms'] > tier.get('max_technical_terms', float('inf')):
+                continue
+            return index
+        return len(self.tiers) - 1
+
+    def translate(self, client, config, message, hint=None, max_tokens=None, on_result=None):
+        """
+        Translate a message starting at its tier and escalating while
+        the answer fails validation. The answer of the last tier is
+        kept unless it is empty. on_result is called with the
+        TranslationResult of every tier tried, e.g. to count usage.
+
+        Returns:
+        TranslationResult of the accepted answer
+
+        Raises:
+        openai errors
+        ValueError if the last tier answers an empty translation
+        DegenerateOutputError if the answer of the last tier degenerates
+        """
+        for index in range(self.select_tier(message), len(self.tiers)):
+            model = self.tiers[index]['model'].strip()
+            last = index == len(self.tiers) - 1
+            try:
+                result = complete_translation(client, config, message, hint,
+                                              self.tiers[index].get('max_tokens', max_tokens), model)
+            except DegenerateOutputError:
+                # Aborted while streaming, a stronger model may not loop
+                with self.lock:
+                    self.stats[f"requests:{model}"] += 1
+                    if not last:
+                        self.stats["escalations:degenerate"] += 1
+                if last:
+                    raise
+                logger.debug("Escalating translation from %s (degenerate)", model)
+                continue
+            if on_result is not None:
+                on_result(result)
+            reason = validate_translation(message, result.translation, result.finish_reason, self.max_untranslated_ratio)
+            with self.lock:
+                self.stats[f"requests:{model}"] += 1
+                if reason is not None and not last:
+                    self.stats[f"escalations:{reason}"] += 1
+            if reason is None or last:
+                break
+            logger.debug("Escalating translation from %s (%s)", model, reason)
+
+        if reason == 'empty':
+            raise ValueError("Empty translation returned by the model")
+        if reason is not None:
+            logger.debug("Keeping %s translation of the last tier %s", reason, model)
+        return result
@@ -0,0 +1,191 @@
+"""
+HermeneisGPT library of functions for the full-text search index.
+
+An FTS5 index over the original and translated text of every
+translation. Triggers on message_translation keep it in sync with
+the rows written by upsert_message_translation. Compressed
+translations are indexed decompressed.
+"""
+
+import sqlite3
+from lib.db_utils import check_table_exists
+from lib.db_utils import is_compressed_db
+from lib.db_utils import register_text_functions
+
+
+SEARCH_INDEX_TABLE = 'message_translation_fts'
+
+SEARCH_INDEX_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS message_translation_fts USING fts5(
+    message_text,
+    translation_text
+);
+"""
+
+SEARCH_INDEX_TRIGGERS = """
+CREATE {temp}TRIGGER IF NOT EXISTS message_translation_fts_insert AFTER INSERT ON {table}
+BEGIN
+    DELETE FROM message_translation_fts WHERE rowid = new.translation_id;
+    INSERT INTO message_translation_fts (rowid, message_text, translation_text)
+    VALUES (new.translation_id,
+            (SELECT message_text FROM messages WHERE message_id = new.message_id LIMIT 1),
+            {text});
+END;
+
+CREATE {temp}TRIGGER IF NOT EXISTS message_translation_fts_update AFTER UPDATE OF translation_text ON {table}
+BEGIN
+    DELETE FROM message_translation_fts WHERE rowid = old.translation_id;
+    INSERT INTO message_translation_fts (rowid, message_text, translation_text)
+    VALUES (new.translation_id,
+            (SELECT message_text FROM messages WHERE message_id = new.message_id LIMIT 1),
+            {text});
+END;
+
+CREATE {temp}TRIGGER IF NOT EXISTS message_translation_fts_delete AFTER DELETE ON {table}
+BEGIN
+    DELETE FROM message_translation_fts WHERE rowid = old.translation_id;
+END;
+"""
+
+UPGRADE_SEARCH_INDEX_TRIGGERS = """
+DROP TRIGGER IF EXISTS main.message_translation_fts_update;
+"""
+
+DROP_SEARCH_INDEX_TRIGGERS = """
+DROP TRIGGER IF EXISTS main.message_translation_fts_insert;
+DROP TRIGGER IF EXISTS main.message_translation_fts_update;
+DROP TRIGGER IF EXISTS main.message_translation_fts_delete;
+"""
+
+
+def has_search_index(cursor):
+    """
+    Check if the full-text search index exists in the DB.
+    """
+    return check_table_exists(cursor, SEARCH_INDEX_TABLE)
+
+
+def create_search_index(connection, cursor):
+    """
+    Create the FTS5 search index and the triggers that keep it in
+    sync with message_translation.
+
+    When the messages are in an attached source DB, or translations
+    are compressed, the triggers can not be stored in the DB: they
+    need the source DB or the decompress_text() function of this
+    process. TEMP triggers are created instead and this function must
+    be called on every connection that writes translations.
+
+    Parameters:
+    connection
+    cursor
+
+    Returns:
+    bool, True if the index did not exist and must be backfilled
+
+    Raises:
+    sqlite3.OperationalError, e.g. if SQLite was built without FTS5
+    """
+    try:
+        created = not has_search_index(cursor)
+        if is_compressed_db(cursor):
+            register_text_functions(cursor)
+            triggers = DROP_SEARCH_INDEX_TRIGGERS + SEARCH_INDEX_TRIGGERS.format(
+                temp='TEMP ', table='main.message_translation', text='decompress_text(new.translation_text)')
+        elif check_table_exists(cursor, 'messages'):
+            # Older versions reindexed translations on updates of any column
+            triggers = UPGRADE_SEARCH_INDEX_TRIGGERS + SEARCH_INDEX_TRIGGERS.format(temp='', table='message_translation', text='new.translation_text')
+        else:
+            triggers = SEARCH_INDEX_TRIGGERS.format(temp='TEMP ', table='main.message_translation', text='new.translation_text')
+        cursor.executescript(SEARCH_INDEX_SCHEMA + triggers)
+        connection.commit()
+        return created
+    except sqlite3.OperationalError as e:
+        connection.rollback()
+        raise sqlite3.OperationalError(e)
+
+
+def rebuild_search_index(connection, cursor):
+    """
+    Rebuild the search index from all the existing translations.
+
+    Parameters:
+    connection
+    cursor
+
+    Returns:
+    number of translations indexed
+
+    Raises:
+    sqlerrors various
+    """
+    query = """
+    INSERT INTO message_translation_fts (rowid, message_text, translation_text)
+    SELECT mt.translation_id,
+           (SELECT message_text FROM messages WHERE message_id = mt.message_id LIMIT 1),
+           decompress_text(mt.translation_text)
+    FROM message_translation mt
+    """
+    try:
+        register_text_functions(cursor)
+        cursor.execute("DELETE FROM message_translation_fts")
+        cursor.execute(query)
+        indexed = cursor.rowcount
+        cursor.execute("INSERT INTO message_translation_fts (message_translation_fts) VALUES ('optimize')")
+        connection.commit()
+        return indexed
+    except sqlite3.IntegrityError:
+        connection.rollback()
+        raise
+    except sqlite3.OperationalError:
+        connection.rollback()
+        raise
+    except sqlite3.DatabaseError:
+        connection.rollback()
+        raise
+
+
+def search_translations(cursor, query, channel_name=None, since=None, until=None, limit=20):
+    """
+    Search the original and translated text of the translations.
+
+    Parameters:
+    cursor
+    query: FTS5 query, e.g. 'ddos AND банк' or '"critical infrastructure"'
+    channel_name: optional, only messages of this channel
+    since: optional, only messages posted at or after this date
+    until: optional, only messages posted before this date
+    limit: maximum number of hits
+
+    Returns:
+    list of (channel_name, message_id, message_date, original snippet,
+    translation snippet, rank), best matches first
+
+    Raises:
+    sqlite3.OperationalError, e.g. on invalid query syntax
+    """
+    search_query = """
+    SELECT c.channel_name, m.message_id, m.message_date,
+           snippet(message_translation_fts, 0, '[', ']', '...', 16),
+           snippet(message_translation_fts, 1, '[', ']', '...', 16),
+           bm25(message_translation_fts) AS rank
+    FROM message_translation_fts f
+    JOIN message_translation mt ON mt.translation_id = f.rowid
+    JOIN messages m ON m.message_id = mt.message_id
+    LEFT JOIN channels c ON c.channel_id = m.channel_id
+    WHERE message_translation_fts MATCH ?
+      AND (? IS NULL OR c.channel_name = ?)
+      AND (? IS NULL OR m.message_date >= ?)
+      AND (? IS NULL OR m.message_date < ?)
+    ORDER BY rank
+    LIMIT ?
+    """
+    try:
+        cursor.execute(search_query, (query, channel_name, channel_name, since, since, until, until, limit))
+        return cursor.fetchall()
+    except sqlite3.OperationalError:
+        raise
+    except sqlite3.ProgrammingError:
+        raise
+    except sqlite3.DatabaseError:
+        raise
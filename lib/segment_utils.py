@@ -0,0 +1,231 @@
+"""
+HermeneisGPT library of functions for the segment translation memory.
+
+Messages are split in segments (lines or sentences) and the translation
+of each segment is cached per translation_parameters_id. Only segments
+missing from the cache are sent to the LLM, recurring signatures,
+footers and hashtag blocks are reused from the cache.
+
+Consecutive segments missing from the cache are sent in one request,
+numbered "[1] ", "[2] "... one per line, so each line of the answer
+can be matched to its segment. Only answers that keep the numbering
+and pass validate_translation() are cached.
+"""
+
+import re
+import sqlite3
+import hashlib
+from itertools import zip_longest
+from lib.routing import validate_translation
+
+
+SEGMENT_PATTERNS = {
+    'lines': re.compile(r'(\s*\n\s*)'),
+    'sentences': re.compile(r'(\s*\n\s*|(?<=[.!?…])\s+)'),
+}
+
+SEGMENT_NUMBER = re.compile(r'^\[(\d+)\] ?(.*)$')
+SEGMENT_NUMBERS = re.compile(r'^\[\d+\] ?', re.MULTILINE)
+
+# Limit of host parameters per query on old SQLite versions is 999
+LOOKUP_CHUNK_SIZE = 500
+
+
+def split_segments(text, mode='lines'):
+    """
+    Split a text in segments, keeping the separators so the
+    text can be reassembled exactly.
+
+    Parameters:
+    text
+    mode: 'lines' or 'sentences'
+
+    Returns:
+    (segments, separators), len(separators) == len(segments) - 1
+
+    Raises:
+    ValueError if the mode is unknown
+    """
+    if mode not in SEGMENT_PATTERNS:
+        raise ValueError(f"Unknown segment mode: {mode}")
+    parts = SEGMENT_PATTERNS[mode].split(text)
+    return parts[0::2], parts[1::2]
+
+
+def join_segments(segments, separators):
+    """
+    Reassemble a text from its segments and separators.
+    """
+    return ''.join(segment + separator for segment, separator in zip_longest(segments, separators, fillvalue=''))
+
+
+def number_segments(segments):
+    """
+    Join segments one per line, each prefixed with its number.
+    """
+    return '\n'.join(f"[{number}] {segment.strip()}" for number, segment in enumerate(segments, 1))
+
+
+def parse_numbered_segments(text, count):
+    """
+    Split the answer to number_segments() back in segments.
+
+    Returns:
+    list of count translations, or None if the lines of the answer
+    are not numbered 1 to count in order
+    """
+    lines = [line.strip() for line in text.strip().split('\n') if line.strip()]
+    if len(lines) != count:
+        return None
+    translations = []
+    for number, line in enumerate(lines, 1):
+        match = SEGMENT_NUMBER.match(line)
+        if not match or int(match.group(1)) != number:
+            return None
+        translations.append(match.group(2).strip())
+    return translations
+
+
+def get_segment_sha256(segment):
+    """
+    Return the SHA256 used as cache key of a segment.
+    """
+    return hashlib.sha256(segment.strip().encode('utf-8')).hexdigest()
+
+
+def lookup_segment_translations(cursor, translation_parameters_id, segments):
+    """
+    Retrieve the cached translations of the given segments.
+
+    Parameters:
+    cursor
+    translation_parameters_id
+    segments
+
+    Returns:
+    dict of segment index to translation, only for cached segments
+
+    Raises:
+    sqlerrors various
+    """
+    hashes = {}
+    for index, segment in enumerate(segments):
+        if segment.strip():
+            hashes.setdefault(get_segment_sha256(segment), []).append(index)
+
+    cached = {}
+    keys = list(hashes)
+    try:
+        for start in range(0, len(keys), LOOKUP_CHUNK_SIZE):
+            chunk = keys[start:start + LOOKUP_CHUNK_SIZE]
+            query = f"""
+            SELECT segment_sha256, translation_text
+            FROM segment_translation
+            WHERE translation_parameters_id = ? AND segment_sha256 IN ({','.join('?' * len(chunk))})
+            """
+            cursor.execute(query, [translation_parameters_id] + chunk)
+            for segment_sha256, translation_text in cursor.fetchall():
+                for index in hashes[segment_sha256]:
+                    cached[index] = translation_text
+        return cached
+    except sqlite3.OperationalError:
+        raise
+    except sqlite3.ProgrammingError:
+        raise
+    except sqlite3.DatabaseError:
+        raise
+
+
+def translate_segments(segments, separators, cached, translate_fn):
+    """
+    Translate the segments missing from the cache and reassemble
+    the full translation.
+
+    Consecutive uncached segments are sent together in one request,
+    numbered one per line. When the answer keeps the numbering, each
+    line is matched to its segment and cached if it passes
+    validate_translation(), otherwise the answer is kept as a block in
+    place of the segments and nothing is cached.
+
+    Parameters:
+    segments
+    separators
+    cached: dict of segment index to translation
+    translate_fn: function translating a text, returns None on failure
+
+    Returns:
+    (translation, new_segments) where new_segments is a list of
+    (segment, translation) to cache. translation is None if any
+    request failed.
+    """
+    translated = list(segments)
+    separators = list(separators)
+
+    # Group uncached segments in runs not interrupted by a cached segment
+    gaps = []
+    current = []
+    for index, segment in enumerate(segments):
+        if not segment.strip():
+            continue
+        if index in cached:
+            translated[index] = cached[index]
+            if current:
+                gaps.append(current)
+                current = []
+        else:
+            current.append(index)
+    if current:
+        gaps.append(current)
+
+    new_segments = []
+    for gap in gaps:
+        if len(gap) == 1:
+            result = translate_fn(segments[gap[0]].strip())
+            lines = [result.strip()] if result is not None else None
+        else:
+            result = translate_fn(number_segments([segments[index] for index in gap]))
+            lines = parse_numbered_segments(result, len(gap)) if result is not None else None
+        if result is None:
+            return None, []
+
+        if lines is not None:
+            for index, line in zip(gap, lines):
+                translated[index] = line
+                if validate_translation(segments[index], line) is None:
+                    new_segments.append((segments[index], line))
+        else:
+            # Not aligned, keep the answer as one block
+            translated[gap[0]] = SEGMENT_NUMBERS.sub('', result.strip())
+            for index in gap[1:]:
+                translated[index] = ''
+            for index in range(gap[0], gap[-1]):
+                separators[index] = ''
+
+    return join_segments(translated, separators), new_segments
+
+
+def store_segment_translations(cursor, translation_parameters_id, new_segments):
+    """
+    Store segment translations in the translation memory.
+
+    Parameters:
+    cursor
+    translation_parameters_id
+    new_segments: list of (segment, translation)
+
+    Raises:
+    sqlerrors various
+    """
+    query = """
+    INSERT OR IGNORE INTO segment_translation (segment_sha256, translation_parameters_id, translation_text)
+    VALUES (?, ?, ?)
+    """
+    try:
+        cursor.executemany(query, [(get_segment_sha256(segment), translation_parameters_id, translation)
+                                   for segment, translation in new_segments])
+    except sqlite3.IntegrityError:
+        raise
+    except sqlite3.OperationalError:
+        raise
+    except sqlite3.DatabaseError:
+        raise
@@ -0,0 +1,307 @@
+"""
+HermeneisGPT local HTTP translation service.
+
+A small asyncio HTTP/1.1 server around one shared OpenAI client:
+
+    POST /translate  {"text": "..."} or {"texts": ["...", ...]}
+    GET  /metrics    request, coalescing, batching and latency stats
+
+Identical requests in flight are coalesced into a single upstream
+request, and short texts arriving within a few milliseconds of each
+other are translated together in one request.
+"""
+
+import json
+import time
+import asyncio
+import logging
+from http import HTTPStatus
+from concurrent.futures import ThreadPoolExecutor
+from lib.hedging import LatencyTracker
+from lib.translator import request_translation
+from lib.translator import request_batch_translation
+
+
+logger = logging.getLogger('hermeneis')
+
+DEFAULT_MAX_BATCH_SIZE = 8
+DEFAULT_MAX_BATCH_CHARS = 200
+DEFAULT_BATCH_WINDOW = 0.01
+DEFAULT_WORKERS = 16
+DEFAULT_LATENCY_WINDOW = 1000
+
+MAX_BODY_SIZE = 1024 * 1024
+MAX_HEADER_COUNT = 100
+
+
+class TranslationService:
+    """
+    Translates texts for the HTTP handlers, coalescing identical
+    texts in flight and micro-batching short texts.
+    """
+
+    def __init__(self, client, config, serve_config=None, token_budget=None):
+        serve_config = serve_config or {}
+        self.client = client
+        self.config = config
+        self.token_budget = token_budget
+        self.max_batch_size = int(serve_config.get('max_batch_size', DEFAULT_MAX_BATCH_SIZE))
+        self.max_batch_chars = int(serve_config.get('max_batch_chars', DEFAULT_MAX_BATCH_CHARS))
+        self.batch_window = float(serve_config.get('batch_window', DEFAULT_BATCH_WINDOW))
+        self.executor = ThreadPoolExecutor(max_workers=int(serve_config.get('workers', DEFAULT_WORKERS)),
+                                           thread_name_prefix='serve')
+        self.latency = LatencyTracker(DEFAULT_LATENCY_WINDOW, min_samples=1)
+        self.in_flight = {}
+        self.batch = []
+        self.batch_timer = None
+        self.tasks = set()
+        self.started = time.monotonic()
+        self.stats = {
+            'requests': 0,
+            'coalesced': 0,
+            'upstream_requests': 0,
+            'batches': 0,
+            'batched_texts': 0,
+            'batch_fallbacks': 0,
+            'errors': 0,
+        }
+
+    def get_max_tokens(self, texts):
+        """
+        Return max_tokens for a request translating the texts, None
+        to use max_tokens of the config.
+        """
+        if not self.token_budget:
+            return None
+        return sum(self.token_budget.get_max_tokens(text) for text in texts)
+
+    async def translate(self, text):
+        """
+        Translate a text, sharing the upstream request with identical
+        texts already in flight.
+
+        Raises:
+        the error of the upstream request
+        """
+        self.stats['requests'] += 1
+        start = time.monotonic()
+        future = self.in_flight.get(text)
+        if future is not None:
+            self.stats['coalesced'] += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self.in_flight[text] = future
+            future.add_done_callback(lambda done: self.in_flight.pop(text) if self.in_flight.get(text) is done else None)
+            if self.max_batch_size > 1 and len(text) <= self.max_batch_chars:
+                self._add_to_batch(text, future)
+            else:
+                self._start(self._translate_single(text, future))
+        try:
+            # A client disconnecting must not cancel the shared request
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.stats['errors'] += 1
+            raise
+        finally:
+            self.latency.record(time.monotonic() - start)
+
+    def _start(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _upstream(self, function, *args):
+        self.stats['upstream_requests'] += 1
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def _translate_single(self, text, future):
+        try:
+            translation, _ = await self._upstream(request_translation, self.client, self.config, text,
+                                                  None, self.get_max_tokens([text]))
+            if not translation:
+                raise ValueError("Empty translation returned by the model")
+            if not future.done():
+                future.set_result(translation)
+        except Exception as err:
+            logger.debug("Exception translating text in serve mode: %s", err)
+            if not future.done():
+                future.set_exception(err)
+
+    def _add_to_batch(self, text, future):
+        self.batch.append((text, future))
+        if len(self.batch) >= self.max_batch_size:
+            self._flush_batch()
+        elif self.batch_timer is None:
+            self.batch_timer = asyncio.get_running_loop().call_later(self.batch_window, self._flush_batch)
+
+    def _flush_batch(self):
+        if self.batch_timer is not None:
+            self.batch_timer.cancel()
+            self.batch_timer = None
+        batch, self.batch = self.batch, []
+        if len(batch) == 1:
+            self._start(self._translate_single(*batch[0]))
+        elif batch:
+            self._start(self._translate_batch(batch))
+
+    async def _translate_batch(self, batch):
+        texts = [text for text, _ in batch]
+        self.stats['batches'] += 1
+        self.stats['batched_texts'] += len(batch)
+        try:
+            translations, _ = await self._upstream(request_batch_translation, self.client, self.config, texts,
+                                                   self.get_max_tokens(texts))
+        except Exception as err:
+            # Malformed answer or failed request, translate the texts one by one
+            logger.debug("Batch of %s texts failed, falling back to single requests: %s", len(batch), err)
+            self.stats['batch_fallbacks'] += 1
+            await asyncio.gather(*(self._translate_single(text, future) for text, future in batch))
+            return
+        for (_, future), translation in zip(batch, translations):
+            if not future.done():
+                future.set_result(translation)
+
+    def get_metrics(self):
+        """
+        Return the service stats: counters, requests in flight,
+        throughput since start and latency percentiles in seconds.
+        """
+        uptime = time.monotonic() - self.started
+        metrics = dict(self.stats)
+        metrics['in_flight'] = len(self.in_flight)
+        metrics['uptime_seconds'] = round(uptime, 3)
+        metrics['requests_per_second'] = round(self.stats['requests'] / uptime, 3) if uptime > 0 else 0.0
+        for percentile in (50, 95, 99):
+            metrics[f'latency_p{percentile}'] = self.latency.percentile(percentile)
+        return metrics
+
+    async def handle_request(self, method, target, body):
+        """
+        Route an HTTP request.
+
+        Returns:
+        (status, JSON payload)
+        """
+        path = target.split('?', 1)[0]
+        if path == '/metrics':
+            if method != 'GET':
+                return HTTPStatus.METHOD_NOT_ALLOWED, {'error': "Use GET"}
+            return HTTPStatus.OK, self.get_metrics()
+        if path != '/translate':
+            return HTTPStatus.NOT_FOUND, {'error': f"Unknown path {path}"}
+        if method != 'POST':
+            return HTTPStatus.METHOD_NOT_ALLOWED, {'error': "Use POST"}
+
+        try:
+            request = json.loads(body or b'null')
+        except ValueError:
+            return HTTPStatus.BAD_REQUEST, {'error': "Invalid JSON"}
+        if isinstance(request, dict) and isinstance(request.get('text'), str):
+            try:
+                return HTTPStatus.OK, {'translation': await self.translate(request['text'])}
+            except Exception as err:
+                return HTTPStatus.BAD_GATEWAY, {'error': f"{type(err).__name__}: {err}"}
+        if isinstance(request, dict) and isinstance(request.get('texts'), list) \
+                and all(isinstance(text, str) for text in request['texts']):
+            results = await asyncio.gather(*(self.translate(text) for text in request['texts']), return_exceptions=True)
+            return HTTPStatus.OK, {
+                'translations': [None if isinstance(result, Exception) else result for result in results],
+                'errors': [f"{type(result).__name__}: {result}" if isinstance(result, Exception) else None for result in results],
+            }
+        return HTTPStatus.BAD_REQUEST, {'error': "Expected {\"text\": str} or {\"texts\": [str]}"}
+
+    async def handle_connection(self, reader, writer):
+        """
+        Serve the HTTP requests of a connection, keep-alive included.
+        """
+        try:
+            while True:
+                try:
+                    request = await read_http_request(reader)
+                except ValueError as err:
+                    write_http_response(writer, HTTPStatus.BAD_REQUEST, {'error': str(err)}, False)
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, target, headers, body = request
+                if body is None:
+                    status, payload = HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {'error': "Request body too large"}
+                    keep_alive = False
+                else:
+                    status, payload = await self.handle_request(method, target, body)
+                    keep_alive = headers.get('connection', '').lower() != 'close'
+                write_http_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def read_http_request(reader):
+    """
+    Read an HTTP/1.1 request.
+
+    Returns:
+    (method, target, headers, body), body is None if it is larger than
+    MAX_BODY_SIZE, or None if the connection was closed
+
+    Raises:
+    ValueError on a malformed request
+    """
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    parts = request_line.decode('latin-1').split()
+    if len(parts) != 3:
+        raise ValueError("Malformed request line")
+    method, target, _ = parts
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        if len(headers) >= MAX_HEADER_COUNT:
+            raise ValueError("Too many headers")
+        name, separator, value = line.decode('latin-1').partition(':')
+        if not separator:
+            raise ValueError("Malformed header")
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError as err:
+        raise ValueError("Invalid Content-Length") from err
+    if length > MAX_BODY_SIZE:
+        return method, target, headers, None
+    body = await reader.readexactly(length) if length > 0 else b''
+    return method, target, headers, body
+
+
+def write_http_response(writer, status, payload, keep_alive=True):
+    """
+    Write an HTTP/1.1 response with a JSON payload.
+    """
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    head = (f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+            "\r\n")
+    writer.write(head.encode('latin-1') + body)
+
+
+async def serve(service, host='127.0.0.1', port=8080):
+    """
+    Run the HTTP server until cancelled.
+    """
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    logger.info("Serving translations on http://%s:%s", host, port)
+    async with server:
+        await server.serve_forever()
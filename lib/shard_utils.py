@@ -0,0 +1,131 @@
+"""
+HermeneisGPT library of functions to translate many scraped SQLite
+DBs (shards) in one run.
+
+Shards are scanned in parallel for pending messages, identical texts
+are translated once and the translations are written back in bulk to
+every shard where the text appears. Messages queued for retry in the
+translation_failure table of a shard are left to the retry pass.
+"""
+
+import os
+import glob
+from concurrent.futures import ThreadPoolExecutor
+from lib.db_utils import get_db_connection
+from lib.db_utils import create_tables_from_schema
+from lib.db_utils import insert_translation_parameters
+from lib.db_utils import get_pending_channel_messages
+from lib.db_utils import upsert_message_translations
+from lib.edit_utils import record_translation_sources
+from lib.failure_utils import get_failed_message_ids
+from lib.fingerprint_utils import backfill_config_fingerprints
+from lib.stats_utils import increment_translated_messages
+from lib.stats_utils import record_request_latencies
+
+
+SHARD_EXTENSIONS = ('.sqlite', '.sqlite3', '.db')
+
+
+def resolve_shard_paths(shards):
+    """
+    Resolve a directory or a glob pattern to a sorted list of SQLite
+    DB files. A directory matches the files with SHARD_EXTENSIONS.
+
+    Raises:
+    FileNotFoundError if no DB matches
+    """
+    if os.path.isdir(shards):
+        paths = [os.path.join(shards, name) for name in os.listdir(shards)
+                 if name.lower().endswith(SHARD_EXTENSIONS)]
+    else:
+        paths = glob.glob(shards)
+    paths = sorted(path for path in paths if os.path.isfile(path))
+    if not paths:
+        raise FileNotFoundError(f"No SQLite databases found: {shards}")
+    return paths
+
+
+def scan_shard(shard_path, schema_path, channel_name, translation_parameters):
+    """
+    Prepare a shard for translation and retrieve its pending messages.
+
+    Parameters:
+    shard_path
+    schema_path: SQLite schema for the translation tables
+    channel_name
+    translation_parameters: tuple of insert_translation_parameters()
+    arguments after the cursor
+
+    Returns:
+    (shard_path, translation_parameters_id, [(message_id, message_text)])
+    without the messages queued for retry
+    """
+    connection, cursor = get_db_connection(shard_path)
+    try:
+        create_tables_from_schema(connection, cursor, schema_path)
+        backfill_config_fingerprints(cursor)
+        translation_parameters_id = insert_translation_parameters(cursor, *translation_parameters)
+        failed_message_ids = get_failed_message_ids(cursor, translation_parameters_id)
+        pending = [(message_id, message_text)
+                   for message_id, message_text in get_pending_channel_messages(cursor, channel_name, translation_parameters_id)
+                   if message_id not in failed_message_ids]
+        connection.commit()
+        return shard_path, translation_parameters_id, pending
+    finally:
+        connection.close()
+
+
+def scan_shards(shard_paths, schema_path, channel_name, translation_parameters, max_workers=8):
+    """
+    Scan shards in parallel, each thread with its own connection.
+
+    Returns:
+    list of scan_shard() results in the order of shard_paths
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda path: scan_shard(path, schema_path, channel_name, translation_parameters),
+                                 shard_paths))
+
+
+def group_pending_by_text(scans, min_length=2):
+    """
+    Deduplicate the pending messages of all shards by text.
+
+    Parameters:
+    scans: scan_shards() results
+    min_length: shorter messages are not translated
+
+    Returns:
+    dict of message text to list of (shard_path, message_id), in
+    the order the texts were first found
+    """
+    texts = {}
+    for shard_path, _, pending in scans:
+        for message_id, message_text in pending:
+            if message_text and len(message_text) >= min_length:
+                texts.setdefault(message_text, []).append((shard_path, message_id))
+    return texts
+
+
+def write_shard_translations(cursor, translation_parameters_id, translations, usage=None, compressor=None):
+    """
+    Write translations back to a shard and count them in the
+    translation stats of the shard. The caller commits.
+
+    Parameters:
+    cursor: connection to the shard
+    translation_parameters_id
+    translations: list of (message_id, translation_text)
+    usage: optional RequestUsage of the translations
+    compressor: optional TextCompressor of the shard
+
+    Returns:
+    number of translations written
+    """
+    message_ids = [message_id for message_id, _ in translations]
+    upsert_message_translations(cursor, translation_parameters_id, translations, compressor)
+    record_translation_sources(cursor, translation_parameters_id, message_ids)
+    increment_translated_messages(cursor, translation_parameters_id, message_ids, usage.totals if usage else None)
+    if usage:
+        record_request_latencies(cursor, usage.latencies)
+    return len(translations)
@@ -0,0 +1,316 @@
+"""
+HermeneisGPT library of translation stats and spend.
+
+Counts per channel and translation parameters are kept in the
+translation_stats table and incremented as translations and failures
+are written, so the status of a DB is read from a few rows instead of
+counting the messages. Message counts per channel are kept in
+channel_stats and caught up from the last counted message_id of each
+channel, which assumes the scraper inserts the messages of a channel
+with increasing IDs.
+
+Failures that will be retried count as failed, failures given up after
+max_attempts count as skipped.
+"""
+
+import sqlite3
+from datetime import datetime
+from collections import Counter
+
+
+# cost in $ per 1k tokens as per 22.3.2024
+DEFAULT_INPUT_PRICE = 0.0005
+DEFAULT_OUTPUT_PRICE = 0.0015
+
+STATS_FIELDS = ('translated_count', 'failed_count', 'skipped_count', 'prompt_tokens', 'completion_tokens', 'cost')
+
+# Chunk size of IN (...) queries, below the SQLite variable limit
+QUERY_CHUNK_SIZE = 500
+
+
+def get_prices(pricing_config, model):
+    """
+    Return the input and output prices in $ per 1k tokens of a model
+    from the 'pricing' config section: model prices first, then the
+    section defaults, then DEFAULT_INPUT_PRICE and DEFAULT_OUTPUT_PRICE.
+
+    Returns:
+    (input_price, output_price)
+    """
+    pricing_config = pricing_config or {}
+    model_prices = (pricing_config.get('models') or {}).get(model.strip()) or {}
+    input_price = model_prices.get('input_price', pricing_config.get('input_price', DEFAULT_INPUT_PRICE))
+    output_price = model_prices.get('output_price', pricing_config.get('output_price', DEFAULT_OUTPUT_PRICE))
+    return float(input_price), float(output_price)
+
+
+def get_cost(pricing_config, model, prompt_tokens, completion_tokens):
+    """
+    Return the cost in $ of a request.
+    """
+    input_price, output_price = get_prices(pricing_config, model)
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1000
+
+
+def add_usage(totals, pricing_config, model, usage):
+    """
+    Add the token usage of a response and its cost to a Counter of
+    prompt_tokens, completion_tokens and cost. Responses without usage
+    are not counted, the losing request of a hedged response is.
+    """
+    if not usage:
+        return
+    totals['prompt_tokens'] += usage['prompt_tokens']
+    totals['completion_tokens'] += usage['completion_tokens']
+    totals['cost'] += get_cost(pricing_config, model, usage['prompt_tokens'], usage['completion_tokens'])
+    add_usage(totals, pricing_config, model, usage.get('hedged'))
+
+
+class RequestUsage:
+    """
+    Tokens, cost and latencies of the requests sent to translate one
+    message, filled by the worker thread sending them.
+    """
+
+    def __init__(self):
+        self.totals = Counter()
+        self.latencies = []
+
+    def add(self, pricing_config, model, usage, latency=None):
+        """
+        Count a response, see add_usage(), and its latency in seconds.
+        The losing request of a hedged response is counted with its
+        own latency when it answered, not when its usage is estimated.
+        """
+        add_usage(self.totals, pricing_config, model, usage)
+        if latency is not None:
+            self.latencies.append((model, (usage or {}).get('prompt_tokens'), (usage or {}).get('completion_tokens'), latency))
+        hedged = (usage or {}).get('hedged')
+        if hedged and hedged.get('latency') is not None:
+            self.latencies.append((model, hedged['prompt_tokens'], hedged['completion_tokens'], hedged['latency']))
+
+
+def get_failure_stats(attempt_count, max_attempts):
+    """
+    Return the (failed, skipped) increments of recording the
+    attempt_count-th failure of a message.
+    """
+    if attempt_count == max_attempts:
+        # Given up, no longer pending a retry
+        return (-1, 1) if attempt_count > 1 else (0, 1)
+    if attempt_count == 1:
+        return 1, 0
+    return 0, 0
+
+
+def record_request_latencies(cursor, latencies):
+    """
+    Store the latencies of requests, used to plan runs.
+
+    Parameters:
+    cursor
+    latencies: list of (model, prompt_tokens, completion_tokens, seconds)
+
+    Raises:
+    sqlite3.OperationalError
+    """
+    query = """
+    INSERT INTO request_latency (translation_model, prompt_tokens, completion_tokens, latency_seconds, request_timestamp)
+    VALUES (?, ?, ?, ?, ?)
+    """
+    timestamp = datetime.utcnow().isoformat()
+    try:
+        cursor.executemany(query, [latency + (timestamp,) for latency in latencies])
+    except sqlite3.OperationalError as e:
+        raise sqlite3.OperationalError(f"Operational error storing request latencies: {e}")
+
+
+def get_message_channels(cursor, message_ids):
+    """
+    Return the channel ID of each message.
+
+    Returns:
+    dict of message_id to channel_id
+
+    Raises:
+    sqlite3.OperationalError
+    """
+    message_ids = list(message_ids)
+    channels = {}
+    try:
+        for start in range(0, len(message_ids), QUERY_CHUNK_SIZE):
+            chunk = message_ids[start:start + QUERY_CHUNK_SIZE]
+            cursor.execute(f"SELECT message_id, channel_id FROM messages WHERE message_id IN ({','.join('?' * len(chunk))})", chunk)
+            channels.update(cursor.fetchall())
+        return channels
+    except sqlite3.OperationalError as e:
+        raise sqlite3.OperationalError(f"Operational error retrieving message channels: {e}")
+
+
+def increment_translation_stats(cursor, channel_id, translation_parameters_id, **increments):
+    """
+    Add increments to the stats of a channel and translation
+    parameters.
+
+    Parameters:
+    cursor
+    channel_id
+    translation_parameters_id
+    increments: values to add to the STATS_FIELDS, e.g. translated_count=1
+
+    Raises:
+    sqlite3.IntegrityError
+    sqlite3.OperationalError
+    """
+    unknown = set(increments) - set(STATS_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown translation stats: {', '.join(sorted(unknown))}")
+    query = f"""
+    INSERT INTO translation_stats (channel_id, translation_parameters_id, {', '.join(STATS_FIELDS)})
+    VALUES (?, ?, {', '.join('?' * len(STATS_FIELDS))})
+    ON CONFLICT(channel_id, translation_parameters_id) DO UPDATE SET
+    {', '.join(f"{field} = {field} + excluded.{field}" for field in STATS_FIELDS)}
+    """
+    try:
+        cursor.execute(query, [channel_id, translation_parameters_id] + [increments.get(field, 0) for field in STATS_FIELDS])
+    except sqlite3.IntegrityError as e:
+        raise sqlite3.IntegrityError(f"Integrity error updating translation stats: {e}")
+    except sqlite3.OperationalError as e:
+        raise sqlite3.OperationalError(f"Operational error updating translation stats: {e}")
+
+
+def increment_translated_messages(cursor, translation_parameters_id, message_ids, usage=None):
+    """
+    Count new translations of messages, grouped by channel. The usage
+    (prompt_tokens, completion_tokens and cost) is added to the
+    channel of the first message.
+    """
+    channels = get_message_channels(cursor, message_ids)
+    counts = Counter(channels[message_id] for message_id in message_ids if message_id in channels)
+    for index, (channel_id, count) in enumerate(counts.items()):
+        increments = {'translated_count': count}
+        if index == 0 and usage:
+            increments.update({field: usage.get(field, 0) for field in ('prompt_tokens', 'completion_tokens', 'cost')})
+        increment_translation_stats(cursor, channel_id, translation_parameters_id, **increments)
+
+
+def has_translation_stats(cursor):
+    """
+    Check if the stats were built, see rebuild_translation_stats().
+
+    Raises:
+    sqlite3.OperationalError
+    """
+    try:
+        cursor.execute("SELECT 1 FROM channel_stats LIMIT 1")
+        return cursor.fetchone() is not None
+    except sqlite3.OperationalError as e:
+        raise sqlite3.OperationalError(f"Operational error checking channel stats: {e}")
+
+
+def refresh_channel_stats(cursor):
+    """
+    Count the messages inserted since the last refresh. Message IDs
+    are only unique within a channel, each channel is compared with its
+    own last counted message ID.
+
+    Returns:
+    number of channels with new messages
+
+    Raises:
+    sqlite3.OperationalError
+    """
+    query = """
+    INSERT INTO channel_stats (channel_id, message_count, last_message_id)
+    SELECT m.channel_id, count(*), max(m.message_id) FROM messages m
+    LEFT JOIN channel_stats s ON s.channel_id = m.channel_id
+    WHERE m.message_id > coalesce(s.last_message_id, 0)
+    GROUP BY m.channel_id
+    ON CONFLICT(channel_id) DO UPDATE SET
+    message_count = message_count + excluded.message_count,
+    last_message_id = max(last_message_id, excluded.last_message_id)
+    """
+    try:
+        cursor.execute(query)
+        return cursor.rowcount
+    except sqlite3.OperationalError as e:
+        raise sqlite3.OperationalError(f"Operational error refreshing channel stats: {e}")
+
+
+def rebuild_translation_stats(cursor, max_attempts):
+    """
+    Recount the messages, translations and failures of every channel.
+    Token totals and spend are not stored per translation and are kept.
+
+    Parameters:
+    cursor
+    max_attempts: failures with as many attempts count as skipped
+
+    Raises:
+    sqlite3.OperationalError
+    """
+    translated_query = """
+    INSERT INTO translation_stats (channel_id, translation_parameters_id, translated_count)
+    SELECT m.channel_id, mt.translation_parameters_id, count(*)
+    FROM message_translation mt
+    JOIN messages m ON m.message_id = mt.message_id
+    WHERE mt.translation_text IS NOT NULL
+    GROUP BY m.channel_id, mt.translation_parameters_id
+    ON CONFLICT(channel_id, translation_parameters_id) DO UPDATE SET
+    translated_count = excluded.translated_count
+    """
+    failed_query = """
+    INSERT INTO translation_stats (channel_id, translation_parameters_id, failed_count, skipped_count)
+    SELECT m.channel_id, f.translation_parameters_id,
+           sum(f.attempt_count < ?), sum(f.attempt_count >= ?)
+    FROM translation_failure f
+    JOIN messages m ON m.message_id = f.message_id
+    GROUP BY m.channel_id, f.translation_parameters_id
+    ON CONFLICT(channel_id, translation_parameters_id) DO UPDATE SET
+    failed_count = excluded.failed_count,
+    skipped_count = excluded.skipped_count
+    """
+    try:
+        cursor.execute("UPDATE translation_stats SET translated_count = 0, failed_count = 0, skipped_count = 0")
+        cursor.execute(translated_query)
+        cursor.execute(failed_query, (max_attempts, max_attempts))
+        cursor.execute("DELETE FROM channel_stats")
+        refresh_channel_stats(cursor)
+    except sqlite3.OperationalError as e:
+        raise sqlite3.OperationalError(f"Operational error rebuilding translation stats: {e}")
+
+
+def get_translation_status(cursor, channel_name=None):
+    """
+    Return the stats of every channel, or of one channel, per
+    translation parameters. Channels without translations have a
+    single row with no translation parameters.
+
+    Returns:
+    list of dicts with channel_name, message_count,
+    translation_parameters_id, translation_model, the STATS_FIELDS and
+    pending_count
+
+    Raises:
+    sqlite3.OperationalError
+    """
+    query = f"""
+    SELECT c.channel_name, cs.message_count, ts.translation_parameters_id, tp.translation_model,
+           {', '.join(f"coalesce(ts.{field}, 0)" for field in STATS_FIELDS)}
+    FROM channel_stats cs
+    JOIN channels c ON c.channel_id = cs.channel_id
+    LEFT JOIN translation_stats ts ON ts.channel_id = cs.channel_id
+    LEFT JOIN translation_parameters tp ON tp.translation_parameters_id = ts.translation_parameters_id
+    WHERE ? IS NULL OR c.channel_name = ?
+    ORDER BY c.channel_name, ts.translation_parameters_id
+    """
+    try:
+        cursor.execute(query, (channel_name, channel_name))
+        status = []
+        for row in cursor.fetchall():
+            entry = dict(zip(('channel_name', 'message_count', 'translation_parameters_id', 'translation_model') + STATS_FIELDS, row))
+            entry['pending_count'] = max(entry['message_count'] - entry['translated_count'] - entry['failed_count'] - entry['skipped_count'], 0)
+            status.append(entry)
+        return status
+    except sqlite3.OperationalError as e:
+        raise sqlite3.OperationalError(f"Operational error retrieving translation status: {e}")
@@ -0,0 +1,134 @@
+"""
+HermeneisGPT library to size max_tokens per request.
+
+The number of output tokens is predicted from the number of input
+tokens with the output/input ratio of past translations, so short
+messages do not reserve the whole configured max_tokens from the
+tokens-per-minute quota and long messages are not truncated.
+"""
+
+import math
+import sqlite3
+import logging
+from lib.db_utils import decode_translation_text
+
+
+logger = logging.getLogger('hermeneis')
+
+DEFAULT_RATIO = 1.5
+DEFAULT_PERCENTILE = 90
+DEFAULT_MARGIN = 0.2
+DEFAULT_MIN_TOKENS = 32
+DEFAULT_MAX_TOKENS = 4096
+DEFAULT_SAMPLE_SIZE = 500
+DEFAULT_MIN_SAMPLES = 20
+
+# Shorter messages give noisy ratios and are left out of the sample
+MIN_SAMPLE_INPUT_TOKENS = 8
+
+
+def get_translation_samples(cursor, translation_model, sample_size=DEFAULT_SAMPLE_SIZE):
+    """
+    Retrieve the most recent (message_text, translation_text) pairs
+    translated with the given model.
+
+    Raises:
+    sqlerrors various
+    """
+    query = """
+    SELECT m.message_text, mt.translation_text
+    FROM message_translation mt
+    JOIN translation_parameters tp ON tp.translation_parameters_id = mt.translation_parameters_id
+    JOIN messages m ON m.message_id = mt.message_id
+    WHERE tp.translation_model = ? AND mt.translation_text IS NOT NULL AND m.message_text IS NOT NULL
+    ORDER BY mt.translation_timestamp DESC
+    LIMIT ?
+    """
+    try:
+        cursor.execute(query, (translation_model, sample_size))
+        return [(message_text, decode_translation_text(cursor, translation_text))
+                for message_text, translation_text in cursor.fetchall()]
+    except sqlite3.OperationalError:
+        raise
+    except sqlite3.DatabaseError:
+        raise
+
+
+def learn_output_ratio(encoding, samples, percentile=DEFAULT_PERCENTILE, min_samples=DEFAULT_MIN_SAMPLES):
+    """
+    Learn the output/input token ratio from past translations.
+
+    A high percentile of the per-message ratios is used instead of the
+    mean, so most translations fit in the predicted budget.
+
+    Parameters:
+    encoding: tiktoken encoding
+    samples: list of (message_text, translation_text)
+    percentile
+    min_samples: minimum number of usable samples
+
+    Returns:
+    ratio, or None if there are not enough samples
+    """
+    ratios = []
+    for message_text, translation_text in samples:
+        input_tokens = len(encoding.encode(message_text))
+        if input_tokens < MIN_SAMPLE_INPUT_TOKENS:
+            continue
+        ratios.append(len(encoding.encode(translation_text)) / input_tokens)
+    if len(ratios) < min_samples:
+        return None
+    ratios.sort()
+    return ratios[min(len(ratios) - 1, int(len(ratios) * percentile / 100))]
+
+
+class TokenBudget:
+    """
+    Predicts the max_tokens of a translation request from the input.
+    """
+
+    def __init__(self, encoding, budget_config=None, ratio=None):
+        budget_config = budget_config or {}
+        self.encoding = encoding
+        self.ratio = ratio or float(budget_config.get('default_ratio', DEFAULT_RATIO))
+        self.margin = float(budget_config.get('margin', DEFAULT_MARGIN))
+        self.min_tokens = int(budget_config.get('min_tokens', DEFAULT_MIN_TOKENS))
+        self.max_tokens = int(budget_config.get('max_tokens', DEFAULT_MAX_TOKENS))
+
+    def get_max_tokens(self, message_text):
+        """
+        Return the max_tokens for the translation of a message.
+        """
+        input_tokens = len(self.encoding.encode(message_text))
+        predicted = math.ceil(input_tokens * self.ratio * (1 + self.margin)) + self.min_tokens
+        return min(self.max_tokens, predicted)
+
+
+def build_token_budget(encoding, budget_config, cursor=None, translation_model=None):
+    """
+    Build a TokenBudget with the ratio learned from the translations in
+    the DB, or the configured default_ratio if there are not enough.
+
+    Parameters:
+    encoding: tiktoken encoding
+    budget_config: 'token_budget' section of the YAML config
+    cursor: optional, DB with past translations
+    translation_model: model of the past translations to learn from
+
+    Returns:
+    TokenBudget
+    """
+    budget_config = budget_config or {}
+    ratio = None
+    if cursor is not None:
+        samples = get_translation_samples(cursor, translation_model,
+                                          int(budget_config.get('sample_size', DEFAULT_SAMPLE_SIZE)))
+        ratio = learn_output_ratio(encoding, samples,
+                                   float(budget_config.get('percentile', DEFAULT_PERCENTILE)),
+                                   int(budget_config.get('min_samples', DEFAULT_MIN_SAMPLES)))
+        if ratio is not None:
+            logger.info("Learned output/input token ratio %.2f from %s past translations", ratio, len(samples))
+    budget = TokenBudget(encoding, budget_config, ratio)
+    if ratio is None:
+        logger.debug("Not enough past translations, using output/input token ratio %.2f", budget.ratio)
+    return budget
@@ -0,0 +1,142 @@
+"""
+HermeneisGPT tokenizer registry.
+
+Encodings are loaded once per process and shared by every component
+that counts tokens (cost analysis, token budget, routing, planning).
+tiktoken downloads its BPE files on first use, the registry points it
+to a local cache directory so air-gapped hosts work offline:
+
+- the 'cache_dir' of the 'tokenizer' config section, or
+- the bundled assets/tiktoken_cache directory when it exists.
+
+Copy the cache directory from a host with network access (or run
+hermeneisGPT there once with the same cache_dir) to fill it. Models
+tiktoken does not know use the fallback encoding, and if no encoding
+can be loaded, tokens are approximated from the text length.
+"""
+
+import os
+import math
+import logging
+import threading
+import tiktoken
+
+
+logger = logging.getLogger('hermeneis')
+
+BUNDLED_CACHE_DIR = os.path.join('assets', 'tiktoken_cache')
+DEFAULT_FALLBACK_ENCODING = 'cl100k_base'
+
+# Average UTF-8 bytes per token of cl100k_base on mixed Russian and English text
+APPROXIMATE_BYTES_PER_TOKEN = 4
+
+
+class ApproximateEncoding:
+    """
+    Stand-in encoding when no BPE file is available, only the number
+    of tokens it returns is meaningful.
+    """
+
+    name = 'approximate'
+
+    def encode(self, text, **kwargs):
+        """
+        Return a list with about as many items as tokens in the text.
+        """
+        return [0] * math.ceil(len(text.encode('utf-8')) / APPROXIMATE_BYTES_PER_TOKEN)
+
+
+class TokenizerRegistry:
+    """
+    Loads and caches the encoding of every model.
+    """
+
+    def __init__(self, tokenizer_config=None):
+        tokenizer_config = tokenizer_config or {}
+        self.cache_dir = tokenizer_config.get('cache_dir')
+        if self.cache_dir is None and os.path.isdir(BUNDLED_CACHE_DIR):
+            self.cache_dir = BUNDLED_CACHE_DIR
+        self.fallback_encoding = tokenizer_config.get('fallback_encoding', DEFAULT_FALLBACK_ENCODING)
+        self.models = dict(tokenizer_config.get('models') or {})
+        self.encodings = {}
+        self.lock = threading.Lock()
+        if self.cache_dir:
+            # Read by tiktoken when it loads a BPE file
+            os.environ['TIKTOKEN_CACHE_DIR'] = os.path.abspath(self.cache_dir)
+
+    def get_encoding_name(self, model):
+        """
+        Return the encoding name of a model: configured, known to
+        tiktoken, or the fallback encoding.
+        """
+        model = model.strip()
+        if model in self.models:
+            return self.models[model]
+        try:
+            return tiktoken.encoding_name_for_model(model)
+        except KeyError:
+            logger.debug("Unknown model %s for tiktoken, using encoding %s", model, self.fallback_encoding)
+            return self.fallback_encoding
+
+    def load_encoding(self, name):
+        """
+        Load an encoding by name, the fallback encoding if it fails and
+        an ApproximateEncoding if no encoding can be loaded.
+        """
+        for candidate in dict.fromkeys((name, self.fallback_encoding)):
+            try:
+                return tiktoken.get_encoding(candidate)
+            except Exception as err:
+                logger.warning("Could not load tiktoken encoding %s: %s", candidate, err)
+        logger.warning("Approximating token counts from the text length")
+        return ApproximateEncoding()
+
+    def get_encoding(self, model):
+        """
+        Return the encoding of a model, loaded once per process.
+        """
+        name = self.get_encoding_name(model)
+        with self.lock:
+            if name not in self.encodings:
+                self.encodings[name] = self.load_encoding(name)
+            return self.encodings[name]
+
+    def count_tokens(self, model, text):
+        """
+        Return the number of tokens of a text for a model.
+        """
+        return len(self.get_encoding(model).encode(text))
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def configure_tokenizer(tokenizer_config=None):
+    """
+    Create the registry shared by the process from the 'tokenizer'
+    section of the YAML config.
+    """
+    global _registry
+    with _registry_lock:
+        _registry = TokenizerRegistry(tokenizer_config)
+        return _registry
+
+
+def get_tokenizer():
+    """
+    Return the registry shared by the process, created with the
+    default settings if configure_tokenizer() was not called.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = TokenizerRegistry()
+        return _registry
+
+
+def get_encoding(model):
+    """
+    Return the encoding of a model from the shared registry.
+    """
+    return get_tokenizer().get_encoding(model)
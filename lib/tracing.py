@@ -0,0 +1,173 @@
+"""
+HermeneisGPT library of tracing spans and a sampling profiler.
+
+Spans are written as a Chrome trace-event JSON file that can be opened
+in chrome://tracing or https://ui.perfetto.dev. The profiler samples
+the stacks of the busy threads and writes them in the folded format
+used by flamegraph.pl and https://www.speedscope.app. It is a
+wall-clock profile: threads waiting on the network are sampled, idle
+threads waiting for work (pool workers, the log listener) are not.
+
+Tracing is disabled by default and span() costs a single check then.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+from contextlib import nullcontext
+from collections import Counter
+
+
+DEFAULT_SAMPLING_INTERVAL = 0.005
+
+# Innermost frames of threads waiting for work: (file suffix, function)
+IDLE_FRAMES = (
+    ('threading.py', 'wait'),
+    ('threading.py', '_wait_for_tstate_lock'),
+    ('queue.py', 'get'),
+    (os.path.join('futures', 'thread.py'), '_worker'),
+)
+
+_tracer = None
+
+
+class Tracer:
+    """
+    Collects complete ('X') trace events from all threads.
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.start = time.perf_counter()
+        self.events = []
+        self.threads = {}
+        self.lock = threading.Lock()
+
+    def _now(self):
+        return (time.perf_counter() - self.start) * 1e6
+
+    @contextmanager
+    def span(self, name, **args):
+        """
+        Record the time spent in the block as an event.
+        """
+        thread = threading.current_thread()
+        start = self._now()
+        try:
+            yield
+        finally:
+            event = {'name': name, 'ph': 'X', 'ts': round(start, 3), 'dur': round(self._now() - start, 3),
+                     'pid': self.pid, 'tid': thread.ident}
+            if args:
+                event['args'] = args
+            with self.lock:
+                self.events.append(event)
+                self.threads.setdefault(thread.ident, thread.name)
+
+    def get_trace(self):
+        """
+        Return the trace as a dict in the Chrome trace-event format.
+        """
+        with self.lock:
+            events = list(self.events)
+            threads = dict(self.threads)
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': name}}
+                    for tid, name in threads.items()]
+        return {'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}
+
+    def write(self, trace_path):
+        """
+        Write the trace-event JSON file.
+        """
+        with open(trace_path, 'w', encoding='utf-8') as trace_file:
+            json.dump(self.get_trace(), trace_file)
+
+
+def enable_tracing():
+    """
+    Start recording spans, returns the Tracer.
+    """
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def get_tracer():
+    """
+    Return the active Tracer, or None if tracing is disabled.
+    """
+    return _tracer
+
+
+def span(name, **args):
+    """
+    Context manager timing a block when tracing is enabled:
+
+        with span('get_channel_messages', channel=channel_name):
+            ...
+    """
+    if _tracer is None:
+        return nullcontext()
+    return _tracer.span(name, **args)
+
+
+def is_idle_frame(frame):
+    """
+    Check if the innermost frame of a thread is waiting for work.
+    """
+    code = frame.f_code
+    return any(code.co_name == name and code.co_filename.endswith(suffix) for suffix, name in IDLE_FRAMES)
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stacks of the busy threads from a background
+    thread, see IDLE_FRAMES.
+    """
+
+    def __init__(self, interval=DEFAULT_SAMPLING_INTERVAL):
+        self.interval = interval
+        self.samples = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+
+    def start(self):
+        """
+        Start sampling.
+        """
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop sampling and wait for the sampling thread.
+        """
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        names = {}
+        while not self.stopped.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.thread.ident or is_idle_frame(frame):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def write(self, profile_path):
+        """
+        Write the samples in the folded stack format, one
+        'thread;outer;...;inner count' line per stack.
+        """
+        with open(profile_path, 'w', encoding='utf-8') as profile_file:
+            for stack, count in self.samples.most_common():
+                profile_file.write(f"{stack} {count}\n")
@@ -0,0 +1,430 @@
+"""
+HermeneisGPT library API to translate messages with an LLM.
+
+translate_many() can be embedded in other pipelines:
+
+    async def main():
+        client = build_async_openai_client(api_key)
+        async for message_id, translation, usage in translate_many(client, config, messages):
+            ...
+
+    asyncio.run(main())
+"""
+
+import json
+import asyncio
+import logging
+from collections import namedtuple
+from lib.degeneration import DegenerationDetector
+from lib.degeneration import DegenerateOutputError
+
+
+logger = logging.getLogger('hermeneis')
+
+# Answer of the LLM to a translation request
+TranslationResult = namedtuple('TranslationResult', ['translation', 'usage', 'finish_reason', 'model'])
+
+DEFAULT_DEGENERATE_RETRIES = 1
+DEFAULT_RETRY_TEMPERATURE = 0.7
+
+BATCH_INSTRUCTIONS = ("The text is a JSON array of separate messages. Translate each message on its own and "
+                      "answer only with a JSON array of strings with the translations, in the same order.")
+
+LANGUAGES_INSTRUCTIONS = ("Translate the text into each of these languages: {languages}. Answer only with a JSON "
+                          "object whose keys are these language names and whose values are the translations.")
+
+
+def build_translation_messages(config, message, hint=None):
+    """
+    Build the chat messages sent to the LLM to translate a message.
+    An optional hint (e.g. the translation of a near-duplicate message)
+    is given to the model as extra system instructions.
+    """
+    translate_messages = [{"role": "system", "content": config['system']}]
+    if hint:
+        translate_messages.append({"role": "system", "content": hint})
+    translate_messages.append({"role": "user", "content": config['user'] + message})
+    return translate_messages
+
+
+def get_usage(llm_response):
+    """
+    Return the token usage of an LLM response as a dict, or None
+    if the server did not report it. The usage of the losing request
+    of a hedged response is under 'hedged', see lib.hedging.
+    """
+    usage = getattr(llm_response, 'usage', None)
+    if usage is None:
+        return None
+    result = {
+        'prompt_tokens': usage.prompt_tokens,
+        'completion_tokens': usage.completion_tokens,
+        'total_tokens': usage.total_tokens,
+    }
+    hedged_usage = getattr(llm_response, 'hedged_usage', None)
+    if hedged_usage:
+        result['hedged'] = hedged_usage
+    return result
+
+
+def complete_translation(client, config, message, hint=None, max_tokens=None, model=None):
+    """
+    Request the translation of a message to the LLM and return the
+    details of the answer.
+
+    Parameters:
+    client: OpenAI client
+    config: parsed YAML config
+    message
+    hint: optional extra instructions
+    max_tokens: optional, overrides max_tokens of the config
+    model: optional, overrides the model of the config
+
+    Returns:
+    TranslationResult
+
+    Raises:
+    openai errors
+    DegenerateOutputError when streaming, see stream_translation()
+    """
+    streaming = config.get('streaming')
+    if streaming:
+        # Degenerate answers are retried at a higher temperature, loops are often deterministic
+        retries = int(streaming.get('retries', DEFAULT_DEGENERATE_RETRIES))
+        temperature = None
+        for attempt in range(retries + 1):
+            try:
+                return stream_translation(client, config, message, hint, max_tokens, model, temperature)
+            except DegenerateOutputError as err:
+                if attempt == retries:
+                    raise
+                logger.debug("Retrying degenerate translation (%s)", err.reason)
+                temperature = float(streaming.get('retry_temperature', DEFAULT_RETRY_TEMPERATURE))
+
+    model = model or config['model']
+    llm_response = client.chat.completions.create(
+        model=model,
+        messages=build_translation_messages(config, message, hint),
+        max_tokens=max_tokens or config['max_tokens'],
+        temperature=config['temperature'],
+    )
+    choice = llm_response.choices[0]
+    return TranslationResult(choice.message.content, get_usage(llm_response),
+                             getattr(choice, 'finish_reason', None), model)
+
+
+def stream_translation(client, config, message, hint=None, max_tokens=None, model=None, temperature=None):
+    """
+    Stream the translation of a message and abort the request as soon
+    as the output degenerates, see lib.degeneration.
+
+    Parameters:
+    client: OpenAI client
+    config: parsed YAML config, with the 'streaming' section
+    message
+    hint: optional extra instructions
+    max_tokens: optional, overrides max_tokens of the config
+    model: optional, overrides the model of the config
+    temperature: optional, overrides the temperature of the config
+
+    Returns:
+    TranslationResult, usage is None if the server did not report it
+
+    Raises:
+    openai errors
+    DegenerateOutputError
+    """
+    model = model or config['model']
+    detector = DegenerationDetector(message, config.get('streaming'))
+    stream = client.chat.completions.create(
+        model=model,
+        messages=build_translation_messages(config, message, hint),
+        max_tokens=max_tokens or config['max_tokens'],
+        temperature=config['temperature'] if temperature is None else temperature,
+        stream=True,
+        stream_options={'include_usage': True},
+    )
+    usage = None
+    finish_reason = None
+    try:
+        for chunk in stream:
+            if getattr(chunk, 'usage', None) is not None:
+                usage = get_usage(chunk)
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            finish_reason = choice.finish_reason or finish_reason
+            if choice.delta.content:
+                reason = detector.feed(choice.delta.content)
+                if reason is not None:
+                    raise DegenerateOutputError(reason, detector.get_text())
+    finally:
+        # Closing the connection stops the generation of an aborted answer
+        if hasattr(stream, 'close'):
+            stream.close()
+    return TranslationResult(detector.get_text(), usage, finish_reason, model)
+
+
+def request_translation(client, config, message, hint=None, max_tokens=None):
+    """
+    Request the translation of a message to the LLM.
+
+    Parameters:
+    client: OpenAI client
+    config: parsed YAML config
+    message
+    hint: optional extra instructions
+    max_tokens: optional, overrides max_tokens of the config
+
+    Returns:
+    (translation, usage)
+
+    Raises:
+    openai errors
+    """
+    result = complete_translation(client, config, message, hint, max_tokens)
+    return result.translation, result.usage
+
+
+def build_batch_translation_messages(config, messages):
+    """
+    Build the chat messages sent to the LLM to translate several short
+    messages in one request, as a JSON array.
+    """
+    return [
+        {"role": "system", "content": config['system']},
+        {"role": "system", "content": BATCH_INSTRUCTIONS},
+        {"role": "user", "content": config['user'] + json.dumps(messages, ensure_ascii=False)},
+    ]
+
+
+def parse_batch_translation(content, count):
+    """
+    Parse the JSON array answered to a batch translation request.
+
+    Raises:
+    ValueError if the answer is not a JSON array of 'count' strings
+    """
+    content = (content or '').strip()
+    if content.startswith('```'):
+        # Drop a markdown code fence around the JSON
+        content = content.strip('`').removeprefix('json').strip()
+    translations = json.loads(content)
+    if not isinstance(translations, list) or len(translations) != count \
+            or not all(isinstance(translation, str) for translation in translations):
+        raise ValueError(f"Expected a JSON array of {count} translations")
+    return translations
+
+
+def request_batch_translation(client, config, messages, max_tokens=None):
+    """
+    Request the translation of several messages in one LLM request.
+
+    Parameters:
+    client: OpenAI client
+    config: parsed YAML config
+    messages: list of texts
+    max_tokens: optional, overrides max_tokens of the config
+
+    Returns:
+    (list of translations, usage)
+
+    Raises:
+    openai errors
+    ValueError if the answer does not match the messages
+    """
+    llm_response = client.chat.completions.create(
+        model=config['model'],
+        messages=build_batch_translation_messages(config, messages),
+        max_tokens=max_tokens or config['max_tokens'],
+        temperature=config['temperature'],
+    )
+    return parse_batch_translation(llm_response.choices[0].message.content, len(messages)), get_usage(llm_response)
+
+
+def get_target_languages(config):
+    """
+    Return the target languages of the 'languages' config section, or
+    an empty list when the config translates to the language of its
+    prompt only.
+
+    Raises:
+    ValueError if the section is not a list of distinct language names
+    """
+    languages = config.get('languages') or []
+    if not isinstance(languages, list) or not all(isinstance(language, str) and language.strip() for language in languages):
+        raise ValueError("languages must be a list of language names")
+    languages = [language.strip() for language in languages]
+    if len(set(languages)) != len(languages):
+        raise ValueError("languages must not repeat a language")
+    return languages
+
+
+def build_languages_translation_messages(config, message, languages, hint=None):
+    """
+    Build the chat messages sent to the LLM to translate a message into
+    several languages in one request, answered as a JSON object.
+    """
+    translate_messages = build_translation_messages(config, message, hint)
+    translate_messages.insert(1, {"role": "system", "content": LANGUAGES_INSTRUCTIONS.format(languages=', '.join(languages))})
+    return translate_messages
+
+
+def parse_languages_translation(content, languages):
+    """
+    Parse the JSON object answered to a multi-language translation
+    request.
+
+    Returns:
+    dict of language to translation
+
+    Raises:
+    ValueError if the answer is not a JSON object with a non-empty
+    translation for each language
+    """
+    content = (content or '').strip()
+    if content.startswith('```'):
+        # Drop a markdown code fence around the JSON
+        content = content.strip('`').removeprefix('json').strip()
+    translations = json.loads(content)
+    if not isinstance(translations, dict):
+        raise ValueError("Expected a JSON object of translations")
+    # Models do not always keep the case of the language names
+    by_name = {str(name).strip().lower(): translation for name, translation in translations.items()}
+    missing = [language for language in languages
+               if not isinstance(by_name.get(language.lower()), str) or not by_name[language.lower()].strip()]
+    if missing:
+        raise ValueError(f"Missing translations for {', '.join(missing)}")
+    return {language: by_name[language.lower()] for language in languages}
+
+
+def request_languages_translation(client, config, message, languages, hint=None, max_tokens=None):
+    """
+    Request the translation of a message into several languages in one
+    LLM request, so the input tokens are paid once for all of them.
+
+    Parameters:
+    client: OpenAI client
+    config: parsed YAML config
+    message
+    languages: list of target language names
+    hint: optional extra instructions
+    max_tokens: optional, overrides max_tokens of the config, which is
+    otherwise allowed for each language
+
+    Returns:
+    TranslationResult whose translation is a dict of language to
+    translation
+
+    Raises:
+    openai errors
+    ValueError if the answer does not have every language
+    """
+    model = config['model']
+    llm_response = client.chat.completions.create(
+        model=model,
+        messages=build_languages_translation_messages(config, message, languages, hint),
+        max_tokens=max_tokens or config['max_tokens'] * len(languages),
+        temperature=config['temperature'],
+    )
+    choice = llm_response.choices[0]
+    return TranslationResult(parse_languages_translation(choice.message.content, languages), get_usage(llm_response),
+                             getattr(choice, 'finish_reason', None), model)
+
+
+async def async_request_translation(client, config, message, hint=None, max_tokens=None):
+    """
+    Request the translation of a message to the LLM with an
+    AsyncOpenAI client.
+
+    Returns:
+    (translation, usage)
+
+    Raises:
+    openai errors
+    """
+    llm_response = await client.chat.completions.create(
+        model=config['model'],
+        messages=build_translation_messages(config, message, hint),
+        max_tokens=max_tokens or config['max_tokens'],
+        temperature=config['temperature'],
+    )
+    return llm_response.choices[0].message.content, get_usage(llm_response)
+
+
+async def _iterate(messages):
+    if hasattr(messages, '__aiter__'):
+        async for item in messages:
+            yield item
+    else:
+        for item in messages:
+            yield item
+
+
+async def translate_many(client, config, messages, concurrency=8, ordered=False, token_budget=None):
+    """
+    Translate many messages concurrently.
+
+    Messages are read lazily, at most 'concurrency' translations are
+    in flight (or waiting to be yielded in order) at any time, so
+    memory use does not depend on the number of messages.
+
+    Parameters:
+    client: AsyncOpenAI client
+    config: parsed YAML config
+    messages: iterable or async iterable of (id, text)
+    concurrency: maximum number of requests in flight
+    ordered: yield results in input order instead of completion order
+    token_budget: optional TokenBudget to size max_tokens per message
+
+    Yields:
+    (id, translation, usage), translation and usage are None when
+    the request failed
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+
+    async def run(index, message_id, text):
+        try:
+            max_tokens = token_budget.get_max_tokens(text) if token_budget else None
+            translation, usage = await async_request_translation(client, config, text, max_tokens=max_tokens)
+        except Exception as err:
+            logger.debug("Exception in translate_many() for message %s: %s", message_id, err)
+            translation, usage = None, None
+        return index, (message_id, translation, usage)
+
+    source = _iterate(messages)
+    pending = set()
+    finished = {}
+    next_index = 0
+    index = 0
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) + len(finished) < concurrency:
+                try:
+                    message_id, text = await source.__anext__()
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                pending.add(asyncio.ensure_future(run(index, message_id, text)))
+                index = index + 1
+
+            if not pending:
+                break
+
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                result_index, result = task.result()
+                if ordered:
+                    finished[result_index] = result
+                else:
+                    yield result
+
+            while next_index in finished:
+                yield finished.pop(next_index)
+                next_index = next_index + 1
+    finally:
+        for task in pending:
+            task.cancel()
+        await source.aclose()
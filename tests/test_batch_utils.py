@@ -0,0 +1,92 @@
+# pylint: disable=missing-docstring
+# pylint: disable=line-too-long
+import io
+import sys
+import json
+import time
+import threading
+import pytest
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from lib.batch_utils import split_stream
+from lib.batch_utils import read_records
+from lib.batch_utils import format_record
+from lib.batch_utils import translate_ordered
+
+
+def test_split_stream():
+    assert list(split_stream(io.StringIO("a\0bc\0\0d"), '\0', chunk_size=2)) == ["a", "bc", "", "d"]
+    assert list(split_stream(io.StringIO("a\nb\0c\0"), '\0')) == ["a\nb", "c"]
+    assert list(split_stream(io.StringIO(""), '\0')) == []
+
+
+def test_read_records_line():
+    assert list(read_records(io.StringIO("один\r\n\nдва\n"))) == [(1, "один"), (2, ""), (3, "два")]
+
+
+def test_read_records_nul():
+    assert list(read_records(io.StringIO("первая\nстрока\0вторая\0"), 'nul')) == [(1, "первая\nстрока"), (2, "вторая")]
+
+
+def test_read_records_jsonl():
+    stream = io.StringIO('{"id": "a1", "text": "один"}\n\n{"text": "два\\nтри"}\n')
+    assert list(read_records(stream, 'jsonl')) == [("a1", "один"), (3, "два\nтри")]
+    with pytest.raises(ValueError):
+        list(read_records(io.StringIO('{"id": 1}\n'), 'jsonl'))
+    with pytest.raises(ValueError):
+        list(read_records(io.StringIO('not json\n'), 'jsonl'))
+
+
+def test_read_records_unknown_format():
+    with pytest.raises(ValueError):
+        list(read_records(io.StringIO("text"), 'xml'))
+
+
+def test_format_record():
+    assert format_record('line', 1, "текст", "first\nsecond") == "first second\n"
+    assert format_record('line', 1, "текст", None, RuntimeError("boom")) == "\n"
+    assert format_record('nul', 1, "текст", "first\nsecond") == "first\nsecond\0"
+    assert json.loads(format_record('jsonl', "a1", "текст", "text")) == {'id': "a1", 'text': "текст", 'translation': "text"}
+    assert json.loads(format_record('jsonl', 2, "текст", None, RuntimeError("boom")))['error'] == "RuntimeError: boom"
+
+
+def test_translate_ordered_keeps_input_order():
+    def translate_fn(text):
+        time.sleep(0.02 if text == "slow" else 0)
+        if text == "fail":
+            raise RuntimeError("boom")
+        return text.upper()
+
+    records = [(1, "slow"), (2, "fast"), (3, "fail"), (4, " "), (5, "last")]
+    results = list(translate_ordered(records, translate_fn, workers=4))
+    assert [(record_id, translation) for record_id, _, translation, _ in results] == [(1, "SLOW"), (2, "FAST"), (3, None), (4, " "), (5, "LAST")]
+    assert isinstance(results[2][3], RuntimeError)
+
+
+def test_translate_ordered_bounded_read_ahead():
+    read = []
+    release = threading.Event()
+
+    def records():
+        for number in range(100):
+            read.append(number)
+            yield number, str(number)
+
+    def translate_fn(text):
+        if text == "0":
+            release.wait(1)
+        return text
+
+    results = translate_ordered(records(), translate_fn, workers=2)
+    time.sleep(0.05)
+    # Nothing is read before the first result is requested
+    assert read == []
+    threading.Timer(0.05, release.set).start()
+    assert next(results)[2] == "0"
+    assert len(read) <= 5
+    assert [result[2] for result in results] == [str(number) for number in range(1, 100)]
+
+
+def test_translate_ordered_invalid_workers():
+    with pytest.raises(ValueError):
+        list(translate_ordered([], str, workers=0))
@@ -0,0 +1,64 @@
+# pylint: disable=missing-docstring
+# pylint: disable=line-too-long
+import sys
+import httpx
+from os import path
+from unittest.mock import patch
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from lib.client_utils import get_client_timeout
+from lib.client_utils import get_client_limits
+from lib.client_utils import get_client_options
+from lib.client_utils import build_openai_client
+from lib.client_utils import build_async_openai_client
+from lib.client_utils import DEFAULT_TIMEOUT
+from lib.client_utils import DEFAULT_MAX_RETRIES
+
+
+def test_get_client_timeout_default():
+    timeout = get_client_timeout({})
+    assert timeout.read == DEFAULT_TIMEOUT
+    assert timeout.connect == DEFAULT_TIMEOUT
+
+
+def test_get_client_timeout_number():
+    assert get_client_timeout({'timeout': 30}).read == 30.0
+
+
+def test_get_client_timeout_mapping():
+    timeout = get_client_timeout({'timeout': {'total': 60, 'connect': 5}})
+    assert timeout.connect == 5.0
+    assert timeout.read == 60.0
+    assert timeout.pool == 60.0
+
+
+def test_get_client_limits():
+    limits = get_client_limits({'max_connections': 64, 'max_keepalive_connections': 32, 'keepalive_expiry': 90})
+    assert limits.max_connections == 64
+    assert limits.max_keepalive_connections == 32
+    assert limits.keepalive_expiry == 90.0
+
+
+def test_get_client_options():
+    options = get_client_options('key', {'base_url': ' http://localhost:8000/v1\n', 'max_retries': 5})
+    assert options['api_key'] == 'key'
+    assert options['base_url'] == 'http://localhost:8000/v1'
+    assert options['max_retries'] == 5
+    assert 'base_url' not in get_client_options('key', {})
+    assert get_client_options('key', {})['max_retries'] == DEFAULT_MAX_RETRIES
+
+
+def test_build_openai_client():
+    with patch('lib.client_utils.OpenAI') as mock_openai:
+        build_openai_client('key', {'max_connections': 8, 'timeout': 10})
+    kwargs = mock_openai.call_args.kwargs
+    assert isinstance(kwargs['http_client'], httpx.Client)
+    assert kwargs['api_key'] == 'key'
+    assert kwargs['timeout'].read == 10.0
+
+
+def test_build_async_openai_client():
+    with patch('lib.client_utils.AsyncOpenAI') as mock_openai:
+        build_async_openai_client('key')
+    kwargs = mock_openai.call_args.kwargs
+    assert isinstance(kwargs['http_client'], httpx.AsyncClient)
+    assert 'base_url' not in kwargs
@@ -0,0 +1,61 @@
+# pylint: disable=missing-docstring
+# pylint: disable=line-too-long
+import sys
+import pytest
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from lib.compression import COMPRESSED_FORMAT
+from lib.compression import NO_DICTIONARY_KEY
+from lib.compression import TextCompressor
+from lib.compression import get_compressed_key
+from lib.compression import get_dictionary_key
+from lib.compression import decompress_text
+from lib.compression import train_dictionary
+
+
+SAMPLES = [f"We attacked the websites of the banks of Lithuania, message {index}. Subscribe to our channel!" for index in range(20)]
+
+
+def test_train_dictionary():
+    dictionary = train_dictionary(SAMPLES, 256)
+    assert 0 < len(dictionary) <= 256
+    assert b"Subscribe to our" in dictionary
+    # Words of a single sample are left out
+    assert b"3." not in dictionary
+    assert train_dictionary(["one", "two"]) == b''
+
+
+def test_compress_round_trip():
+    compressor = TextCompressor(min_length=10)
+    text = "Attack on the banks of Lithuania. " * 5
+    blob = compressor.compress(text)
+    assert isinstance(blob, bytes)
+    assert blob[0] == COMPRESSED_FORMAT
+    assert get_compressed_key(blob) == NO_DICTIONARY_KEY
+    assert decompress_text(blob) == text
+
+
+def test_compress_with_dictionary():
+    dictionary = train_dictionary(SAMPLES)
+    text = "We attacked the websites of the banks of Lithuania again. Subscribe to our channel!"
+    plain = TextCompressor().compress(text)
+    blob = TextCompressor(dictionary).compress(text)
+    assert get_compressed_key(blob) == get_dictionary_key(dictionary)
+    assert len(blob) < len(plain if isinstance(plain, bytes) else plain.encode('utf-8'))
+    assert decompress_text(blob) == text
+
+
+def test_compress_keeps_short_text():
+    compressor = TextCompressor()
+    assert compressor.compress("Short text") == "Short text"
+    assert compressor.compress(None) is None
+    # Text that does not get smaller stays plain
+    assert TextCompressor(min_length=0).compress("abcdefghij") == "abcdefghij"
+    assert decompress_text("Short text") == "Short text"
+
+
+def test_decompress_text_errors():
+    with pytest.raises(KeyError):
+        decompress_text(bytes([COMPRESSED_FORMAT]) + b'unknown!' + b'data')
+    with pytest.raises(ValueError):
+        decompress_text(bytes([COMPRESSED_FORMAT]) + NO_DICTIONARY_KEY + b'\xff\xff\xff')
@@ -0,0 +1,149 @@
+# pylint: disable=missing-docstring
+# pylint: disable=line-too-long
+import sys
+import time
+import threading
+import openai
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from lib.concurrency import AIMDController
+from lib.concurrency import classify_error
+from lib.concurrency import run_concurrently
+
+
+def make_error(error_class):
+    # The OpenAI errors require an HTTP response, not needed here
+    return error_class.__new__(error_class)
+
+
+def test_classify_error():
+    assert classify_error(make_error(openai.RateLimitError)) == 'rate_limit'
+    assert classify_error(make_error(openai.APITimeoutError)) == 'timeout'
+    assert classify_error(make_error(openai.InternalServerError)) == 'overload'
+    assert classify_error(ValueError("bad")) == 'error'
+
+
+def test_controller_without_config_is_sequential():
+    controller = AIMDController()
+    for _ in range(10):
+        controller.on_success(0.1)
+    assert controller.get_limit() == 1
+
+
+def test_controller_additive_increase():
+    controller = AIMDController({'initial': 2, 'max': 4})
+    # Grows by about one after 'limit' successful requests
+    controller.on_success(0.1)
+    controller.on_success(0.1)
+    assert controller.get_limit() == 2
+    controller.on_success(0.1)
+    assert controller.get_limit() == 3
+    for _ in range(20):
+        controller.on_success(0.1)
+    assert controller.get_limit() == 4
+
+
+def test_controller_multiplicative_decrease():
+    controller = AIMDController({'initial': 16, 'min': 2, 'cooldown': 0})
+    controller.on_error('rate_limit')
+    assert controller.get_limit() == 8
+    controller.on_error('timeout')
+    controller.on_error('overload')
+    assert controller.get_limit() == 2
+    controller.on_error('rate_limit')
+    assert controller.get_limit() == 2
+
+
+def test_controller_min_is_at_least_one():
+    controller = AIMDController({'initial': 2, 'min': 0, 'cooldown': 0})
+    for _ in range(5):
+        controller.on_error('rate_limit')
+    assert controller.get_limit() == 1
+    controller.on_success(0.1)
+    assert controller.get_limit() == 2
+
+
+def test_controller_decrease_cooldown():
+    controller = AIMDController({'initial': 16, 'cooldown': 60})
+    controller.on_error('rate_limit')
+    controller.on_error('rate_limit')
+    assert controller.get_limit() == 8
+
+
+def test_controller_clock():
+    now = [0.0]
+    controller = AIMDController({'initial': 16, 'cooldown': 60}, clock=lambda: now[0])
+    controller.on_error('rate_limit')
+    now[0] = 59.0
+    controller.on_error('rate_limit')
+    assert controller.get_limit() == 8
+    now[0] = 60.0
+    controller.on_error('rate_limit')
+    assert controller.get_limit() == 4
+
+
+def test_controller_ignores_other_errors():
+    controller = AIMDController({'initial': 8})
+    controller.on_error('error')
+    assert controller.get_limit() == 8
+
+
+def test_controller_latency_over_target():
+    controller = AIMDController({'initial': 8, 'target_latency': 1, 'cooldown': 0})
+    controller.on_success(2.0)
+    assert controller.get_limit() == 4
+
+
+def test_run_concurrently_results():
+    def worker(job):
+        if job == 3:
+            raise ValueError("bad job")
+        return job * 2
+
+    results = {job: (result, error) for job, result, error in run_concurrently(range(5), worker, AIMDController({'initial': 2}))}
+    assert sorted(results) == [0, 1, 2, 3, 4]
+    assert results[4] == (8, None)
+    assert results[3][0] is None
+    assert isinstance(results[3][1], ValueError)
+
+
+def test_run_concurrently_respects_limit():
+    lock = threading.Lock()
+    running = [0, 0]
+
+    def worker(job):
+        with lock:
+            running[0] += 1
+            running[1] = max(running[1], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        return job
+
+    controller = AIMDController({'initial': 3, 'max': 3})
+    assert len(list(run_concurrently(range(12), worker, controller))) == 12
+    assert running[1] == 3
+
+
+def test_run_concurrently_reduces_limit_on_rate_limit():
+    def worker(job):
+        raise make_error(openai.RateLimitError)
+
+    # Requests in flight fail together, the limit is cut once per cooldown
+    controller = AIMDController({'initial': 4, 'max': 4})
+    list(run_concurrently(range(4), worker, controller))
+    assert controller.get_limit() == 2
+
+
+def test_run_concurrently_jobs_are_lazy():
+    consumed = []
+
+    def jobs():
+        for job in range(100):
+            consumed.append(job)
+            yield job
+
+    for job, _, _ in run_concurrently(jobs(), lambda job: job, AIMDController()):
+        if job == 2:
+            break
+    assert len(consumed) == 3
@@ -11,15 +11,25 @@ from unittest.mock import patch
 from unittest.mock import MagicMock
 sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
 from lib.db_utils import get_db_connection
+from lib.db_utils import get_split_db_connection
 from lib.db_utils import check_channel_exists
 from lib.db_utils import has_channel_messages
 from lib.db_utils import check_table_exists
 from lib.db_utils import read_sql_from_file
 from lib.db_utils import create_tables_from_schema
+from lib.db_utils import migrate_schema
+from lib.db_utils import get_table_columns
 from lib.db_utils import insert_translation_parameters
 from lib.db_utils import get_channel_messages
 from lib.db_utils import exists_translation_for_message
 from lib.db_utils import upsert_message_translation
+from lib.db_utils import upsert_message_translations
+from lib.db_utils import get_pending_channel_messages
+from lib.db_utils import get_text_compressor
+from lib.db_utils import compress_translations
+from lib.db_utils import decode_translation_text
+from lib.db_utils import is_compressed_db
+from lib import compression
 
 
 def test_get_db_connection_success():
@@ -243,6 +253,66 @@ def test_create_tables_from_schema(setup_database):
         connection.close()
 
 
+def test_create_tables_from_schema_migrates_old_tables():
+    connection = sqlite3.connect(":memory:")
+    cursor = connection.cursor()
+    cursor.execute("""
+    CREATE TABLE translation_parameters (
+        translation_parameters_id INTEGER PRIMARY KEY,
+        translation_tool_name TEXT,
+        translation_tool_commit TEXT,
+        translation_model TEXT,
+        translation_config_sha256 TEXT,
+        translation_config TEXT,
+        UNIQUE(translation_tool_name, translation_tool_commit, translation_model, translation_config_sha256, translation_config)
+    )
+    """)
+    cursor.execute("INSERT INTO translation_parameters VALUES (1, 'tool', 'commit', 'model', 'sha', 'config')")
+
+    create_tables_from_schema(connection, cursor, 'assets/schema.sql')
+    migrate_schema(cursor)
+
+    cursor.execute("PRAGMA table_info(translation_parameters)")
+    assert 'translation_config_fingerprint' in [column[1] for column in cursor.fetchall()]
+    cursor.execute("SELECT translation_tool_commit, translation_config_fingerprint FROM translation_parameters")
+    assert cursor.fetchall() == [('commit', None)]
+    connection.close()
+
+
+def test_create_tables_from_schema_rebuilds_old_tables():
+    connection = sqlite3.connect(":memory:")
+    cursor = connection.cursor()
+    cursor.execute("""
+    CREATE TABLE translation_parameters (
+        translation_parameters_id INTEGER PRIMARY KEY,
+        translation_tool_name TEXT,
+        translation_tool_commit TEXT,
+        translation_model TEXT,
+        translation_config_sha256 TEXT,
+        translation_config TEXT,
+        translation_config_fingerprint TEXT,
+        UNIQUE(translation_tool_name, translation_tool_commit, translation_model, translation_config_sha256, translation_config)
+    )
+    """)
+    cursor.execute("INSERT INTO translation_parameters VALUES (3, 'tool', 'commit', 'model', 'sha', 'config', 'fingerprint')")
+    cursor.execute("INSERT INTO translation_parameters VALUES (4, 'tool', 'commit2', 'model', 'sha', 'config', 'fingerprint')")
+
+    create_tables_from_schema(connection, cursor, 'assets/schema.sql')
+
+    cursor.execute("SELECT translation_parameters_id, translation_config_fingerprint, translation_language FROM translation_parameters ORDER BY 1")
+    assert cursor.fetchall() == [(3, 'fingerprint', ''), (4, 'fingerprint', '')]
+    # The config is stored once and the parameters are found by their SHA256
+    assert 'translation_config' not in get_table_columns(cursor, 'translation_parameters')
+    cursor.execute("SELECT translation_config_sha256, translation_config FROM translation_config")
+    assert cursor.fetchall() == [('sha', 'config')]
+    assert insert_translation_parameters(cursor, 'tool', 'commit2', 'model', 'sha', 'config') == 4
+    assert insert_translation_parameters(cursor, 'tool', 'commit2', 'model', 'sha', 'config', translation_language='Czech') == 5
+    assert check_table_exists(cursor, 'translation_parameters_rebuild') is False
+    cursor.execute("SELECT sql FROM sqlite_master WHERE name = 'message_translation'")
+    assert 'REFERENCES translation_parameters(' in cursor.fetchone()[0]
+    connection.close()
+
+
 @pytest.mark.parametrize("exception", [sqlite3.OperationalError])
 def test_create_tables_from_schema_exceptions(exception):
     """
@@ -270,18 +340,9 @@ def db_cursor():
     # Create an in-memory SQLite database and cursor
     connection = sqlite3.connect(":memory:")
     cursor = connection.cursor()
-    # Create the table needed for the test
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS translation_parameters (
-        translation_parameters_id   INTEGER PRIMARY KEY,
-        translation_tool_name       TEXT,
-        translation_tool_commit     TEXT,
-        translation_model           TEXT,
-        translation_config_sha256   TEXT,
-        translation_config          TEXT,
-        UNIQUE(translation_tool_name, translation_tool_commit, translation_model, translation_config_sha256, translation_config)
-    )
-    """)
+    # Create the tables needed for the test
+    with open('assets/schema.sql', 'r') as schema_file:
+        cursor.executescript(schema_file.read())
     yield cursor
     # No need to close the connection for in-memory databases as they are discarded
 
@@ -302,16 +363,28 @@ def test_insert_translation_parameters(db_cursor):
     translation_parameters_id = insert_translation_parameters(db_cursor, translation_tool_name, translation_tool_commit, translation_model, translation_config_sha256, translation_config)
 
     # Query the database to verify the insertion
-    db_cursor.execute("SELECT * FROM translation_parameters WHERE translation_parameters_id=?", (translation_parameters_id,))
+    db_cursor.execute("""
+    SELECT tp.translation_tool_name, tp.translation_tool_commit, tp.translation_model, tp.translation_config_sha256, tc.translation_config
+    FROM translation_parameters tp
+    JOIN translation_config tc ON tc.translation_config_sha256 = tp.translation_config_sha256
+    WHERE tp.translation_parameters_id=?
+    """, (translation_parameters_id,))
 
     result = db_cursor.fetchone()
 
     assert result is not None, "The data was not inserted into the database."
-    assert result[1] == translation_tool_name
-    assert result[2] == translation_tool_commit
-    assert result[3] == translation_model
-    assert result[4] == translation_config_sha256
-    assert result[5] == translation_config
+    assert result[0] == translation_tool_name
+    assert result[1] == translation_tool_commit
+    assert result[2] == translation_model
+    assert result[3] == translation_config_sha256
+    assert result[4] == translation_config
+
+    # Same parameters, same row, and the config is stored once
+    assert insert_translation_parameters(db_cursor, translation_tool_name, translation_tool_commit, translation_model, translation_config_sha256, translation_config) == translation_parameters_id
+    other_id = insert_translation_parameters(db_cursor, translation_tool_name, "other commit", translation_model, translation_config_sha256, translation_config)
+    assert other_id != translation_parameters_id
+    db_cursor.execute("SELECT count(*) FROM translation_config")
+    assert db_cursor.fetchone()[0] == 1
 
 
 @pytest.mark.parametrize("exception,expected_exception", [
@@ -384,6 +457,13 @@ def test_exists_translation_for_message_false(setup_database):
     assert exists_translation_for_message(cursor, message_id, translation_parameters_id) is False, "Translation should not exist but was reported as found."
 
 
+def test_exists_translation_for_message_null(setup_database):
+    """Test that a NULL translation does not count as translated."""
+    cursor = setup_database
+    cursor.execute("UPDATE message_translation SET translation_text = NULL")
+    assert exists_translation_for_message(cursor, 1, 1) is False
+
+
 @pytest.mark.parametrize("exception", [
     sqlite3.IntegrityError,
     sqlite3.OperationalError,
@@ -454,3 +534,116 @@ def test_upsert_message_translation_exceptions(exception):
 
     with pytest.raises(exception):
         upsert_message_translation(cursor, message_id, translation_parameters_id, translation_text)
+
+
+@pytest.fixture
+def source_db(tmp_path):
+    """Create a source DB file with a channel and a message."""
+    source_db_path = str(tmp_path / "source.sqlite")
+    connection = sqlite3.connect(source_db_path)
+    connection.execute("CREATE TABLE channels (channel_id INTEGER PRIMARY KEY, channel_name TEXT UNIQUE)")
+    connection.execute("CREATE TABLE messages (message_id INTEGER PRIMARY KEY, channel_id INTEGER, message_text TEXT)")
+    connection.execute("INSERT INTO channels (channel_id, channel_name) VALUES (1, 'existing_channel')")
+    connection.execute("INSERT INTO messages (message_id, channel_id, message_text) VALUES (1, 1, 'Test message')")
+    connection.commit()
+    connection.close()
+    return source_db_path
+
+
+def test_get_split_db_connection(source_db, tmp_path):
+    """Test translations are written to the output DB and messages read from the source DB."""
+    output_db_path = str(tmp_path / "output.sqlite")
+    connection, cursor = get_split_db_connection(output_db_path, source_db)
+    create_tables_from_schema(connection, cursor, 'assets/schema.sql')
+
+    assert get_channel_messages(cursor, 'existing_channel') == [(1, 'Test message')]
+    upsert_message_translation(cursor, 1, 1, "Translated text")
+    connection.commit()
+    assert exists_translation_for_message(cursor, 1, 1) is True
+
+    # The source DB is read-only
+    with pytest.raises(sqlite3.OperationalError):
+        cursor.execute("INSERT INTO messages (message_id, channel_id, message_text) VALUES (2, 1, 'New')")
+    connection.close()
+
+    # Translation tables only exist in the output DB
+    source_connection = sqlite3.connect(source_db)
+    assert check_table_exists(source_connection.cursor(), 'message_translation') is False
+    source_connection.close()
+
+
+def test_get_split_db_connection_immutable(source_db, tmp_path):
+    connection, cursor = get_split_db_connection(str(tmp_path / "output.sqlite"), source_db, source_immutable=True)
+    assert has_channel_messages(cursor, 'existing_channel') is True
+    connection.close()
+
+
+def test_get_split_db_connection_missing_source(tmp_path):
+    with pytest.raises(sqlite3.DatabaseError):
+        get_split_db_connection(str(tmp_path / "output.sqlite"), str(tmp_path / "missing.sqlite"))
+
+
+def test_get_pending_channel_messages(setup_database):
+    cursor = setup_database
+    channel_id = cursor.execute("SELECT channel_id FROM channels WHERE channel_name = 'existing_channel'").fetchone()[0]
+    cursor.execute("INSERT INTO messages (channel_id, message_text) VALUES (?, 'Pending message')", (channel_id,))
+    assert get_pending_channel_messages(cursor, 'existing_channel', 1) == [(2, 'Pending message')]
+    assert get_pending_channel_messages(cursor, 'existing_channel', 999) == [(1, 'Test message'), (2, 'Pending message')]
+    assert get_pending_channel_messages(cursor, 'nonexistent_channel', 1) == []
+
+
+def test_upsert_message_translations(setup_database):
+    cursor = setup_database
+    upsert_message_translations(cursor, 1, [(1, "Updated translation"), (22, "New translation")])
+    cursor.execute("SELECT message_id, translation_text FROM message_translation WHERE translation_parameters_id = 1 ORDER BY message_id")
+    assert cursor.fetchall() == [(1, "Updated translation"), (22, "New translation")]
+
+
+@pytest.mark.parametrize("exception", [
+    sqlite3.IntegrityError,
+    sqlite3.OperationalError,
+    sqlite3.DatabaseError,
+])
+def test_upsert_message_translations_exceptions(exception):
+    cursor = MagicMock()
+    cursor.executemany.side_effect = exception("Simulated database error")
+
+    with pytest.raises(exception):
+        upsert_message_translations(cursor, 1, [(1, "text")])
+
+
+def test_get_text_compressor(db_cursor):
+    assert is_compressed_db(db_cursor) is False
+    # Too few translations to train a dictionary, an empty one is stored
+    compressor = get_text_compressor(db_cursor, {'min_dictionary_samples': 10})
+    assert compressor.dictionary == b''
+    assert is_compressed_db(db_cursor) is True
+    for message_id in range(1, 11):
+        upsert_message_translation(db_cursor, message_id, 1, f"Attack on the banks of Lithuania, part {message_id}. Subscribe to our channel!")
+    compressor = get_text_compressor(db_cursor, {'min_dictionary_samples': 10, 'level': 6})
+    assert b"Subscribe to our" in compressor.dictionary
+    assert compressor.level == 6
+    # The trained dictionary is kept
+    assert get_text_compressor(db_cursor, {'min_dictionary_samples': 10}).dictionary == compressor.dictionary
+    db_cursor.execute("SELECT count(*) FROM compression_dictionary")
+    assert db_cursor.fetchone()[0] == 2
+
+
+def test_compress_translations(db_cursor):
+    texts = {message_id: f"Attack on the banks of Lithuania, part {message_id}. Subscribe to our channel!" for message_id in range(1, 11)}
+    upsert_message_translations(db_cursor, 1, list(texts.items()) + [(11, "Short")])
+    compressor = get_text_compressor(db_cursor, {'min_dictionary_samples': 10})
+    assert compress_translations(db_cursor, compressor, chunk_size=3) == 10
+    assert compress_translations(db_cursor, compressor) == 0
+    upsert_message_translation(db_cursor, 12, 1, texts[1], compressor)
+    db_cursor.execute("SELECT message_id, translation_text FROM message_translation ORDER BY message_id")
+    rows = db_cursor.fetchall()
+    assert all(isinstance(value, bytes) for message_id, value in rows if message_id != 11)
+    # Dictionaries are loaded from the DB when missing
+    compression._dictionaries.pop(compressor.key)
+    assert {message_id: decode_translation_text(db_cursor, value) for message_id, value in rows} == {**texts, 11: "Short", 12: texts[1]}
+
+
+def test_decode_translation_text_missing_dictionary(db_cursor):
+    with pytest.raises(ValueError):
+        decode_translation_text(db_cursor, bytes([compression.COMPRESSED_FORMAT]) + b'unknown!' + b'data')
@@ -0,0 +1,111 @@
+# pylint: disable=missing-docstring
+# pylint: disable=line-too-long
+import sys
+import sqlite3
+import pytest
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from lib.dedup_utils import get_shingles
+from lib.dedup_utils import compute_minhash
+from lib.dedup_utils import get_minhash_bands
+from lib.dedup_utils import estimate_similarity
+from lib.dedup_utils import index_message_minhash
+from lib.dedup_utils import index_translated_messages
+from lib.dedup_utils import find_near_duplicate
+from lib.dedup_utils import build_translation_hint
+from lib.dedup_utils import NUM_PERMUTATIONS
+from lib.dedup_utils import NUM_BANDS
+
+
+TEMPLATE = ("Наши DDoS-атаки продолжаются! Сегодня мы отправили в нокаут сайты {target}. "
+            "Подписывайтесь на наш канал и присоединяйтесь к DDoSIA проекту. "
+            "Россия вперёд, мы не остановимся пока враг не будет повержен. Дата атаки {date}")
+
+
+@pytest.fixture
+def db_cursor():
+    connection = sqlite3.connect(":memory:")
+    cursor = connection.cursor()
+    cursor.execute("CREATE TABLE messages (message_id INTEGER PRIMARY KEY, channel_id INTEGER, message_text TEXT)")
+    with open('assets/schema.sql', 'r') as schema_file:
+        cursor.executescript(schema_file.read())
+    yield cursor
+    connection.close()
+
+
+def add_translated_message(cursor, message_id, message_text, translation_text, translation_parameters_id=1):
+    cursor.execute("INSERT INTO messages (message_id, channel_id, message_text) VALUES (?, 1, ?)", (message_id, message_text))
+    cursor.execute("INSERT INTO message_translation (message_id, translation_parameters_id, translation_text) VALUES (?, ?, ?)",
+                   (message_id, translation_parameters_id, translation_text))
+
+
+def test_get_shingles():
+    assert get_shingles("Привет мир, привет") == {"привет мир", "мир привет"}
+    assert get_shingles("Один") == {"один"}
+    assert get_shingles("...") == set()
+
+
+def test_compute_minhash_deterministic():
+    signature = compute_minhash("Сегодня мы атакуем сайты")
+    assert len(signature) == NUM_PERMUTATIONS
+    assert signature == compute_minhash("сегодня МЫ атакуем сайты!")
+    assert compute_minhash("") is None
+
+
+def test_get_minhash_bands():
+    bands = get_minhash_bands(compute_minhash(TEMPLATE))
+    assert len(bands) == NUM_BANDS
+    assert [band for band, _ in bands] == list(range(NUM_BANDS))
+    assert all(-2**63 <= bucket < 2**63 for _, bucket in bands)
+
+
+def test_estimate_similarity():
+    first = compute_minhash(TEMPLATE.format(target="Литвы", date="12.03"))
+    second = compute_minhash(TEMPLATE.format(target="Польши", date="13.03"))
+    unrelated = compute_minhash("Совсем другой текст про погоду и котиков на выходных")
+    assert estimate_similarity(first, first) == 1.0
+    assert estimate_similarity(first, second) > 0.6
+    assert estimate_similarity(first, unrelated) < 0.2
+
+
+def test_find_near_duplicate(db_cursor):
+    add_translated_message(db_cursor, 1, TEMPLATE.format(target="Литвы", date="12.03"), "Translation for Lithuania")
+    add_translated_message(db_cursor, 2, "Совсем другой текст про погоду и котиков на выходных", "Weather and cats")
+    assert index_translated_messages(db_cursor) == 2
+    # Already indexed messages are not indexed again
+    assert index_translated_messages(db_cursor) == 0
+
+    duplicate = find_near_duplicate(db_cursor, 1, TEMPLATE.format(target="Польши", date="13.03"), 0.5)
+    assert duplicate is not None
+    assert duplicate[0] == 1
+    assert duplicate[1] > 0.5
+    assert duplicate[3] == "Translation for Lithuania"
+
+
+def test_find_near_duplicate_other_parameters(db_cursor):
+    add_translated_message(db_cursor, 1, TEMPLATE.format(target="Литвы", date="12.03"), "Translation", translation_parameters_id=2)
+    index_translated_messages(db_cursor)
+    assert find_near_duplicate(db_cursor, 1, TEMPLATE.format(target="Литвы", date="12.03"), 0.5) is None
+
+
+def test_find_near_duplicate_excludes_message(db_cursor):
+    message_text = TEMPLATE.format(target="Литвы", date="12.03")
+    add_translated_message(db_cursor, 1, message_text, "Translation")
+    index_message_minhash(db_cursor, 1, message_text)
+    assert find_near_duplicate(db_cursor, 1, message_text, 0.9)[1] == 1.0
+    assert find_near_duplicate(db_cursor, 1, message_text, 0.9, message_id=1) is None
+
+
+def test_index_message_minhash_replaces_bands(db_cursor):
+    index_message_minhash(db_cursor, 1, "Первый текст сообщения")
+    index_message_minhash(db_cursor, 1, "Второй текст сообщения")
+    db_cursor.execute("SELECT COUNT(*) FROM message_minhash_band WHERE message_id = 1")
+    assert db_cursor.fetchone()[0] == NUM_BANDS
+    assert index_message_minhash(db_cursor, 2, "!!!") is False
+
+
+def test_build_translation_hint():
+    hint = build_translation_hint("Атака на сайты Литвы", "Attack on Lithuanian sites", "Атака на сайты Польши")
+    assert "Attack on Lithuanian sites" in hint
+    assert "- Литвы" in hint
+    assert "+ Польши" in hint
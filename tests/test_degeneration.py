@@ -0,0 +1,56 @@
+# pylint: disable=missing-docstring
+# pylint: disable=line-too-long
+import sys
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from lib.degeneration import DegenerateOutputError
+from lib.degeneration import find_repetition
+from lib.degeneration import DegenerationDetector
+
+
+def feed_words(detector, text):
+    for word in text.split(' '):
+        reason = detector.feed(word + ' ')
+        if reason is not None:
+            return reason
+    return None
+
+
+def test_find_repetition():
+    assert find_repetition("Intro. " + "we attack " * 5) == "we attack " * 4
+    assert find_repetition("Intro. " + "!" * 60) == "!" * 40
+    assert find_repetition("Intro. " + "we attack " * 3) is None
+    assert find_repetition("A normal sentence with some words that do not repeat at all.") is None
+    # Whitespace runs are not loops
+    assert find_repetition("Text" + " " * 80) is None
+
+
+def test_detector_repetition():
+    detector = DegenerationDetector("Привет, как дела? " * 3)
+    assert feed_words(detector, "Hello, how are you? " * 3 + "and the " * 30) == 'repetition'
+    assert detector.length < len("Hello, how are you? " * 3 + "and the " * 30)
+
+
+def test_detector_repetition_in_source():
+    # Repetitions already in the source are translated as they are
+    detector = DegenerationDetector("Слава! " + "🔥" * 50)
+    assert feed_words(detector, "Glory! " + "🔥" * 50) is None
+
+
+def test_detector_length():
+    detector = DegenerationDetector("Короткое сообщение", {'max_length_ratio': 2, 'min_length': 10})
+    assert feed_words(detector, "A short message that keeps going on and on without any end in sight") == 'length'
+
+
+def test_detector_valid_translation():
+    source = "Сегодня мы атаковали сайты банков и министерств. Следите за новостями!"
+    detector = DegenerationDetector(source)
+    assert feed_words(detector, "Today we attacked the websites of banks and ministries. Stay tuned for the news!") is None
+    assert detector.get_text().strip() == "Today we attacked the websites of banks and ministries. Stay tuned for the news!"
+
+
+def test_degenerate_output_error():
+    err = DegenerateOutputError('repetition', "abc")
+    assert isinstance(err, ValueError)
+    assert err.reason == 'repetition'
+    assert err.partial_translation == "abc"
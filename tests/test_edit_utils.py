@@ -0,0 +1,99 @@
+# pylint: disable=missing-docstring
+# pylint: disable=line-too-long
+import sys
+import sqlite3
+import pytest
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from lib.db_utils import upsert_message_translation
+from lib.edit_utils import get_text_sha256
+from lib.edit_utils import is_edited_after
+from lib.edit_utils import record_translation_sources
+from lib.edit_utils import find_edited_translations
+from lib.search_utils import create_search_index
+from lib.search_utils import rebuild_search_index
+
+
+@pytest.fixture
+def db_cursor():
+    connection = sqlite3.connect(":memory:")
+    cursor = connection.cursor()
+    cursor.execute("CREATE TABLE channels (channel_id INTEGER PRIMARY KEY, channel_name TEXT UNIQUE)")
+    cursor.execute("CREATE TABLE messages (message_id INTEGER PRIMARY KEY, channel_id INTEGER, message_text TEXT, message_edit_date TEXT)")
+    with open('assets/schema.sql', 'r') as schema_file:
+        cursor.executescript(schema_file.read())
+    cursor.execute("INSERT INTO channels (channel_id, channel_name) VALUES (1, 'noname05716'), (2, 'other')")
+    cursor.execute("""INSERT INTO messages VALUES (1, 1, 'Первое сообщение', NULL), (2, 1, 'Второе сообщение', '2023-01-01 10:00:00+00:00'),
+                      (3, 2, 'Третье сообщение', '2023-01-01 10:00:00+00:00')""")
+    for message_id in (1, 2, 3):
+        upsert_message_translation(cursor, message_id, 1, f"Translation {message_id}")
+    record_translation_sources(cursor, 1, [1, 2, 3])
+    yield cursor
+    connection.close()
+
+
+def edit_message(cursor, message_id, message_text, message_edit_date):
+    cursor.execute("UPDATE messages SET message_text = ?, message_edit_date = ? WHERE message_id = ?", (message_text, message_edit_date, message_id))
+
+
+def test_get_text_sha256():
+    assert get_text_sha256("abc") == "ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad"
+    assert get_text_sha256(None) is None
+
+
+def test_is_edited_after():
+    assert is_edited_after('2023-01-01 10:00:00+00:00', '2022-12-31T23:00:00.123456') is True
+    assert is_edited_after('2023-01-01 10:00:00+02:00', '2023-01-01T09:00:00') is False
+    assert is_edited_after('not a date', '2023-01-01T09:00:00') is True
+
+
+def test_record_translation_sources(db_cursor):
+    db_cursor.execute("SELECT message_id, source_edit_date, source_sha256 FROM message_translation ORDER BY 1")
+    rows = db_cursor.fetchall()
+    assert rows[0] == (1, None, get_text_sha256('Первое сообщение'))
+    assert rows[1] == (2, '2023-01-01 10:00:00+00:00', get_text_sha256('Второе сообщение'))
+
+
+def test_find_edited_translations_unchanged(db_cursor):
+    assert find_edited_translations(db_cursor, 1) == []
+
+
+def test_find_edited_translations_text_changed(db_cursor):
+    edit_message(db_cursor, 2, 'Второе сообщение, исправлено', '2023-01-02 10:00:00+00:00')
+    edit_message(db_cursor, 3, 'Третье сообщение, исправлено', '2023-01-02 10:00:00+00:00')
+    assert find_edited_translations(db_cursor, 1, 'noname05716') == [(2, 'Второе сообщение, исправлено')]
+    assert find_edited_translations(db_cursor, 1) == [(2, 'Второе сообщение, исправлено'), (3, 'Третье сообщение, исправлено')]
+    assert find_edited_translations(db_cursor, 2) == []
+
+
+def test_find_edited_translations_same_text(db_cursor):
+    # Edits that keep the text only record the new edit date
+    edit_message(db_cursor, 2, 'Второе сообщение', '2023-01-02 10:00:00+00:00')
+    assert find_edited_translations(db_cursor, 1) == []
+    db_cursor.execute("SELECT source_edit_date FROM message_translation WHERE message_id = 2")
+    assert db_cursor.fetchone()[0] == '2023-01-02 10:00:00+00:00'
+
+
+def test_find_edited_translations_without_sources(db_cursor):
+    db_cursor.execute("UPDATE message_translation SET source_edit_date = NULL, source_sha256 = NULL, translation_timestamp = '2023-01-01T12:00:00'")
+    edit_message(db_cursor, 3, 'Третье сообщение, исправлено', '2023-01-02 10:00:00+00:00')
+    assert find_edited_translations(db_cursor, 1) == [(3, 'Третье сообщение, исправлено')]
+    # Edited before their translation, the sources are recorded
+    db_cursor.execute("SELECT message_id FROM message_translation WHERE source_sha256 IS NOT NULL ORDER BY 1")
+    assert db_cursor.fetchall() == [(2,)]
+
+
+def test_recorded_sources_keep_search_index(db_cursor):
+    connection = db_cursor.connection
+    create_search_index(connection, db_cursor)
+    rebuild_search_index(connection, db_cursor)
+    db_cursor.execute("SELECT rowid FROM message_translation_fts ORDER BY rowid")
+    rowids = db_cursor.fetchall()
+    # Only the translations are written, the index is left alone
+    changes = connection.total_changes
+    record_translation_sources(db_cursor, 1, [1, 2, 3])
+    edit_message(db_cursor, 2, 'Второе сообщение', '2023-01-02 10:00:00+00:00')
+    assert find_edited_translations(db_cursor, 1) == []
+    assert connection.total_changes - changes == 3 + 1 + 1
+    db_cursor.execute("SELECT rowid FROM message_translation_fts ORDER BY rowid")
+    assert db_cursor.fetchall() == rowids == [(1,), (2,), (3,)]
@@ -0,0 +1,103 @@
+# pylint: disable=missing-docstring
+# pylint: disable=line-too-long
+import io
+import csv
+import sys
+import json
+import sqlite3
+import pytest
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from lib.db_utils import get_text_compressor
+from lib.db_utils import compress_translations
+from lib.export_utils import iterate_translations
+from lib.export_utils import export_jsonl
+from lib.export_utils import export_csv
+from lib.export_utils import export_translations
+from lib.export_utils import EXPORT_FIELDS
+
+
+@pytest.fixture
+def db_cursor():
+    connection = sqlite3.connect(":memory:")
+    cursor = connection.cursor()
+    cursor.execute("CREATE TABLE channels (channel_id INTEGER PRIMARY KEY, channel_name TEXT UNIQUE)")
+    cursor.execute("CREATE TABLE messages (message_id INTEGER PRIMARY KEY, channel_id INTEGER, message_date TEXT, message_text TEXT)")
+    with open('assets/schema.sql', 'r') as schema_file:
+        cursor.executescript(schema_file.read())
+    cursor.execute("INSERT INTO channels (channel_id, channel_name) VALUES (1, 'noname05716'), (2, 'other')")
+    cursor.execute("INSERT INTO translation_parameters (translation_parameters_id, translation_model, translation_tool_commit) VALUES (1, 'gpt', 'abc')")
+    for message_id, channel_id, timestamp in [(1, 1, '2024-03-01T00:00:00'), (2, 1, '2024-03-02T00:00:00'), (3, 2, '2024-03-03T00:00:00')]:
+        cursor.execute("INSERT INTO messages VALUES (?, ?, '2024-02-28', ?)", (message_id, channel_id, f"Сообщение {message_id}"))
+        cursor.execute("INSERT INTO message_translation (message_id, translation_parameters_id, translation_text, translation_timestamp) VALUES (?, 1, ?, ?)",
+                       (message_id, f"Message {message_id}", timestamp))
+    yield cursor
+    connection.close()
+
+
+def test_iterate_translations(db_cursor):
+    rows = list(iterate_translations(db_cursor, chunk_size=2))
+    assert [row['message_id'] for row in rows] == [1, 2, 3]
+    assert rows[0] == {
+        'channel_name': 'noname05716',
+        'message_id': 1,
+        'message_date': '2024-02-28',
+        'message_text': 'Сообщение 1',
+        'translation_id': 1,
+        'translation_text': 'Message 1',
+        'translation_timestamp': '2024-03-01T00:00:00',
+        'translation_parameters_id': 1,
+        'translation_model': 'gpt',
+        'translation_tool_commit': 'abc',
+    }
+
+
+def test_iterate_translations_since(db_cursor):
+    rows = list(iterate_translations(db_cursor, since='2024-03-01T00:00:00'))
+    assert [row['message_id'] for row in rows] == [2, 3]
+
+
+def test_iterate_translations_channel(db_cursor):
+    rows = list(iterate_translations(db_cursor, channel_name='other'))
+    assert [row['message_id'] for row in rows] == [3]
+
+
+def test_iterate_translations_compressed(db_cursor):
+    compressor = get_text_compressor(db_cursor, {'min_length': 0})
+    db_cursor.execute("UPDATE message_translation SET translation_text = translation_text || ', message ' || translation_text || ', message ' || translation_text")
+    assert compress_translations(db_cursor, compressor) == 3
+    rows = list(iterate_translations(db_cursor, chunk_size=2))
+    assert rows[0]['translation_text'] == 'Message 1, message Message 1, message Message 1'
+
+
+def test_export_jsonl(db_cursor):
+    output = io.StringIO()
+    assert export_jsonl(iterate_translations(db_cursor), output) == 3
+    lines = output.getvalue().splitlines()
+    assert json.loads(lines[0])['message_text'] == 'Сообщение 1'
+
+
+def test_export_csv(db_cursor):
+    output = io.StringIO()
+    assert export_csv(iterate_translations(db_cursor), output) == 3
+    rows = list(csv.DictReader(io.StringIO(output.getvalue())))
+    assert list(rows[0].keys()) == EXPORT_FIELDS
+    assert rows[2]['translation_text'] == 'Message 3'
+
+
+def test_export_translations_file(db_cursor, tmp_path):
+    output_path = tmp_path / "export.jsonl"
+    assert export_translations(db_cursor, str(output_path), 'jsonl', since='2024-03-02T00:00:00') == 1
+    assert json.loads(output_path.read_text(encoding='utf-8'))['message_id'] == 3
+
+
+def test_export_translations_parquet(db_cursor, tmp_path):
+    parquet = pytest.importorskip("pyarrow.parquet")
+    output_path = tmp_path / "export.parquet"
+    assert export_translations(db_cursor, str(output_path), 'parquet', chunk_size=2) == 3
+    assert parquet.read_table(str(output_path)).num_rows == 3
+
+
+def test_export_translations_unknown_format(db_cursor):
+    with pytest.raises(ValueError):
+        export_translations(db_cursor, '-', 'xml')
@@ -0,0 +1,90 @@
+# pylint: disable=missing-docstring
+# pylint: disable=line-too-long
+import sys
+import sqlite3
+import pytest
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from lib.db_utils import upsert_message_translation
+from lib.db_utils import get_pending_channel_messages
+from lib.failure_utils import get_retry_delay
+from lib.failure_utils import record_translation_failure
+from lib.failure_utils import clear_translation_failures
+from lib.failure_utils import get_failed_message_ids
+from lib.failure_utils import get_due_translation_failures
+from lib.failure_utils import requeue_null_translations
+
+
+@pytest.fixture
+def db_connection():
+    connection = sqlite3.connect(":memory:")
+    cursor = connection.cursor()
+    cursor.execute("CREATE TABLE channels (channel_id INTEGER PRIMARY KEY, channel_name TEXT UNIQUE)")
+    cursor.execute("CREATE TABLE messages (message_id INTEGER PRIMARY KEY, channel_id INTEGER, message_text TEXT)")
+    with open('assets/schema.sql', 'r') as schema_file:
+        cursor.executescript(schema_file.read())
+    cursor.execute("INSERT INTO channels (channel_id, channel_name) VALUES (1, 'noname05716'), (2, 'other')")
+    cursor.execute("INSERT INTO messages VALUES (1, 1, 'Первое сообщение'), (2, 1, 'Второе сообщение'), (3, 2, 'Третье сообщение')")
+    yield connection, cursor
+    connection.close()
+
+
+def make_due(cursor):
+    cursor.execute("UPDATE translation_failure SET next_retry_timestamp = '2000-01-01T00:00:00'")
+
+
+def test_get_retry_delay():
+    assert get_retry_delay(1) == 60
+    assert get_retry_delay(3) == 240
+    assert get_retry_delay(30) == 24 * 60 * 60
+    assert get_retry_delay(2, {'base_delay': 10, 'max_delay': 15}) == 15
+
+
+def test_record_translation_failure(db_connection):
+    _, cursor = db_connection
+    assert record_translation_failure(cursor, 1, 1, TimeoutError("too slow")) == 1
+    assert record_translation_failure(cursor, 1, 1, ValueError("bad answer")) == 2
+    cursor.execute("SELECT error_class, error_message, attempt_count, next_retry_timestamp > last_failure_timestamp FROM translation_failure")
+    assert cursor.fetchall() == [('ValueError', 'bad answer', 2, 1)]
+
+
+def test_failed_messages_are_not_due_before_retry_time(db_connection):
+    _, cursor = db_connection
+    record_translation_failure(cursor, 1, 1, RuntimeError("boom"))
+    assert get_failed_message_ids(cursor, 1) == {1}
+    assert get_failed_message_ids(cursor, 2) == set()
+    assert get_due_translation_failures(cursor, 1) == []
+    make_due(cursor)
+    assert get_due_translation_failures(cursor, 1) == [(1, 'Первое сообщение', 1)]
+
+
+def test_get_due_translation_failures_filters(db_connection):
+    _, cursor = db_connection
+    for message_id in (1, 2, 3):
+        record_translation_failure(cursor, message_id, 1, RuntimeError("boom"))
+    record_translation_failure(cursor, 2, 1, RuntimeError("boom"))
+    make_due(cursor)
+    assert sorted(row[0] for row in get_due_translation_failures(cursor, 1)) == [1, 2, 3]
+    assert sorted(row[0] for row in get_due_translation_failures(cursor, 1, channel_name='noname05716')) == [1, 2]
+    assert sorted(row[0] for row in get_due_translation_failures(cursor, 1, max_attempts=2)) == [1, 3]
+    assert len(get_due_translation_failures(cursor, 1, limit=1)) == 1
+
+
+def test_clear_translation_failures(db_connection):
+    _, cursor = db_connection
+    record_translation_failure(cursor, 1, 1, RuntimeError("boom"))
+    record_translation_failure(cursor, 2, 1, RuntimeError("boom"))
+    clear_translation_failures(cursor, 1, [1])
+    assert get_failed_message_ids(cursor, 1) == {2}
+
+
+def test_requeue_null_translations(db_connection):
+    _, cursor = db_connection
+    upsert_message_translation(cursor, 1, 1, None)
+    upsert_message_translation(cursor, 2, 1, "Second message")
+    assert [row[0] for row in get_pending_channel_messages(cursor, 'noname05716', 1)] == [1]
+
+    assert requeue_null_translations(cursor, 1) == 1
+    cursor.execute("SELECT message_id FROM message_translation")
+    assert cursor.fetchall() == [(2,)]
+    assert get_due_translation_failures(cursor, 1) == [(1, 'Первое сообщение', 1)]
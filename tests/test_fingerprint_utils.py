@@ -0,0 +1,162 @@
+# pylint: disable=missing-docstring
+# pylint: disable=line-too-long
+import sys
+import sqlite3
+import pytest
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from lib.db_utils import insert_translation_parameters
+from lib.fingerprint_utils import parse_personality
+from lib.fingerprint_utils import get_config_fingerprint
+from lib.fingerprint_utils import get_yaml_fingerprint
+from lib.fingerprint_utils import backfill_config_fingerprints
+
+
+YAML_CONFIG = """
+personality:
+  log: hermeneis.log
+  system: |
+    You are a Language Translator Bot.
+  user: "Translate: "
+  model: gpt-4o-mini
+  temperature: "0.1"
+  max_tokens: "1000"
+"""
+
+# Same prompts and model, another log file and layout
+YAML_CONFIG_COSMETIC = """
+# Reformatted
+personality:
+    model: "gpt-4o-mini  "
+    max_tokens: 1000
+    temperature: 0.1
+    user: "Translate: "
+    system: "You are a Language Translator Bot.\\n"
+    log: other.log
+"""
+
+
+@pytest.fixture
+def db_cursor():
+    connection = sqlite3.connect(":memory:")
+    cursor = connection.cursor()
+    with open('assets/schema.sql', 'r') as schema_file:
+        cursor.executescript(schema_file.read())
+    yield cursor
+    connection.close()
+
+
+def get_config():
+    return {'system': "You are a Language Translator Bot.", 'user': "Translate: ", 'model': "gpt-4o-mini",
+            'temperature': 0.1, 'max_tokens': 1000, 'log': "hermeneis.log"}
+
+
+def test_parse_personality():
+    config = parse_personality({'system': " Bot \n", 'user': "Translate: ", 'model': " gpt-4o ", 'temperature': " 0.5", 'max_tokens': "200 "})
+    assert config == {'system': "Bot", 'user': "Translate: ", 'model': "gpt-4o", 'temperature': 0.5, 'max_tokens': 200}
+
+
+def test_get_config_fingerprint_ignores_unrelated_fields():
+    config = get_config()
+    other = dict(config, log="other.log", concurrency={'max': 4}, tokenizer={'cache_dir': 'cache'})
+    assert get_config_fingerprint(config) == get_config_fingerprint(other)
+
+
+@pytest.mark.parametrize("field,value", [
+    ('system', "You are a poet."),
+    ('user', "Translate to English: "),
+    ('model', "gpt-4o"),
+    ('temperature', 0.7),
+    ('max_tokens', 500),
+])
+def test_get_config_fingerprint_changes_with_output_fields(field, value):
+    config = get_config()
+    assert get_config_fingerprint(config) != get_config_fingerprint(dict(config, **{field: value}))
+
+
+def test_get_config_fingerprint_routing():
+    config = get_config()
+    routed = dict(config, routing={'tiers': [{'model': "gpt-4o-mini", 'max_input_tokens': 100}, {'model': "gpt-4o"}]})
+    thresholds = dict(config, routing={'tiers': [{'model': "gpt-4o-mini", 'max_input_tokens': 500}, {'model': "gpt-4o"}]})
+    validation = dict(config, routing=dict(routed['routing'], max_untranslated_ratio=0.3))
+    defaults = dict(config, routing=dict(routed['routing'], max_untranslated_ratio="0.1"))
+    assert get_config_fingerprint(config) != get_config_fingerprint(routed)
+    assert get_config_fingerprint(routed) != get_config_fingerprint(thresholds)
+    assert get_config_fingerprint(routed) != get_config_fingerprint(validation)
+    assert get_config_fingerprint(routed) == get_config_fingerprint(defaults)
+
+
+@pytest.mark.parametrize("section,settings,changed", [
+    ('token_budget', {'margin': 0.2}, {'max_tokens': 512}),
+    ('streaming', {'retries': 1}, {'min_repeats': 2}),
+])
+def test_get_config_fingerprint_sections(section, settings, changed):
+    config = get_config()
+    defaults = dict(config, **{section: settings})
+    assert get_config_fingerprint(config) != get_config_fingerprint(defaults)
+    assert get_config_fingerprint(defaults) == get_config_fingerprint(dict(config, **{section: {'enabled': True}}))
+    assert get_config_fingerprint(defaults) != get_config_fingerprint(dict(config, **{section: changed}))
+
+
+def test_get_yaml_fingerprint():
+    assert get_yaml_fingerprint(YAML_CONFIG) == get_config_fingerprint(get_config())
+    assert get_yaml_fingerprint(YAML_CONFIG_COSMETIC) == get_yaml_fingerprint(YAML_CONFIG)
+    streamed = YAML_CONFIG + "streaming:\n  min_repeats: 2\n"
+    assert get_yaml_fingerprint(streamed) == get_config_fingerprint(dict(get_config(), streaming={'min_repeats': 2}))
+
+
+@pytest.mark.parametrize("yaml_text", ["not: [valid", "personality: {}", "just text"])
+def test_get_yaml_fingerprint_invalid(yaml_text):
+    with pytest.raises(ValueError):
+        get_yaml_fingerprint(yaml_text)
+
+
+def test_backfill_config_fingerprints(db_cursor):
+    old_id = insert_translation_parameters(db_cursor, "hermeneisGPT.py", "commit1", "gpt-4o-mini", "sha1", YAML_CONFIG)
+    invalid_id = insert_translation_parameters(db_cursor, "hermeneisGPT.py", "commit1", "gpt-4o-mini", "sha2", "just text")
+
+    assert backfill_config_fingerprints(db_cursor) == 1
+    assert backfill_config_fingerprints(db_cursor) == 0
+    db_cursor.execute("SELECT translation_parameters_id, translation_config_fingerprint FROM translation_parameters ORDER BY 1")
+    assert db_cursor.fetchall() == [(old_id, get_config_fingerprint(get_config())), (invalid_id, None)]
+
+
+def test_insert_translation_parameters_reuses_fingerprint(db_cursor):
+    old_id = insert_translation_parameters(db_cursor, "hermeneisGPT.py", "commit1", "gpt-4o-mini", "sha1", YAML_CONFIG)
+    backfill_config_fingerprints(db_cursor)
+
+    # New commit and cosmetic config changes keep the parameters
+    reused_id = insert_translation_parameters(db_cursor, "hermeneisGPT.py", "commit2", "gpt-4o-mini", "sha3", YAML_CONFIG_COSMETIC,
+                                              get_yaml_fingerprint(YAML_CONFIG_COSMETIC))
+    assert reused_id == old_id
+
+    other_config = YAML_CONFIG.replace('"0.1"', '"0.7"')
+    new_id = insert_translation_parameters(db_cursor, "hermeneisGPT.py", "commit2", "gpt-4o-mini", "sha4", other_config,
+                                           get_yaml_fingerprint(other_config))
+    assert new_id != old_id
+    assert insert_translation_parameters(db_cursor, "hermeneisGPT.py", "commit3", "gpt-4o-mini", "sha5", other_config,
+                                         get_yaml_fingerprint(other_config)) == new_id
+    db_cursor.execute("SELECT count(*) FROM translation_parameters")
+    assert db_cursor.fetchone()[0] == 2
+
+
+def test_get_config_fingerprint_language():
+    config = get_config()
+    assert get_config_fingerprint(config, '') == get_config_fingerprint(config)
+    assert get_config_fingerprint(config, 'English') != get_config_fingerprint(config)
+    assert get_config_fingerprint(config, 'English') != get_config_fingerprint(config, 'Czech')
+    assert get_yaml_fingerprint(YAML_CONFIG, 'Czech') == get_config_fingerprint(config, 'Czech')
+
+
+def test_insert_translation_parameters_per_language(db_cursor):
+    parameters = ("hermeneisGPT.py", "commit1", "gpt-4o-mini", "sha1", YAML_CONFIG)
+    english_id = insert_translation_parameters(db_cursor, *parameters, get_yaml_fingerprint(YAML_CONFIG, 'English'), 'English')
+    czech_id = insert_translation_parameters(db_cursor, *parameters, get_yaml_fingerprint(YAML_CONFIG, 'Czech'), 'Czech')
+    assert english_id != czech_id
+    assert insert_translation_parameters(db_cursor, *parameters, get_yaml_fingerprint(YAML_CONFIG, 'Czech'), 'Czech') == czech_id
+
+    # Backfilled fingerprints keep the language of the parameters
+    db_cursor.execute("UPDATE translation_parameters SET translation_config_fingerprint = NULL")
+    assert backfill_config_fingerprints(db_cursor) == 2
+    db_cursor.execute("SELECT translation_config_fingerprint FROM translation_parameters WHERE translation_parameters_id = ?", (czech_id,))
+    assert db_cursor.fetchone()[0] == get_yaml_fingerprint(YAML_CONFIG, 'Czech')
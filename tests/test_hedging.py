@@ -0,0 +1,145 @@
+# pylint: disable=missing-docstring
+# pylint: disable=line-too-long
+import sys
+import time
+import threading
+import pytest
+from os import path
+from types import SimpleNamespace
+from concurrent.futures import Future
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from lib.hedging import LatencyTracker
+from lib.hedging import hedge_client
+from lib.hedging import get_hedged_usage
+from lib.translator import get_usage
+
+
+class FakeCompletions:
+    """Returns the call number, sleeping the delays given in order."""
+
+    def __init__(self, delays, errors=()):
+        self.delays = list(delays)
+        self.errors = set(errors)
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def create(self, **kwargs):
+        with self.lock:
+            call = self.calls
+            self.calls += 1
+        time.sleep(self.delays[call] if call < len(self.delays) else 0)
+        if call in self.errors:
+            raise RuntimeError(f"Simulated error in call {call}")
+        return call
+
+
+class UsageCompletions(FakeCompletions):
+    """Answers with the call number and its usage."""
+
+    def create(self, **kwargs):
+        call = super().create(**kwargs)
+        return SimpleNamespace(call=call, usage=SimpleNamespace(prompt_tokens=10, completion_tokens=call + 1, total_tokens=call + 11))
+
+
+def make_client(delays, errors=(), **hedging_config):
+    completions = FakeCompletions(delays, errors)
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions), models="models")
+    config = {'percentile': 90, 'max_extra_requests': 1.0, 'min_delay': 0.0, 'min_samples': 5}
+    config.update(hedging_config)
+    return hedge_client(client, config), completions
+
+
+def warm_up(client, tracker_latency=0.01, samples=5):
+    for _ in range(samples):
+        client.chat.completions.tracker.record(tracker_latency)
+
+
+def test_latency_tracker_percentile():
+    tracker = LatencyTracker(window=100, min_samples=10)
+    for latency in range(1, 10):
+        tracker.record(latency)
+    assert tracker.percentile(50) is None
+    tracker.record(10)
+    assert tracker.percentile(50) == 6
+    assert tracker.percentile(100) == 10
+
+
+def test_latency_tracker_window():
+    tracker = LatencyTracker(window=3, min_samples=1)
+    for latency in (100, 1, 2, 3):
+        tracker.record(latency)
+    assert tracker.percentile(100) == 3
+
+
+def test_no_hedging_without_samples():
+    client, completions = make_client([0.05])
+    assert client.chat.completions.create(model='m') == 0
+    assert completions.calls == 1
+
+
+def test_hedged_request_wins():
+    client, completions = make_client([0.5, 0.0])
+    warm_up(client)
+    start = time.monotonic()
+    assert client.chat.completions.create(model='m') == 1
+    assert time.monotonic() - start < 0.4
+    assert client.chat.completions.hedge_wins == 1
+
+
+def test_fast_request_not_hedged():
+    client, completions = make_client([0.0])
+    warm_up(client, tracker_latency=0.2)
+    assert client.chat.completions.create(model='m') == 0
+    assert completions.calls == 1
+
+
+def test_hedging_budget():
+    client, completions = make_client([0.1, 0.1], max_extra_requests=0.0)
+    warm_up(client)
+    assert client.chat.completions.create(model='m') == 0
+    assert completions.calls == 1
+    assert client.chat.completions.hedged_requests == 0
+
+
+def test_hedged_request_primary_fails():
+    client, completions = make_client([0.1, 0.2], errors=(0,))
+    warm_up(client)
+    assert client.chat.completions.create(model='m') == 1
+
+
+def test_hedged_request_both_fail():
+    client, completions = make_client([0.1, 0.0], errors=(0, 1))
+    warm_up(client)
+    with pytest.raises(RuntimeError):
+        client.chat.completions.create(model='m')
+
+
+def test_hedged_client_delegates_attributes():
+    client, _ = make_client([])
+    assert client.models == "models"
+
+
+def test_hedged_usage_estimated():
+    completions = UsageCompletions([0.5, 0.0])
+    client = hedge_client(SimpleNamespace(chat=SimpleNamespace(completions=completions)),
+                          {'percentile': 90, 'max_extra_requests': 1.0, 'min_delay': 0.0, 'min_samples': 5})
+    warm_up(client)
+    response = client.chat.completions.create(model='m')
+    assert response.call == 1
+    # The primary is still running, its tokens are those of the winner
+    assert get_usage(response) == {'prompt_tokens': 10, 'completion_tokens': 2, 'total_tokens': 12,
+                                   'hedged': {'prompt_tokens': 10, 'completion_tokens': 2, 'total_tokens': 12,
+                                              'latency': None, 'estimated': True}}
+
+
+def test_hedged_usage_answered():
+    loser = Future()
+    loser.set_result((SimpleNamespace(usage=SimpleNamespace(prompt_tokens=10, completion_tokens=7, total_tokens=17)), 3.5))
+    response = SimpleNamespace(usage=SimpleNamespace(prompt_tokens=10, completion_tokens=5, total_tokens=15))
+    assert get_hedged_usage(response, loser, 1.0) == {'prompt_tokens': 10, 'completion_tokens': 7, 'total_tokens': 17,
+                                                      'latency': 2.5, 'estimated': False}
+
+    failed = Future()
+    failed.set_exception(RuntimeError("Simulated error"))
+    assert get_hedged_usage(response, failed, 1.0) is None
+    assert get_hedged_usage(SimpleNamespace(), loser, 1.0) is None
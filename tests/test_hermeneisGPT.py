@@ -3,11 +3,15 @@ import argparse
 import sys
 import pytest
 import logging
+import shutil
+import sqlite3
 from os import path
 from unittest.mock import patch
 sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
 from hermeneisGPT import load_and_parse_config
 from hermeneisGPT import main
+from hermeneisGPT import open_translation_db
+from hermeneisGPT import store_translation
 
 
 def test_load_and_parse_config_success(tmp_path):
@@ -43,6 +47,26 @@ def test_load_and_parse_config_success(tmp_path):
     }
 
 
+def test_load_and_parse_config_log_options(tmp_path):
+    path = tmp_path / "config.yaml"
+    path.write_text("""
+    personality:
+      system: system_prompt
+      user: user_prompt
+      model: test_model
+      temperature: "0.5"
+      max_tokens: "100"
+      log:
+        path: output.jsonl
+        level: INFO
+        format: json
+    """, encoding='utf-8')
+
+    config = load_and_parse_config(str(path))
+    assert config['log'] == 'output.jsonl'
+    assert config['logging'] == {'level': 'INFO', 'format': 'json'}
+
+
 # Example of a failure to load due to file not found or other IO issues
 def test_load_and_parse_config_failure(tmp_path):
     non_existent_file_path = tmp_path / "does_not_exist.yaml"
@@ -96,3 +120,27 @@ def test_argument_parsing():
 
             # Verify parse_args was called indicating arguments were parsed
             mock_parse.assert_called()
+
+
+def test_open_translation_db_commits_on_interrupt(tmp_path):
+    db_path = str(tmp_path / "sample.sqlite")
+    shutil.copy('assets/sample.sqlite', db_path)
+    args = argparse.Namespace(sqlite_db=db_path, output_db=None, sqlite_schema='assets/schema.sql')
+    with open_translation_db({}, args) as (connection, cursor, compressor):
+        assert compressor is None
+        cursor.execute("SELECT message_id FROM messages LIMIT 1")
+        message_id = cursor.fetchone()[0]
+        store_translation(cursor, message_id, 1, "Stored before the interrupt")
+        raise KeyboardInterrupt
+    connection = sqlite3.connect(db_path)
+    row = connection.execute("SELECT translation_text, source_sha256 IS NOT NULL FROM message_translation WHERE message_id = ?", (message_id,)).fetchone()
+    connection.close()
+    assert row == ("Stored before the interrupt", 1)
+
+
+def test_main_logs_config_errors_to_default_log(tmp_path):
+    test_args = ["hermeneisGPT.py", "-c", str(tmp_path / "missing.yml"), "-m", "status"]
+    with patch('sys.argv', test_args), patch('lib.log_utils.LOG_DIR', str(tmp_path)):
+        main()
+    log_text = (tmp_path / "hermeneis.log").read_text(encoding='utf-8')
+    assert "ERROR - Exception in main(): [Errno 2] No such file or directory" in log_text
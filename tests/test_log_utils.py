@@ -0,0 +1,78 @@
+# pylint: disable=missing-docstring
+# pylint: disable=line-too-long
+import sys
+import json
+import logging
+import pytest
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from lib.log_utils import JSONFormatter
+from lib.log_utils import DebugSamplingFilter
+from lib.log_utils import parse_log_config
+from lib.log_utils import get_log_path
+from lib.log_utils import setup_logging
+from lib.log_utils import stop_logging
+
+
+def make_record(level=logging.DEBUG, msg="Processing message %s", args=(7,), **extra):
+    record = logging.LogRecord('hermeneis', level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_json_formatter():
+    entry = json.loads(JSONFormatter().format(make_record(message_id=7, channel='noname05716')))
+    assert entry['level'] == 'DEBUG'
+    assert entry['message'] == "Processing message 7"
+    assert entry['message_id'] == 7
+    assert entry['channel'] == 'noname05716'
+    assert 'args' not in entry
+
+
+def test_debug_sampling_filter_sample_rate():
+    log_filter = DebugSamplingFilter(sample_rate=0.0)
+    assert log_filter.filter(make_record()) is False
+    assert log_filter.filter(make_record(level=logging.INFO)) is True
+    assert log_filter.dropped == 1
+
+
+def test_debug_sampling_filter_rate_limit():
+    log_filter = DebugSamplingFilter(rate_limit=3)
+    assert [log_filter.filter(make_record()) for _ in range(5)] == [True, True, True, False, False]
+    assert log_filter.filter(make_record(level=logging.ERROR)) is True
+
+
+def test_parse_log_config():
+    assert parse_log_config("hermeneisGPT.log\n") == ("hermeneisGPT.log", None)
+    assert parse_log_config({'path': 'run.log', 'level': 'info'}) == ("run.log", {'level': 'info'})
+
+
+def test_get_log_path():
+    assert get_log_path("hermeneisGPT.log") == path.join('logs', "hermeneisGPT.log")
+    assert get_log_path("/var/log/hermeneis.log") == "/var/log/hermeneis.log"
+    assert get_log_path("out/run.log") == "out/run.log"
+
+
+def test_setup_logging_json(tmp_path):
+    logger = logging.getLogger('hermeneis.test_setup_logging_json')
+    log_path = tmp_path / "run.jsonl"
+    listener = setup_logging(logger, str(log_path), {'level': 'INFO', 'format': 'json'})
+    try:
+        assert logger.level == logging.INFO
+        logger.debug("Not written")
+        logger.info("Translated message %s", 7, extra={'message_id': 7})
+    finally:
+        stop_logging(logger, listener)
+    assert logger.handlers == []
+    entries = [json.loads(line) for line in log_path.read_text(encoding='utf-8').splitlines()]
+    assert len(entries) == 1
+    assert entries[0]['message'] == "Translated message 7"
+    assert entries[0]['message_id'] == 7
+
+
+def test_setup_logging_invalid_options(tmp_path):
+    logger = logging.getLogger('hermeneis.test_setup_logging_invalid')
+    with pytest.raises(ValueError):
+        setup_logging(logger, str(tmp_path / "run.log"), {'level': 'LOUD'})
+    with pytest.raises(ValueError):
+        setup_logging(logger, str(tmp_path / "run.log"), {'format': 'xml'})
@@ -0,0 +1,104 @@
+# pylint: disable=missing-docstring
+# pylint: disable=line-too-long
+import sys
+import random
+import sqlite3
+import pytest
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from lib.stats_utils import record_request_latencies
+from lib.planner import PlannedRequest
+from lib.planner import LatencyModel
+from lib.planner import get_latency_samples
+from lib.planner import simulate
+from lib.planner import summarize_schedule
+from lib.planner import plan_run
+
+
+def make_requests(count, prompt_tokens=100, completion_tokens=50, reserved_tokens=1100, cost=0.01):
+    return [PlannedRequest(prompt_tokens, completion_tokens, reserved_tokens, cost) for _ in range(count)]
+
+
+def constant_latency(seconds):
+    return LatencyModel(overhead=seconds, seconds_per_token=0.0)
+
+
+def test_get_latency_samples():
+    connection = sqlite3.connect(":memory:")
+    cursor = connection.cursor()
+    with open('assets/schema.sql', 'r') as schema_file:
+        cursor.executescript(schema_file.read())
+    record_request_latencies(cursor, [('gpt-4o-mini', 10, 20, 1.5), ('gpt-4o-mini', 10, None, 9.0), ('gpt-4o', 10, 30, 2.0), ('gpt-4o-mini', 12, 40, 2.5)])
+    assert get_latency_samples(cursor, 'gpt-4o-mini') == [(40, 2.5), (20, 1.5)]
+    assert get_latency_samples(cursor, 'gpt-4o-mini', limit=1) == [(40, 2.5)]
+    connection.close()
+
+
+def test_latency_model_fit():
+    samples = [(tokens, 1.0 + 0.01 * tokens) for tokens in range(0, 1000, 10)]
+    model = LatencyModel(samples)
+    assert model.overhead == pytest.approx(1.0)
+    assert model.seconds_per_token == pytest.approx(0.01)
+    assert model.sample(500, random.Random(1)) == pytest.approx(6.0)
+
+
+def test_latency_model_defaults():
+    model = LatencyModel([(10, 1.0)], min_samples=20, overhead=2.0, seconds_per_token=0.1)
+    assert model.predict(10) == pytest.approx(3.0)
+    # Latencies are never below MIN_LATENCY
+    assert LatencyModel(overhead=-5.0).sample(0, random.Random(1)) > 0
+
+
+def test_simulate_sequential():
+    schedule = simulate(make_requests(3), constant_latency(2.0))
+    assert schedule == [(0.0, 2.0), (2.0, 4.0), (4.0, 6.0)]
+
+
+def test_simulate_concurrency():
+    schedule = simulate(make_requests(4), constant_latency(2.0), {'initial': 2, 'max': 2})
+    assert [start for start, _ in schedule] == [0.0, 0.0, 2.0, 2.0]
+
+
+def test_simulate_concurrency_grows():
+    schedule = simulate(make_requests(50), constant_latency(1.0), {'initial': 1, 'max': 8, 'target_latency': 30})
+    assert max(end for _, end in schedule) < 50
+
+
+def test_simulate_decrease_cooldown():
+    # Slow requests cut the limit once per cooldown of simulated time
+    schedule = simulate(make_requests(18), constant_latency(2.0), {'initial': 8, 'max': 8, 'target_latency': 1, 'cooldown': 5})
+    assert [start for start, _ in schedule] == [0.0] * 8 + [2.0] * 4 + [4.0] * 4 + [6.0] * 2
+
+
+def test_simulate_requests_per_minute():
+    schedule = simulate(make_requests(5), constant_latency(0.1), {'initial': 10, 'max': 10}, requests_per_minute=2)
+    assert [start for start, _ in schedule] == [0.0, 0.0, 60.0, 60.0, 120.0]
+
+
+def test_simulate_tokens_per_minute():
+    schedule = simulate(make_requests(3, reserved_tokens=1000), constant_latency(0.1), {'initial': 10, 'max': 10}, tokens_per_minute=2500)
+    assert [start for start, _ in schedule] == [0.0, 0.0, 60.0]
+    # A request larger than the limit still runs alone
+    assert simulate(make_requests(1, reserved_tokens=5000), constant_latency(0.1), tokens_per_minute=2500) == [(0.0, 0.1)]
+
+
+def test_summarize_schedule():
+    requests = make_requests(3, cost=0.5)
+    curve = summarize_schedule(requests, [(0.0, 10.0), (0.0, 20.0), (60.0, 70.0)])
+    assert curve == [(60.0, 2, 300, 1.0), (120.0, 1, 150, 1.5)]
+    assert summarize_schedule([], []) == []
+
+
+def test_plan_run():
+    plan = plan_run(make_requests(10), constant_latency(30.0), requests_per_minute=5, runs=3, seed=1)
+    assert plan['requests'] == 10
+    assert plan['cost'] == pytest.approx(0.1)
+    assert plan['duration_p50'] == pytest.approx(300.0)
+    assert plan['peak_requests_per_minute'] == 2
+    assert plan['curve'][-1][3] == pytest.approx(0.1)
+
+
+def test_plan_run_empty():
+    plan = plan_run([], constant_latency(1.0))
+    assert plan['duration_p50'] == 0.0
+    assert plan['curve'] == []
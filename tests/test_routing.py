@@ -0,0 +1,144 @@
+# pylint: disable=missing-docstring
+# pylint: disable=line-too-long
+import sys
+import pytest
+from os import path
+from types import SimpleNamespace
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from lib.routing import get_cyrillic_ratio
+from lib.routing import get_text_features
+from lib.routing import validate_translation
+from lib.routing import ModelRouter
+from lib.degeneration import DegenerateOutputError
+
+
+CONFIG = {
+    'system': 'system_prompt',
+    'user': 'user_prompt: ',
+    'model': 'base-model',
+    'temperature': 0.0,
+    'max_tokens': 100,
+}
+
+ROUTING = {
+    'tiers': [
+        {'model': 'cheap', 'max_input_tokens': 10, 'max_technical_terms': 0},
+        {'model': 'medium', 'max_input_tokens': 100, 'max_latin_ratio': 0.5},
+        {'model': 'strong'},
+    ],
+}
+
+
+def count_words(text):
+    return len(text.split())
+
+
+class FakeCompletions:
+    """Answers the translation of each model in order of the answers."""
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.models = []
+
+    def create(self, **kwargs):
+        self.models.append(kwargs['model'])
+        content, finish_reason = self.answers.get(kwargs['model'], ("Translation", 'stop'))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content), finish_reason=finish_reason)], usage=None)
+
+
+def make_client(answers=None):
+    completions = FakeCompletions(answers or {})
+    return SimpleNamespace(chat=SimpleNamespace(completions=completions)), completions
+
+
+def test_get_cyrillic_ratio():
+    assert get_cyrillic_ratio("Привет") == 1.0
+    assert get_cyrillic_ratio("ab вг") == 0.5
+    assert get_cyrillic_ratio("123") == 0.0
+
+
+def test_get_text_features():
+    features = get_text_features("DDoS атака на сервера банка", count_words)
+    assert features['tokens'] == 5
+    assert features['technical_terms'] == 2
+    assert 0.0 < features['latin_ratio'] < 0.5
+
+
+def test_validate_translation():
+    assert validate_translation("Привет", "Hello") is None
+    assert validate_translation("Привет", "  ") == 'empty'
+    assert validate_translation("Привет", None) == 'empty'
+    assert validate_translation("Привет", "Hello", 'length') == 'truncated'
+    assert validate_translation("Привет мир", "Hello мир") == 'untranslated'
+    # Names kept in Cyrillic below the threshold are fine
+    assert validate_translation("Привет", "Hello from the team of NoName057(16) Ж") is None
+    assert validate_translation("Hello", "Привет") is None
+
+
+def test_select_tier():
+    router = ModelRouter(ROUTING, count_words)
+    assert router.select_tier("Слава героям") == 0
+    assert router.select_tier("DDoS атака") == 1
+    assert router.select_tier(" ".join(["слово"] * 50)) == 1
+    assert router.select_tier("DDoS attack on the servers of the bank today") == 2
+    assert router.select_tier(" ".join(["слово"] * 500)) == 2
+
+
+def test_translate_without_escalation():
+    client, completions = make_client()
+    result = ModelRouter(ROUTING, count_words).translate(client, CONFIG, "Слава героям")
+    assert result.translation == "Translation"
+    assert result.model == 'cheap'
+    assert completions.models == ['cheap']
+
+
+def test_translate_escalates_on_validation_failure():
+    client, completions = make_client({'cheap': ("Слава героям", 'stop'), 'medium': ("Glory", 'length')})
+    router = ModelRouter(ROUTING, count_words)
+    result = router.translate(client, CONFIG, "Слава героям")
+    assert result.model == 'strong'
+    assert completions.models == ['cheap', 'medium', 'strong']
+    assert router.stats['escalations:untranslated'] == 1
+    assert router.stats['escalations:truncated'] == 1
+
+
+def test_translate_on_result():
+    client, _ = make_client({'cheap': ("", 'stop')})
+    results = []
+    ModelRouter(ROUTING, count_words).translate(client, CONFIG, "Слава героям", on_result=results.append)
+    assert [result.model for result in results] == ['cheap', 'medium']
+
+
+def test_translate_escalates_degenerate_output():
+    client, completions = make_client()
+
+    def create(**kwargs):
+        completions.models.append(kwargs['model'])
+        if kwargs['model'] == 'cheap':
+            raise DegenerateOutputError('repetition', "Glory glory glory")
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="Glory"), finish_reason='stop')], usage=None)
+
+    completions.create = create
+    router = ModelRouter(ROUTING, count_words)
+    assert router.translate(client, CONFIG, "Слава героям").model == 'medium'
+    assert router.stats['escalations:degenerate'] == 1
+
+    with pytest.raises(DegenerateOutputError):
+        ModelRouter({'tiers': [{'model': 'cheap'}]}, count_words).translate(client, CONFIG, "Слава героям")
+
+
+def test_translate_last_tier():
+    client, _ = make_client({'strong': ("Слава героям", 'stop')})
+    router = ModelRouter({'tiers': [{'model': 'strong'}]}, count_words)
+    assert router.translate(client, CONFIG, "Слава героям").translation == "Слава героям"
+
+    client, _ = make_client({'strong': ("", 'stop')})
+    with pytest.raises(ValueError):
+        router.translate(client, CONFIG, "Слава героям")
+
+
+def test_router_invalid_config():
+    with pytest.raises(ValueError):
+        ModelRouter({'tiers': []}, count_words)
+    with pytest.raises(ValueError):
+        ModelRouter({'tiers': [{'max_input_tokens': 10}]}, count_words)
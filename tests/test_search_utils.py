@@ -0,0 +1,106 @@
+# pylint: disable=missing-docstring
+# pylint: disable=line-too-long
+import sys
+import sqlite3
+import pytest
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from lib.db_utils import upsert_message_translation
+from lib.db_utils import get_text_compressor
+from lib.search_utils import create_search_index
+from lib.search_utils import rebuild_search_index
+from lib.search_utils import search_translations
+
+
+@pytest.fixture
+def db_connection():
+    connection = sqlite3.connect(":memory:")
+    cursor = connection.cursor()
+    cursor.execute("CREATE TABLE channels (channel_id INTEGER PRIMARY KEY, channel_name TEXT UNIQUE)")
+    cursor.execute("CREATE TABLE messages (message_id INTEGER PRIMARY KEY, channel_id INTEGER, message_date TEXT, message_text TEXT)")
+    with open('assets/schema.sql', 'r') as schema_file:
+        cursor.executescript(schema_file.read())
+    cursor.execute("INSERT INTO channels (channel_id, channel_name) VALUES (1, 'noname05716'), (2, 'other')")
+    cursor.execute("INSERT INTO messages VALUES (1, 1, '2024-03-01', 'Атака на банки Литвы')")
+    cursor.execute("INSERT INTO messages VALUES (2, 1, '2024-03-05', 'Атака на сайты Польши')")
+    cursor.execute("INSERT INTO messages VALUES (3, 2, '2024-03-07', 'Новости про банки')")
+    yield connection, cursor
+    connection.close()
+
+
+def test_create_search_index(db_connection):
+    connection, cursor = db_connection
+    assert create_search_index(connection, cursor) is True
+    assert create_search_index(connection, cursor) is False
+
+
+def test_rebuild_search_index(db_connection):
+    connection, cursor = db_connection
+    upsert_message_translation(cursor, 1, 1, "Attack on Lithuanian banks")
+    create_search_index(connection, cursor)
+    assert search_translations(cursor, 'Lithuanian') == []
+    assert rebuild_search_index(connection, cursor) == 1
+    hits = search_translations(cursor, 'Lithuanian')
+    assert len(hits) == 1
+    assert hits[0][:3] == ('noname05716', 1, '2024-03-01')
+    assert hits[0][4] == "Attack on [Lithuanian] banks"
+
+
+def test_search_index_follows_upserts(db_connection):
+    connection, cursor = db_connection
+    create_search_index(connection, cursor)
+    upsert_message_translation(cursor, 1, 1, "Attack on Lithuanian banks")
+    upsert_message_translation(cursor, 2, 1, "Attack on Polish websites")
+    assert [hit[1] for hit in search_translations(cursor, 'attack')] in ([1, 2], [2, 1])
+
+    # Updating a translation replaces its entry in the index
+    upsert_message_translation(cursor, 1, 1, "Assault on Lithuanian banks")
+    assert search_translations(cursor, 'attack')[0][1] == 2
+    assert len(search_translations(cursor, 'attack')) == 1
+    cursor.execute("SELECT COUNT(*) FROM message_translation_fts")
+    assert cursor.fetchone()[0] == 2
+
+    cursor.execute("DELETE FROM message_translation WHERE message_id = 2")
+    assert search_translations(cursor, 'attack') == []
+
+
+def test_search_translations_original_text(db_connection):
+    connection, cursor = db_connection
+    create_search_index(connection, cursor)
+    upsert_message_translation(cursor, 1, 1, "Attack on Lithuanian banks")
+    hits = search_translations(cursor, 'банки')
+    assert hits[0][3] == "Атака на [банки] Литвы"
+
+
+def test_search_translations_filters(db_connection):
+    connection, cursor = db_connection
+    create_search_index(connection, cursor)
+    for message_id in (1, 2, 3):
+        upsert_message_translation(cursor, message_id, 1, "News")
+    assert [hit[1] for hit in search_translations(cursor, 'news', channel_name='other')] == [3]
+    assert sorted(hit[1] for hit in search_translations(cursor, 'news', since='2024-03-02', until='2024-03-07')) == [2]
+    assert len(search_translations(cursor, 'news', limit=2)) == 2
+
+
+def test_search_translations_invalid_query(db_connection):
+    connection, cursor = db_connection
+    create_search_index(connection, cursor)
+    with pytest.raises(sqlite3.OperationalError):
+        search_translations(cursor, 'AND AND')
+
+
+def test_search_index_compressed_translations(db_connection):
+    connection, cursor = db_connection
+    create_search_index(connection, cursor)
+    compressor = get_text_compressor(cursor, {'min_length': 0})
+    # Compressed DBs swap the stored triggers for decompressing TEMP ones
+    assert create_search_index(connection, cursor) is False
+    cursor.execute("SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'message_translation_fts%'")
+    assert cursor.fetchone()[0] == 0
+    upsert_message_translation(cursor, 1, 1, "Attack on the banks of Lithuania, the banks of Lithuania", compressor)
+    upsert_message_translation(cursor, 2, 1, "Attack on the websites of Poland, the websites of Poland", compressor)
+    cursor.execute("SELECT typeof(translation_text) FROM message_translation")
+    assert cursor.fetchall() == [('blob',), ('blob',)]
+    assert [hit[1] for hit in search_translations(cursor, 'Poland')] == [2]
+    assert rebuild_search_index(connection, cursor) == 2
+    assert [hit[1] for hit in search_translations(cursor, 'Lithuania')] == [1]
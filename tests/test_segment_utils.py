@@ -0,0 +1,144 @@
+# pylint: disable=missing-docstring
+# pylint: disable=line-too-long
+import sys
+import re
+import sqlite3
+import pytest
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from lib.segment_utils import split_segments
+from lib.segment_utils import join_segments
+from lib.segment_utils import lookup_segment_translations
+from lib.segment_utils import translate_segments
+from lib.segment_utils import store_segment_translations
+from lib.segment_utils import number_segments
+from lib.segment_utils import parse_numbered_segments
+
+
+FOOTER = "Подписывайтесь на наш канал"
+
+
+@pytest.fixture
+def db_cursor():
+    connection = sqlite3.connect(":memory:")
+    cursor = connection.cursor()
+    with open('assets/schema.sql', 'r') as schema_file:
+        cursor.executescript(schema_file.read())
+    yield cursor
+    connection.close()
+
+
+TRANSLIT = str.maketrans('абвгдеёжзийклмнопрстуфхцчшщъыьэюя', 'abvgdeejziiklmnoprstufhccss_y_eua')
+
+
+def en(text):
+    return f"EN({text.lower().translate(TRANSLIT)})"
+
+
+def fake_translate(text):
+    # Keeps the segment numbers like the models do
+    return '\n'.join(re.sub(r'^(\[\d+\] )?(.*)$', lambda match: (match.group(1) or '') + en(match.group(2)), line)
+                     for line in text.split('\n'))
+
+
+@pytest.mark.parametrize("text,mode", [
+    ("Первая строка\n\nВторая строка\n#хэштег", 'lines'),
+    ("Привет. Как дела? Хорошо!\nНовая строка", 'sentences'),
+    ("\nОдна строка\n", 'lines'),
+])
+def test_split_and_join_segments(text, mode):
+    segments, separators = split_segments(text, mode)
+    assert len(separators) == len(segments) - 1
+    assert join_segments(segments, separators) == text
+
+
+def test_split_segments_sentences():
+    segments, _ = split_segments("Привет. Как дела? Хорошо!", 'sentences')
+    assert segments == ["Привет.", "Как дела?", "Хорошо!"]
+
+
+def test_split_segments_unknown_mode():
+    with pytest.raises(ValueError):
+        split_segments("text", 'paragraphs')
+
+
+def test_translate_segments_all_uncached():
+    segments, separators = split_segments("Первая\n\nВторая", 'lines')
+    translation, new_segments = translate_segments(segments, separators, {}, fake_translate)
+    assert translation == f"{en('Первая')}\n\n{en('Вторая')}"
+    assert new_segments == [("Первая", en("Первая")), ("Вторая", en("Вторая"))]
+
+
+def test_number_and_parse_segments():
+    text = number_segments(["Первая", " Вторая "])
+    assert text == "[1] Первая\n[2] Вторая"
+    assert parse_numbered_segments("[1] First\n\n[2] Second\n", 2) == ["First", "Second"]
+    assert parse_numbered_segments("First\nSecond", 2) is None
+    assert parse_numbered_segments("[2] Second\n[1] First", 2) is None
+    assert parse_numbered_segments("[1] First and second", 2) is None
+
+
+def test_translate_segments_only_sends_uncached():
+    sent = []
+
+    def translate_fn(text):
+        sent.append(text)
+        return fake_translate(text)
+
+    segments, separators = split_segments(f"Новость дня\n{FOOTER}", 'lines')
+    translation, new_segments = translate_segments(segments, separators, {1: "Subscribe to our channel"}, translate_fn)
+    assert sent == ["Новость дня"]
+    assert translation == f"{en('Новость дня')}\nSubscribe to our channel"
+    assert new_segments == [("Новость дня", en("Новость дня"))]
+
+
+def test_translate_segments_not_aligned():
+    segments, separators = split_segments("Первая\nВторая\nТретья", 'lines')
+    translation, new_segments = translate_segments(segments, separators, {2: "Third"}, lambda text: "First and second")
+    assert translation == "First and second\nThird"
+    assert new_segments == []
+
+
+def test_translate_segments_not_numbered():
+    # Same number of lines without the numbering is not trusted
+    segments, separators = split_segments("Первая\nВторая", 'lines')
+    translation, new_segments = translate_segments(segments, separators, {}, lambda text: "Second\nFirst")
+    assert translation == "Second\nFirst"
+    assert new_segments == []
+
+
+def test_translate_segments_skips_untranslated():
+    segments, separators = split_segments("Первая\nВторая", 'lines')
+    translation, new_segments = translate_segments(segments, separators, {}, lambda text: "[1] First\n[2] Вторая")
+    assert translation == "First\nВторая"
+    assert new_segments == [("Первая", "First")]
+
+
+def test_translate_segments_failure():
+    segments, separators = split_segments("Первая\nВторая", 'lines')
+    assert translate_segments(segments, separators, {}, lambda text: None) == (None, [])
+
+
+def test_store_and_lookup_segment_translations(db_cursor):
+    store_segment_translations(db_cursor, 1, [(FOOTER, "Subscribe to our channel")])
+    segments = ["Новость", f"  {FOOTER} ", FOOTER]
+    assert lookup_segment_translations(db_cursor, 1, segments) == {1: "Subscribe to our channel", 2: "Subscribe to our channel"}
+    assert lookup_segment_translations(db_cursor, 2, segments) == {}
+
+
+def test_translate_segments_reuses_stored_footer(db_cursor):
+    sent = []
+
+    def translate_fn(text):
+        sent.append(text)
+        return fake_translate(text)
+
+    translations = []
+    for message_text in (f"Первая новость\n{FOOTER}", f"Вторая новость\n{FOOTER}"):
+        segments, separators = split_segments(message_text)
+        cached = lookup_segment_translations(db_cursor, 1, segments)
+        translation, new_segments = translate_segments(segments, separators, cached, translate_fn)
+        store_segment_translations(db_cursor, 1, new_segments)
+        translations.append(translation)
+    assert translations == [f"{en('Первая новость')}\n{en(FOOTER)}", f"{en('Вторая новость')}\n{en(FOOTER)}"]
+    assert sent == [f"[1] Первая новость\n[2] {FOOTER}", "Вторая новость"]
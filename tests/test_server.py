@@ -0,0 +1,143 @@
+# pylint: disable=missing-docstring
+# pylint: disable=line-too-long
+import sys
+import json
+import time
+import asyncio
+import threading
+from os import path
+from types import SimpleNamespace
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from lib.server import TranslationService
+
+
+CONFIG = {
+    'system': 'system_prompt',
+    'user': 'user_prompt: ',
+    'model': 'test_model',
+    'temperature': 0.0,
+    'max_tokens': 100,
+}
+
+
+class FakeCompletions:
+    """Translates by upper-casing, JSON arrays for batch requests."""
+
+    def __init__(self, delay=0.05, bad_batches=False):
+        self.delay = delay
+        self.bad_batches = bad_batches
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def create(self, **kwargs):
+        text = kwargs['messages'][-1]['content'].removeprefix(CONFIG['user'])
+        with self.lock:
+            self.calls.append(text)
+        time.sleep(self.delay)
+        if text == "fail":
+            raise RuntimeError("Simulated API error")
+        if len(kwargs['messages']) == 3:
+            content = "not json" if self.bad_batches else json.dumps([item.upper() for item in json.loads(text)])
+        else:
+            content = text.upper()
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+
+
+def make_service(delay=0.05, bad_batches=False, **serve_config):
+    completions = FakeCompletions(delay, bad_batches)
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    return TranslationService(client, CONFIG, serve_config), completions
+
+
+def test_coalesce_identical_requests():
+    service, completions = make_service(max_batch_size=1)
+
+    async def run():
+        return await asyncio.gather(*(service.translate("привет") for _ in range(5)))
+
+    assert asyncio.run(run()) == ["ПРИВЕТ"] * 5
+    assert completions.calls == ["привет"]
+    assert service.get_metrics()['coalesced'] == 4
+
+
+def test_micro_batch_short_texts():
+    service, completions = make_service(max_batch_size=3, max_batch_chars=10)
+
+    async def run():
+        return await asyncio.gather(*(service.translate(text) for text in ("a", "b", "c", "d", "long text here")))
+
+    assert asyncio.run(run()) == ["A", "B", "C", "D", "LONG TEXT HERE"]
+    assert sorted(completions.calls) == ['["a", "b", "c"]', 'd', 'long text here']
+    metrics = service.get_metrics()
+    assert metrics['batches'] == 1
+    assert metrics['batched_texts'] == 3
+    assert metrics['upstream_requests'] == 3
+
+
+def test_micro_batch_fallback():
+    service, completions = make_service(bad_batches=True)
+
+    async def run():
+        return await asyncio.gather(service.translate("a"), service.translate("b"))
+
+    assert asyncio.run(run()) == ["A", "B"]
+    assert len(completions.calls) == 3
+    assert service.get_metrics()['batch_fallbacks'] == 1
+
+
+def test_translate_error():
+    service, _ = make_service(max_batch_size=1)
+
+    async def run():
+        return await service.handle_request('POST', '/translate', b'{"text": "fail"}')
+
+    status, payload = asyncio.run(run())
+    assert status == 502
+    assert payload['error'] == "RuntimeError: Simulated API error"
+    assert service.get_metrics()['errors'] == 1
+
+
+def test_handle_request_routes():
+    service, _ = make_service(max_batch_size=1)
+
+    async def run():
+        return [await service.handle_request('POST', '/translate', b'{"texts": ["a", "fail"]}'),
+                await service.handle_request('GET', '/metrics?x=1', b''),
+                await service.handle_request('GET', '/translate', b''),
+                await service.handle_request('POST', '/translate', b'{"text": 1}'),
+                await service.handle_request('POST', '/translate', b'not json'),
+                await service.handle_request('GET', '/other', b'')]
+
+    results = asyncio.run(run())
+    assert results[0][0] == 200
+    assert results[0][1]['translations'] == ["A", None]
+    assert results[0][1]['errors'][1] == "RuntimeError: Simulated API error"
+    assert results[1][0] == 200 and results[1][1]['requests'] == 2
+    assert [status for status, _ in results[2:]] == [405, 400, 400, 404]
+
+
+def test_http_server_keep_alive():
+    service, _ = make_service(delay=0)
+
+    async def run():
+        server = await asyncio.start_server(service.handle_connection, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        responses = []
+        for body in (b'{"text": "da"}', b'{"text": "net"}'):
+            writer.write(b"POST /translate HTTP/1.1\r\nHost: localhost\r\nContent-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body)
+            await writer.drain()
+            status_line = await reader.readline()
+            headers = {}
+            while (line := await reader.readline()) != b'\r\n':
+                name, _, value = line.decode().partition(':')
+                headers[name.lower()] = value.strip()
+            responses.append((status_line, json.loads(await reader.readexactly(int(headers['content-length'])))))
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return responses
+
+    responses = asyncio.run(run())
+    assert responses[0] == (b"HTTP/1.1 200 OK\r\n", {'translation': "DA"})
+    assert responses[1][1] == {'translation': "NET"}
@@ -0,0 +1,92 @@
+# pylint: disable=missing-docstring
+# pylint: disable=line-too-long
+import sys
+import sqlite3
+import pytest
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from lib.shard_utils import resolve_shard_paths
+from lib.shard_utils import scan_shards
+from lib.shard_utils import group_pending_by_text
+from lib.shard_utils import write_shard_translations
+from lib.compression import TextCompressor
+from lib.compression import decompress_text
+from lib.failure_utils import record_translation_failure
+
+
+TRANSLATION_PARAMETERS = ('hermeneisGPT.py', 'abc', 'model', 'sha256', 'config')
+
+
+def create_shard(shard_path, messages):
+    connection = sqlite3.connect(shard_path)
+    connection.execute("CREATE TABLE channels (channel_id INTEGER PRIMARY KEY, channel_name TEXT UNIQUE)")
+    connection.execute("CREATE TABLE messages (message_id INTEGER PRIMARY KEY, channel_id INTEGER, message_text TEXT, message_edit_date TEXT)")
+    connection.execute("INSERT INTO channels (channel_id, channel_name) VALUES (1, 'noname05716')")
+    connection.executemany("INSERT INTO messages (message_id, channel_id, message_text) VALUES (?, 1, ?)", messages)
+    connection.commit()
+    connection.close()
+
+
+@pytest.fixture
+def shards(tmp_path):
+    create_shard(str(tmp_path / "a.sqlite"), [(1, "Общий текст"), (2, "Только в A"), (3, ".")])
+    create_shard(str(tmp_path / "b.sqlite"), [(7, "Общий текст"), (8, "Только в B")])
+    (tmp_path / "notes.txt").write_text("not a shard")
+    return tmp_path
+
+
+def test_resolve_shard_paths_directory(shards):
+    assert resolve_shard_paths(str(shards)) == [str(shards / "a.sqlite"), str(shards / "b.sqlite")]
+
+
+def test_resolve_shard_paths_glob(shards):
+    assert resolve_shard_paths(str(shards / "b*.sqlite")) == [str(shards / "b.sqlite")]
+
+
+def test_resolve_shard_paths_no_match(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        resolve_shard_paths(str(tmp_path / "*.sqlite"))
+
+
+def test_scan_and_group_shards(shards):
+    scans = scan_shards(resolve_shard_paths(str(shards)), 'assets/schema.sql', 'noname05716', TRANSLATION_PARAMETERS, max_workers=2)
+    assert [len(pending) for _, _, pending in scans] == [3, 2]
+
+    texts = group_pending_by_text(scans)
+    assert list(texts) == ["Общий текст", "Только в A", "Только в B"]
+    assert texts["Общий текст"] == [(str(shards / "a.sqlite"), 1), (str(shards / "b.sqlite"), 7)]
+
+
+def test_write_shard_translations(shards):
+    shard_paths = resolve_shard_paths(str(shards))
+    scans = scan_shards(shard_paths, 'assets/schema.sql', 'noname05716', TRANSLATION_PARAMETERS)
+    shard_path, translation_parameters_id, _ = scans[1]
+    connection = sqlite3.connect(shard_path)
+    cursor = connection.cursor()
+    common_text = "Common text. " * 20
+    assert write_shard_translations(cursor, translation_parameters_id, [(7, common_text), (8, "Only in B")],
+                                    compressor=TextCompressor()) == 2
+    connection.commit()
+    stored = dict(cursor.execute("SELECT message_id, translation_text FROM message_translation").fetchall())
+    connection.close()
+    assert isinstance(stored[7], bytes)
+    assert decompress_text(stored[7]) == common_text
+    assert stored[8] == "Only in B"
+
+    # Translated messages are no longer pending
+    scans = scan_shards(shard_paths, 'assets/schema.sql', 'noname05716', TRANSLATION_PARAMETERS)
+    assert scans[1][2] == []
+    assert len(scans[0][2]) == 3
+
+
+def test_scan_shards_skips_failed_messages(shards):
+    shard_paths = resolve_shard_paths(str(shards))
+    scans = scan_shards(shard_paths, 'assets/schema.sql', 'noname05716', TRANSLATION_PARAMETERS)
+    shard_path, translation_parameters_id, _ = scans[0]
+    connection = sqlite3.connect(shard_path)
+    record_translation_failure(connection.cursor(), 2, translation_parameters_id, TimeoutError("timed out"))
+    connection.commit()
+    connection.close()
+
+    scans = scan_shards(shard_paths, 'assets/schema.sql', 'noname05716', TRANSLATION_PARAMETERS)
+    assert [message_id for message_id, _ in scans[0][2]] == [1, 3]
@@ -0,0 +1,166 @@
+# pylint: disable=missing-docstring
+# pylint: disable=line-too-long
+import sys
+import sqlite3
+import pytest
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from lib.db_utils import upsert_message_translation
+from lib.failure_utils import record_translation_failure
+from lib.stats_utils import get_prices
+from lib.stats_utils import get_cost
+from lib.stats_utils import add_usage
+from lib.stats_utils import RequestUsage
+from lib.stats_utils import get_failure_stats
+from lib.stats_utils import get_message_channels
+from lib.stats_utils import increment_translation_stats
+from lib.stats_utils import increment_translated_messages
+from lib.stats_utils import has_translation_stats
+from lib.stats_utils import refresh_channel_stats
+from lib.stats_utils import rebuild_translation_stats
+from lib.stats_utils import get_translation_status
+from collections import Counter
+
+
+PRICING = {
+    'input_price': 0.001,
+    'output_price': 0.002,
+    'models': {'gpt-4o': {'input_price': 0.005}},
+}
+
+
+@pytest.fixture
+def db_cursor():
+    connection = sqlite3.connect(":memory:")
+    cursor = connection.cursor()
+    cursor.execute("CREATE TABLE channels (channel_id INTEGER PRIMARY KEY, channel_name TEXT UNIQUE)")
+    cursor.execute("CREATE TABLE messages (message_id INTEGER PRIMARY KEY, channel_id INTEGER, message_text TEXT)")
+    with open('assets/schema.sql', 'r') as schema_file:
+        cursor.executescript(schema_file.read())
+    cursor.execute("INSERT INTO channels (channel_id, channel_name) VALUES (1, 'noname05716'), (2, 'other')")
+    cursor.execute("INSERT INTO messages VALUES (1, 1, 'Первое'), (2, 1, 'Второе'), (3, 1, 'Третье'), (4, 2, 'Четвёртое')")
+    cursor.execute("INSERT INTO translation_parameters (translation_parameters_id, translation_model) VALUES (1, 'gpt-4o-mini')")
+    yield cursor
+    connection.close()
+
+
+def test_get_prices():
+    assert get_prices(None, 'gpt-4o') == (0.0005, 0.0015)
+    assert get_prices(PRICING, 'gpt-4o-mini') == (0.001, 0.002)
+    assert get_prices(PRICING, 'gpt-4o ') == (0.005, 0.002)
+
+
+def test_get_cost_and_add_usage():
+    assert get_cost(PRICING, 'gpt-4o-mini', 1000, 500) == pytest.approx(0.002)
+    totals = Counter()
+    add_usage(totals, PRICING, 'gpt-4o-mini', {'prompt_tokens': 1000, 'completion_tokens': 500, 'total_tokens': 1500})
+    add_usage(totals, PRICING, 'gpt-4o-mini', None)
+    assert totals['prompt_tokens'] == 1000
+    assert totals['completion_tokens'] == 500
+    assert totals['cost'] == pytest.approx(0.002)
+
+
+def test_request_usage():
+    usage = RequestUsage()
+    usage.add(PRICING, 'gpt-4o-mini', {'prompt_tokens': 1000, 'completion_tokens': 500, 'total_tokens': 1500}, 1.5)
+    usage.add(PRICING, 'gpt-4o', None, 0.5)
+    assert usage.totals['prompt_tokens'] == 1000
+    assert usage.latencies == [('gpt-4o-mini', 1000, 500, 1.5), ('gpt-4o', None, None, 0.5)]
+
+
+def test_request_usage_hedged():
+    usage = RequestUsage()
+    hedged = {'prompt_tokens': 1000, 'completion_tokens': 400, 'total_tokens': 1400, 'latency': 3.0, 'estimated': False}
+    usage.add(PRICING, 'gpt-4o-mini', {'prompt_tokens': 1000, 'completion_tokens': 500, 'total_tokens': 1500, 'hedged': hedged}, 1.5)
+    estimated = dict(hedged, latency=None, estimated=True)
+    usage.add(PRICING, 'gpt-4o-mini', {'prompt_tokens': 1000, 'completion_tokens': 500, 'total_tokens': 1500, 'hedged': estimated}, 1.0)
+    assert usage.totals['prompt_tokens'] == 4000
+    assert usage.totals['completion_tokens'] == 1800
+    assert usage.latencies == [('gpt-4o-mini', 1000, 500, 1.5), ('gpt-4o-mini', 1000, 400, 3.0), ('gpt-4o-mini', 1000, 500, 1.0)]
+
+
+def test_get_failure_stats():
+    assert get_failure_stats(1, 5) == (1, 0)
+    assert get_failure_stats(3, 5) == (0, 0)
+    assert get_failure_stats(5, 5) == (-1, 1)
+    assert get_failure_stats(1, 1) == (0, 1)
+
+
+def test_get_message_channels(db_cursor):
+    assert get_message_channels(db_cursor, [1, 4, 99]) == {1: 1, 4: 2}
+    assert get_message_channels(db_cursor, []) == {}
+
+
+def test_increment_translation_stats(db_cursor):
+    increment_translation_stats(db_cursor, 1, 1, translated_count=1, prompt_tokens=10, completion_tokens=5, cost=0.5)
+    increment_translation_stats(db_cursor, 1, 1, translated_count=1, failed_count=-1)
+    db_cursor.execute("SELECT translated_count, failed_count, skipped_count, prompt_tokens, completion_tokens, cost FROM translation_stats")
+    assert db_cursor.fetchall() == [(2, -1, 0, 10, 5, 0.5)]
+
+    with pytest.raises(ValueError):
+        increment_translation_stats(db_cursor, 1, 1, unknown_count=1)
+
+
+def test_increment_translated_messages(db_cursor):
+    increment_translated_messages(db_cursor, 1, [1, 2, 4], {'prompt_tokens': 7, 'completion_tokens': 3, 'cost': 0.1})
+    db_cursor.execute("SELECT channel_id, translated_count, prompt_tokens FROM translation_stats ORDER BY channel_id")
+    assert db_cursor.fetchall() == [(1, 2, 7), (2, 1, 0)]
+
+
+def test_refresh_channel_stats(db_cursor):
+    assert has_translation_stats(db_cursor) is False
+    assert refresh_channel_stats(db_cursor) == 2
+    assert has_translation_stats(db_cursor) is True
+    # Only the new messages are counted
+    db_cursor.execute("INSERT INTO messages VALUES (5, 2, 'Пятое')")
+    refresh_channel_stats(db_cursor)
+    refresh_channel_stats(db_cursor)
+    db_cursor.execute("SELECT channel_id, message_count, last_message_id FROM channel_stats ORDER BY channel_id")
+    assert db_cursor.fetchall() == [(1, 3, 3), (2, 2, 5)]
+
+
+def test_refresh_channel_stats_overlapping_ids():
+    # Message IDs are per channel, as in Telegram
+    connection = sqlite3.connect(":memory:")
+    cursor = connection.cursor()
+    cursor.execute("CREATE TABLE messages (id INTEGER PRIMARY KEY, message_id INTEGER, channel_id INTEGER, message_text TEXT, UNIQUE(message_id, channel_id))")
+    with open('assets/schema.sql', 'r') as schema_file:
+        cursor.executescript(schema_file.read())
+    cursor.executemany("INSERT INTO messages (message_id, channel_id, message_text) VALUES (?, 1, 'text')", [(i,) for i in range(1, 501)])
+    cursor.executemany("INSERT INTO messages (message_id, channel_id, message_text) VALUES (?, 2, 'text')", [(i,) for i in range(1, 11)])
+    refresh_channel_stats(cursor)
+    cursor.executemany("INSERT INTO messages (message_id, channel_id, message_text) VALUES (?, 2, 'text')", [(i,) for i in range(11, 111)])
+    assert refresh_channel_stats(cursor) == 1
+    cursor.execute("SELECT channel_id, message_count, last_message_id FROM channel_stats ORDER BY channel_id")
+    assert cursor.fetchall() == [(1, 500, 500), (2, 110, 110)]
+    connection.close()
+
+
+def test_rebuild_translation_stats(db_cursor):
+    upsert_message_translation(db_cursor, 1, 1, "First")
+    upsert_message_translation(db_cursor, 4, 1, "Fourth")
+    record_translation_failure(db_cursor, 2, 1, ValueError("Empty"))
+    for _ in range(3):
+        record_translation_failure(db_cursor, 3, 1, ValueError("Empty"))
+    increment_translation_stats(db_cursor, 1, 1, translated_count=10, prompt_tokens=100, cost=1.5)
+
+    rebuild_translation_stats(db_cursor, max_attempts=3)
+
+    db_cursor.execute("SELECT channel_id, translated_count, failed_count, skipped_count, prompt_tokens, cost FROM translation_stats ORDER BY channel_id")
+    assert db_cursor.fetchall() == [(1, 1, 1, 1, 100, 1.5), (2, 1, 0, 0, 0, 0.0)]
+
+
+def test_get_translation_status(db_cursor):
+    increment_translation_stats(db_cursor, 1, 1, translated_count=1, failed_count=1, prompt_tokens=10, completion_tokens=5, cost=0.25)
+    refresh_channel_stats(db_cursor)
+
+    status = get_translation_status(db_cursor)
+    assert [(entry['channel_name'], entry['translation_parameters_id'], entry['pending_count']) for entry in status] == [
+        ('noname05716', 1, 1),
+        ('other', None, 1),
+    ]
+    assert status[0]['translation_model'] == 'gpt-4o-mini'
+    assert status[0]['cost'] == 0.25
+    assert status[1]['translated_count'] == 0
+
+    assert [entry['channel_name'] for entry in get_translation_status(db_cursor, 'other')] == ['other']
@@ -0,0 +1,75 @@
+# pylint: disable=missing-docstring
+# pylint: disable=line-too-long
+import sys
+import sqlite3
+import pytest
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from lib.db_utils import insert_translation_parameters
+from lib.db_utils import upsert_message_translation
+from lib.token_budget import get_translation_samples
+from lib.token_budget import learn_output_ratio
+from lib.token_budget import build_token_budget
+from lib.token_budget import TokenBudget
+
+
+class WordEncoding:
+    """One token per word, tiktoken needs to download its encodings."""
+
+    def encode(self, text):
+        return text.split()
+
+
+@pytest.fixture
+def db_connection():
+    connection = sqlite3.connect(":memory:")
+    cursor = connection.cursor()
+    cursor.execute("CREATE TABLE channels (channel_id INTEGER PRIMARY KEY, channel_name TEXT UNIQUE)")
+    cursor.execute("CREATE TABLE messages (message_id INTEGER PRIMARY KEY, channel_id INTEGER, message_text TEXT)")
+    with open('assets/schema.sql', 'r') as schema_file:
+        cursor.executescript(schema_file.read())
+    translation_parameters_id = insert_translation_parameters(cursor, 'hermeneisGPT.py', 'abc', 'model', 'sha256', 'config')
+    other_parameters_id = insert_translation_parameters(cursor, 'hermeneisGPT.py', 'abc', 'other', 'sha256', 'config')
+    for message_id in range(1, 31):
+        cursor.execute("INSERT INTO messages VALUES (?, 1, ?)", (message_id, ' '.join(['слово'] * 10)))
+        upsert_message_translation(cursor, message_id, translation_parameters_id, ' '.join(['word'] * (12 if message_id % 10 else 20)))
+    upsert_message_translation(cursor, 1, other_parameters_id, "word")
+    yield connection, cursor
+    connection.close()
+
+
+def test_get_translation_samples(db_connection):
+    _, cursor = db_connection
+    assert len(get_translation_samples(cursor, 'model')) == 30
+    assert len(get_translation_samples(cursor, 'model', sample_size=5)) == 5
+    assert get_translation_samples(cursor, 'other') == [(' '.join(['слово'] * 10), "word")]
+
+
+def test_learn_output_ratio():
+    samples = [("a b c d e f g h i j", "a b c d e f g h i j k l")] * 9 + [("a b c d e f g h i j", " ".join(["w"] * 20))]
+    assert learn_output_ratio(WordEncoding(), samples, percentile=50, min_samples=5) == 1.2
+    assert learn_output_ratio(WordEncoding(), samples, percentile=95, min_samples=5) == 2.0
+    assert learn_output_ratio(WordEncoding(), samples, min_samples=20) is None
+    # Short messages are not used
+    assert learn_output_ratio(WordEncoding(), [("a b", "a b c d e f")] * 30) is None
+
+
+def test_token_budget_get_max_tokens():
+    budget = TokenBudget(WordEncoding(), {'margin': 0.5, 'min_tokens': 10, 'max_tokens': 100}, ratio=2.0)
+    assert budget.get_max_tokens("") == 10
+    assert budget.get_max_tokens("a b c d") == 22
+    assert budget.get_max_tokens(" ".join(["a"] * 50)) == 100
+
+
+def test_build_token_budget_learns_ratio(db_connection):
+    _, cursor = db_connection
+    budget = build_token_budget(WordEncoding(), {'percentile': 50}, cursor, 'model')
+    assert budget.ratio == 1.2
+    budget = build_token_budget(WordEncoding(), {'percentile': 100}, cursor, 'model')
+    assert budget.ratio == 2.0
+
+
+def test_build_token_budget_default_ratio(db_connection):
+    _, cursor = db_connection
+    assert build_token_budget(WordEncoding(), {'default_ratio': 1.7}, cursor, 'other').ratio == 1.7
+    assert build_token_budget(WordEncoding(), None).ratio == 1.5
@@ -0,0 +1,78 @@
+# pylint: disable=missing-docstring
+# pylint: disable=line-too-long
+import os
+import sys
+import pytest
+from os import path
+from unittest.mock import patch
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from lib import tokenizer
+from lib.tokenizer import ApproximateEncoding
+from lib.tokenizer import TokenizerRegistry
+
+
+class FakeEncoding:
+    def __init__(self, name):
+        self.name = name
+
+    def encode(self, text):
+        return text.split()
+
+
+@pytest.fixture(autouse=True)
+def restore_environment():
+    environ = dict(os.environ)
+    yield
+    os.environ.clear()
+    os.environ.update(environ)
+    tokenizer._registry = None
+
+
+def test_get_encoding_name():
+    registry = TokenizerRegistry({'models': {'local-model': 'o200k_base'}, 'fallback_encoding': 'p50k_base'})
+    assert registry.get_encoding_name('gpt-3.5-turbo-1106\n') == 'cl100k_base'
+    assert registry.get_encoding_name('local-model') == 'o200k_base'
+    assert registry.get_encoding_name('unknown-model') == 'p50k_base'
+
+
+def test_get_encoding_loaded_once():
+    registry = TokenizerRegistry()
+    with patch('lib.tokenizer.tiktoken.get_encoding', side_effect=FakeEncoding) as get_encoding:
+        first = registry.get_encoding('gpt-3.5-turbo')
+        second = registry.get_encoding('gpt-4')
+        assert first is second
+        assert first.name == 'cl100k_base'
+        assert registry.count_tokens('gpt-4', "два слова") == 2
+    get_encoding.assert_called_once_with('cl100k_base')
+
+
+def test_load_encoding_fallback():
+    def get_encoding(name):
+        if name == 'o200k_base':
+            raise ConnectionError("offline")
+        return FakeEncoding(name)
+
+    registry = TokenizerRegistry()
+    with patch('lib.tokenizer.tiktoken.get_encoding', side_effect=get_encoding):
+        assert registry.get_encoding('gpt-4o').name == 'cl100k_base'
+
+
+def test_load_encoding_approximate():
+    registry = TokenizerRegistry()
+    with patch('lib.tokenizer.tiktoken.get_encoding', side_effect=ConnectionError("offline")):
+        encoding = registry.get_encoding('gpt-4o')
+    assert isinstance(encoding, ApproximateEncoding)
+    assert len(encoding.encode("abcdefgh")) == 2
+    assert len(encoding.encode("привет")) == 3
+
+
+def test_cache_dir(tmp_path):
+    TokenizerRegistry({'cache_dir': str(tmp_path)})
+    assert os.environ['TIKTOKEN_CACHE_DIR'] == str(tmp_path)
+
+
+def test_shared_registry(tmp_path):
+    registry = tokenizer.configure_tokenizer({'cache_dir': str(tmp_path)})
+    assert tokenizer.get_tokenizer() is registry
+    tokenizer._registry = None
+    assert tokenizer.get_tokenizer() is tokenizer.get_tokenizer()
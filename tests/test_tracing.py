@@ -0,0 +1,92 @@
+# pylint: disable=missing-docstring
+# pylint: disable=line-too-long
+import sys
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from lib import tracing
+from lib.tracing import Tracer
+from lib.tracing import SamplingProfiler
+
+
+def test_span_disabled():
+    tracing._tracer = None
+    with tracing.span('nothing'):
+        pass
+    assert tracing.get_tracer() is None
+
+
+def test_span_enabled(tmp_path):
+    tracer = tracing.enable_tracing()
+    try:
+        with tracing.span('outer', channel='noname05716'):
+            with tracing.span('inner'):
+                time.sleep(0.01)
+        def worker():
+            with tracing.span('in_thread'):
+                pass
+        thread = threading.Thread(target=worker, name='worker-thread')
+        thread.start()
+        thread.join()
+    finally:
+        tracing._tracer = None
+
+    trace_path = tmp_path / "trace.json"
+    tracer.write(str(trace_path))
+    trace = json.loads(trace_path.read_text())
+    events = {event['name']: event for event in trace['traceEvents'] if event['ph'] == 'X'}
+    assert set(events) == {'outer', 'inner', 'in_thread'}
+    assert events['outer']['args'] == {'channel': 'noname05716'}
+    assert events['inner']['dur'] >= 10000
+    assert events['outer']['ts'] <= events['inner']['ts']
+    assert events['outer']['dur'] >= events['inner']['dur']
+    assert events['in_thread']['tid'] != events['outer']['tid']
+    assert {event['args']['name'] for event in trace['traceEvents'] if event['ph'] == 'M'} == {'MainThread', 'worker-thread'}
+
+
+def test_span_records_exceptions():
+    tracer = Tracer()
+    try:
+        with tracer.span('failing'):
+            raise ValueError("boom")
+    except ValueError:
+        pass
+    assert [event['name'] for event in tracer.get_trace()['traceEvents'] if event['ph'] == 'X'] == ['failing']
+
+
+def busy_function(seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        pass
+
+
+def test_sampling_profiler(tmp_path):
+    profiler = SamplingProfiler(interval=0.001)
+    profiler.start()
+    busy_function(0.1)
+    profiler.stop()
+    profile_path = tmp_path / "profile.folded"
+    profiler.write(str(profile_path))
+    lines = profile_path.read_text().splitlines()
+    assert any(line.startswith('MainThread;') and 'busy_function (test_tracing.py' in line for line in lines)
+    assert all(int(line.rsplit(' ', 1)[1]) > 0 for line in lines)
+
+
+def test_sampling_profiler_skips_idle_threads(tmp_path):
+    idle = threading.Event()
+    waiter = threading.Thread(target=idle.wait, name='waiter')
+    waiter.start()
+    executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='idle-pool')
+    executor.submit(lambda: None).result()
+    profiler = SamplingProfiler(interval=0.001)
+    profiler.start()
+    busy_function(0.1)
+    profiler.stop()
+    idle.set()
+    waiter.join()
+    executor.shutdown()
+    assert any(stack.startswith('MainThread;') for stack in profiler.samples)
+    assert not any(stack.startswith(('waiter', 'idle-pool')) for stack in profiler.samples)
@@ -0,0 +1,271 @@
+# pylint: disable=missing-docstring
+# pylint: disable=line-too-long
+import sys
+import asyncio
+import pytest
+from os import path
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from lib.translator import build_translation_messages
+from lib.translator import get_usage
+from lib.translator import request_translation
+from lib.translator import parse_batch_translation
+from lib.translator import request_batch_translation
+from lib.translator import translate_many
+from lib.translator import complete_translation
+from lib.translator import stream_translation
+from lib.translator import get_target_languages
+from lib.translator import parse_languages_translation
+from lib.translator import request_languages_translation
+from lib.degeneration import DegenerateOutputError
+from lib.hedging import hedge_client
+
+
+CONFIG = {
+    'system': 'system_prompt',
+    'user': 'user_prompt: ',
+    'model': 'test_model',
+    'temperature': 0.0,
+    'max_tokens': 100,
+}
+
+
+def make_response(content, prompt_tokens=10, completion_tokens=5):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+                           usage=SimpleNamespace(prompt_tokens=prompt_tokens,
+                                                 completion_tokens=completion_tokens,
+                                                 total_tokens=prompt_tokens + completion_tokens))
+
+
+class FakeStream:
+    """Streams the answers word by word, one answer per request."""
+
+    def __init__(self, words, usage=True):
+        self.chunks = [SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word + ' '), finish_reason=None)], usage=None)
+                       for word in words]
+        self.chunks.append(SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=None), finish_reason='stop')], usage=None))
+        if usage:
+            self.chunks.append(SimpleNamespace(choices=[], usage=SimpleNamespace(prompt_tokens=10, completion_tokens=len(words), total_tokens=10 + len(words))))
+        self.consumed = 0
+        self.closed = False
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.consumed += 1
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+class FakeStreamingCompletions:
+
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.streams = []
+        self.temperatures = []
+
+    def create(self, **kwargs):
+        assert kwargs['stream'] is True
+        self.temperatures.append(kwargs['temperature'])
+        stream = FakeStream(self.answers.pop(0).split(' '))
+        self.streams.append(stream)
+        return stream
+
+
+class FakeAsyncCompletions:
+    """Translates by upper-casing, the delay is given in the text."""
+
+    def __init__(self, fail_on=None):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.fail_on = fail_on
+
+    async def create(self, **kwargs):
+        text = kwargs['messages'][-1]['content'].removeprefix(CONFIG['user'])
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(float(text.split(':')[1]))
+            if text == self.fail_on:
+                raise RuntimeError("Simulated API error")
+            return make_response(text.upper())
+        finally:
+            self.in_flight -= 1
+
+
+def make_async_client(fail_on=None):
+    completions = FakeAsyncCompletions(fail_on)
+    return SimpleNamespace(chat=SimpleNamespace(completions=completions)), completions
+
+
+async def collect(generator):
+    return [item async for item in generator]
+
+
+def test_build_translation_messages():
+    assert build_translation_messages(CONFIG, "текст") == [
+        {"role": "system", "content": "system_prompt"},
+        {"role": "user", "content": "user_prompt: текст"},
+    ]
+    assert build_translation_messages(CONFIG, "текст", "hint")[1] == {"role": "system", "content": "hint"}
+
+
+def test_get_usage():
+    assert get_usage(make_response("x", 3, 4)) == {'prompt_tokens': 3, 'completion_tokens': 4, 'total_tokens': 7}
+    assert get_usage(SimpleNamespace(usage=None)) is None
+
+
+def test_request_translation():
+    client = MagicMock()
+    client.chat.completions.create.return_value = make_response("text")
+    assert request_translation(client, CONFIG, "текст") == ("text", {'prompt_tokens': 10, 'completion_tokens': 5, 'total_tokens': 15})
+    kwargs = client.chat.completions.create.call_args.kwargs
+    assert kwargs['model'] == 'test_model'
+    assert kwargs['max_tokens'] == 100
+
+    request_translation(client, CONFIG, "текст", max_tokens=42)
+    assert client.chat.completions.create.call_args.kwargs['max_tokens'] == 42
+
+
+def test_stream_translation():
+    completions = FakeStreamingCompletions(["Hello to the whole team"])
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    result = stream_translation(client, dict(CONFIG, streaming={'retries': 0}), "Привет всей команде")
+    assert result.translation.strip() == "Hello to the whole team"
+    assert result.usage == {'prompt_tokens': 10, 'completion_tokens': 5, 'total_tokens': 15}
+    assert result.finish_reason == 'stop'
+    assert completions.streams[0].closed
+
+
+def test_stream_translation_hedged_client():
+    completions = FakeStreamingCompletions(["Hello to the whole team"])
+    client = hedge_client(SimpleNamespace(chat=SimpleNamespace(completions=completions)),
+                          {'percentile': 50, 'max_extra_requests': 1.0, 'min_delay': 0.0, 'min_samples': 1})
+    client.chat.completions.tracker.record(0.0)
+    result = stream_translation(client, dict(CONFIG, streaming={'retries': 0}), "Привет всей команде")
+    assert result.translation.strip() == "Hello to the whole team"
+    # Sent once, not raced, and its latency is not recorded
+    assert len(completions.streams) == 1
+    assert completions.streams[0].closed
+    assert client.chat.completions.requests == 0
+    assert client.chat.completions.hedged_requests == 0
+    assert list(client.chat.completions.tracker.latencies) == [0.0]
+
+
+def test_stream_translation_aborts_degenerate_output():
+    completions = FakeStreamingCompletions(["Glory " + "to the heroes " * 100])
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    with pytest.raises(DegenerateOutputError) as exc_info:
+        stream_translation(client, dict(CONFIG, streaming={'retries': 0}), "Слава героям")
+    assert exc_info.value.reason in ('repetition', 'length')
+    assert completions.streams[0].consumed < len(completions.streams[0].chunks) / 2
+    assert completions.streams[0].closed
+
+
+def test_complete_translation_retries_degenerate_output():
+    completions = FakeStreamingCompletions(["Glory " + "to the heroes " * 100, "Glory to the heroes"])
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    config = dict(CONFIG, streaming={'retries': 1, 'retry_temperature': 0.5})
+    assert complete_translation(client, config, "Слава героям").translation.strip() == "Glory to the heroes"
+    assert completions.temperatures == [0.0, 0.5]
+
+    completions = FakeStreamingCompletions(["Glory " + "to the heroes " * 100] * 2)
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    with pytest.raises(DegenerateOutputError):
+        complete_translation(client, config, "Слава героям")
+
+
+def test_parse_batch_translation():
+    assert parse_batch_translation('["one", "two"]', 2) == ["one", "two"]
+    assert parse_batch_translation('```json\n["one"]\n```', 1) == ["one"]
+    for content in ('["one"]', '{"a": "one"}', '[1, 2]', 'one, two', None):
+        with pytest.raises(ValueError):
+            parse_batch_translation(content, 2)
+
+
+def test_request_batch_translation():
+    client = MagicMock()
+    client.chat.completions.create.return_value = make_response('["one", "two"]')
+    assert request_batch_translation(client, CONFIG, ["один", "два"])[0] == ["one", "two"]
+    messages = client.chat.completions.create.call_args.kwargs['messages']
+    assert messages[-1]['content'] == 'user_prompt: ["один", "два"]'
+
+
+def test_get_target_languages():
+    assert get_target_languages(CONFIG) == []
+    assert get_target_languages(dict(CONFIG, languages=[" English", "Czech "])) == ["English", "Czech"]
+    for languages in ("English", ["English", ""], ["English", "English"], [1]):
+        with pytest.raises(ValueError):
+            get_target_languages(dict(CONFIG, languages=languages))
+
+
+def test_parse_languages_translation():
+    assert parse_languages_translation('{"English": "Hello", "Czech": "Ahoj"}', ["English", "Czech"]) == {"English": "Hello", "Czech": "Ahoj"}
+    assert parse_languages_translation('```json\n{"english": "Hello"}\n```', ["English"]) == {"English": "Hello"}
+    for content in ('{"English": "Hello"}', '{"English": "Hello", "Czech": ""}', '["Hello", "Ahoj"]', 'Hello', None):
+        with pytest.raises(ValueError):
+            parse_languages_translation(content, ["English", "Czech"])
+
+
+def test_request_languages_translation():
+    client = MagicMock()
+    client.chat.completions.create.return_value = make_response('{"English": "Hello", "Czech": "Ahoj"}')
+    result = request_languages_translation(client, CONFIG, "Привет", ["English", "Czech"])
+    assert result.translation == {"English": "Hello", "Czech": "Ahoj"}
+    assert result.usage['prompt_tokens'] == 10
+    kwargs = client.chat.completions.create.call_args.kwargs
+    # One request for both languages, with max_tokens for each
+    assert client.chat.completions.create.call_count == 1
+    assert kwargs['max_tokens'] == 200
+    assert "English, Czech" in kwargs['messages'][1]['content']
+    assert kwargs['messages'][-1]['content'] == 'user_prompt: Привет'
+
+
+def test_translate_many_completion_order():
+    client, completions = make_async_client()
+    messages = [(1, "a:0.05"), (2, "b:0.0"), (3, "c:0.02")]
+    results = asyncio.run(collect(translate_many(client, CONFIG, messages, concurrency=3)))
+    assert [result[0] for result in results] == [2, 3, 1]
+    assert results[0][1] == "B:0.0"
+    assert results[0][2]['total_tokens'] == 15
+    assert completions.max_in_flight == 3
+
+
+def test_translate_many_ordered():
+    client, _ = make_async_client()
+    messages = [(1, "a:0.05"), (2, "b:0.0"), (3, "c:0.02")]
+    results = asyncio.run(collect(translate_many(client, CONFIG, messages, concurrency=3, ordered=True)))
+    assert [result[0] for result in results] == [1, 2, 3]
+
+
+def test_translate_many_bounded_concurrency():
+    client, completions = make_async_client()
+    messages = ((i, "m:0.001") for i in range(20))
+    results = asyncio.run(collect(translate_many(client, CONFIG, messages, concurrency=4)))
+    assert len(results) == 20
+    assert completions.max_in_flight == 4
+
+
+def test_translate_many_async_iterable():
+    client, _ = make_async_client()
+
+    async def messages():
+        for i in range(3):
+            yield i, f"m{i}:0"
+
+    results = asyncio.run(collect(translate_many(client, CONFIG, messages(), ordered=True)))
+    assert results[2][:2] == (2, "M2:0")
+
+
+def test_translate_many_failure():
+    client, _ = make_async_client(fail_on="b:0")
+    results = asyncio.run(collect(translate_many(client, CONFIG, [(1, "a:0"), (2, "b:0")], ordered=True)))
+    assert results[1] == (2, None, None)
+
+
+def test_translate_many_invalid_concurrency():
+    client, _ = make_async_client()
+    with pytest.raises(ValueError):
+        asyncio.run(collect(translate_many(client, CONFIG, [], concurrency=0)))